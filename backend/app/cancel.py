@@ -1,62 +1,190 @@
 # app/cancel.py
 # -*- coding: utf-8 -*-
 import os
+import time
+import select
 import signal
 import threading
-from typing import Dict, Set, Optional
+import contextlib
+from typing import Dict, FrozenSet, Iterator, List, Set, Optional
 from subprocess import Popen
 
 # 记录“请求取消”的任务 & 正在运行的子进程
-_STOP_REQ: Set[int] = set()
-_PROCS: Dict[int, Set[Popen]] = {}
+# _STOP_REQ 采用写时复制的 frozenset：写者在 _LOCK 下整体替换引用，读者无需加锁
+_STOP_REQ: FrozenSet[int] = frozenset()
 _LOCK = threading.RLock()
 
-def request_stop(task_id: int) -> None:
-    """标记取消并尽最大努力终止该任务名下所有子进程（整组）"""
-    with _LOCK:
-        _STOP_REQ.add(task_id)
-        procs = list(_PROCS.get(task_id, set()))
-    # 进程组杀掉（优先 TERM，短暂等待后 KILL）
-    for p in procs:
+# _PROCS 按 task_id 分片，每片独立加锁，避免不相关任务互相争用
+_SHARDS = 16
+_PROCS: List[Dict[int, Set[Popen]]] = [{} for _ in range(_SHARDS)]
+_PROC_LOCKS = [threading.Lock() for _ in range(_SHARDS)]
+
+# 取消事件 eventfd（仅 Linux）：task_id -> [fd, 引用计数]，由 _LOCK 保护；
+# request_stop 写入后 fd 常为可读，等待方可与 pidfd 一起 poll，无需定时轮询 stop 标记
+_STOP_FDS: Dict[int, List[int]] = {}
+
+def _shard(task_id: int) -> int:
+    return task_id % _SHARDS
+
+def _killpg(p: Popen, sig: int) -> None:
+    """
+    与 utils._kill_group 同一规则：子进程以 setsid 启动，pgid 即 p.pid，直接 killpg(p.pid)，
+    不先 getpgid（两次调用之间号可能被回收复用）；已回收（returncode 已设置）的不再发信号。
+    """
+    if p.returncode is not None:
+        return
+    try:
+        os.killpg(p.pid, sig)
+    except OSError:
+        pass
+
+def _wait_all(procs: List[Popen], timeout: float) -> List[Popen]:
+    """
+    在同一个截止时间内并发等待多个子进程退出，返回超时后仍存活的进程。
+    - Linux：pidfd_open + poll，事件驱动，一次等待所有进程
+    - BSD/macOS：kqueue 监听 NOTE_EXIT
+    - 其它平台：共享截止时间逐个 wait(timeout)
+    """
+    deadline = time.monotonic() + timeout
+    alive = [p for p in procs if p.poll() is None]
+    if not alive:
+        return []
+
+    if hasattr(os, "pidfd_open") and hasattr(select, "poll"):
+        poller = select.poll()
+        fds: Dict[int, Popen] = {}
+        try:
+            for p in alive:
+                try:
+                    fd = os.pidfd_open(p.pid)
+                except OSError:
+                    continue  # 已退出/已被回收
+                fds[fd] = p
+                poller.register(fd, select.POLLIN)
+            while fds:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                for fd, _ in poller.poll(int(remaining * 1000) + 1):
+                    p = fds.pop(fd, None)
+                    poller.unregister(fd)
+                    os.close(fd)
+                    if p is not None:
+                        try:
+                            p.wait(0)
+                        except Exception:
+                            pass
+        finally:
+            for fd in fds:
+                os.close(fd)
+        return [p for p in alive if p.poll() is None]
+
+    if hasattr(select, "kqueue"):
+        kq = select.kqueue()
+        try:
+            pending: Dict[int, Popen] = {}
+            for p in alive:
+                ev = select.kevent(p.pid, filter=select.KQ_FILTER_PROC,
+                                   flags=select.KQ_EV_ADD | select.KQ_EV_ONESHOT,
+                                   fflags=select.KQ_NOTE_EXIT)
+                try:
+                    kq.control([ev], 0, 0)
+                except OSError:
+                    continue
+                pending[p.pid] = p
+            while pending:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                for ev in kq.control(None, len(pending), remaining):
+                    p = pending.pop(ev.ident, None)
+                    if p is not None:
+                        try:
+                            p.wait(0)
+                        except Exception:
+                            pass
+        finally:
+            kq.close()
+        return [p for p in alive if p.poll() is None]
+
+    for p in alive:
         try:
-            pgid = os.getpgid(p.pid)
-            os.killpg(pgid, signal.SIGTERM)
+            p.wait(timeout=max(0.0, deadline - time.monotonic()))
         except Exception:
             pass
+    return [p for p in alive if p.poll() is None]
+
+def request_stop(task_id: int) -> None:
+    """标记取消并尽最大努力终止该任务名下所有子进程（整组）"""
+    global _STOP_REQ
+    with _LOCK:
+        _STOP_REQ = _STOP_REQ | {task_id}
+        ent = _STOP_FDS.get(task_id)
+        if ent is not None:
+            os.eventfd_write(ent[0], 1)  # 唤醒所有在 poll 上等待的执行器
+    i = _shard(task_id)
+    with _PROC_LOCKS[i]:
+        procs = list(_PROCS[i].get(task_id, set()))
+    # 进程组杀掉（先全部 TERM，统一等待至多 2 秒，仍存活的再 KILL）
     for p in procs:
-        try:
-            p.wait(timeout=2.0)
-        except Exception:
-            try:
-                pgid = os.getpgid(p.pid)
-                os.killpg(pgid, signal.SIGKILL)
-            except Exception:
-                pass
+        _killpg(p, signal.SIGTERM)
+    for p in _wait_all(procs, timeout=2.0):
+        _killpg(p, signal.SIGKILL)
     # 清理登记
-    with _LOCK:
-        _PROCS.pop(task_id, None)
+    with _PROC_LOCKS[i]:
+        _PROCS[i].pop(task_id, None)
 
 def clear_stop(task_id: int) -> None:
     """可选：任务真正结束后清理状态"""
+    global _STOP_REQ
     with _LOCK:
-        _STOP_REQ.discard(task_id)
-        _PROCS.pop(task_id, None)
+        _STOP_REQ = _STOP_REQ - {task_id}
+    i = _shard(task_id)
+    with _PROC_LOCKS[i]:
+        _PROCS[i].pop(task_id, None)
 
 def is_stop_requested(task_id: Optional[int]) -> bool:
     if task_id is None:
         return False
+    # 无锁读：_STOP_REQ 引用替换是原子的
+    return task_id in _STOP_REQ
+
+@contextlib.contextmanager
+def stop_eventfd(task_id: int) -> Iterator[Optional[int]]:
+    """
+    产出该任务的取消 eventfd：request_stop 后（含之前已请求的情况）变为可读，调用方只 poll 不读取。
+    同一任务的多个等待方共享一个 fd，最后一个退出时关闭；平台不支持 eventfd 时产出 None。
+    """
+    if not hasattr(os, "eventfd"):
+        yield None
+        return
     with _LOCK:
-        return task_id in _STOP_REQ
+        ent = _STOP_FDS.get(task_id)
+        if ent is None:
+            ent = _STOP_FDS[task_id] = [os.eventfd(0, os.EFD_CLOEXEC | os.EFD_NONBLOCK), 0]
+            if task_id in _STOP_REQ:
+                os.eventfd_write(ent[0], 1)
+        ent[1] += 1
+    try:
+        yield ent[0]
+    finally:
+        with _LOCK:
+            ent[1] -= 1
+            if ent[1] == 0:
+                _STOP_FDS.pop(task_id, None)
+                os.close(ent[0])
 
 def register_process(task_id: int, p: Popen) -> None:
-    with _LOCK:
-        _PROCS.setdefault(task_id, set()).add(p)
+    i = _shard(task_id)
+    with _PROC_LOCKS[i]:
+        _PROCS[i].setdefault(task_id, set()).add(p)
 
 def unregister_process(task_id: int, p: Popen) -> None:
-    with _LOCK:
-        s = _PROCS.get(task_id)
-        if not s: 
+    i = _shard(task_id)
+    with _PROC_LOCKS[i]:
+        s = _PROCS[i].get(task_id)
+        if not s:
             return
         s.discard(p)
         if not s:
-            _PROCS.pop(task_id, None)
+            _PROCS[i].pop(task_id, None)
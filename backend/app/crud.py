@@ -1,10 +1,57 @@
-from sqlalchemy.orm import Session
-from sqlalchemy import select, func, and_, or_
+import time
+import functools
+from typing import NamedTuple
+from sqlalchemy.orm import Session, load_only, raiseload
+from sqlalchemy import select, insert, update, delete, func, and_, or_, case, event, inspect, literal, bindparam
 from . import models
+from .db import IS_SQLITE
+
+# 各状态计数的短 TTL 缓存：{engine id: (过期时间, {status: count})}
+STATUS_COUNTS_TTL = 0.25
+_status_counts_cache: dict[int, tuple[float, dict[str, int]]] = {}
+
+def status_counts(db: Session) -> dict[str, int]:
+    """
+    一次 GROUP BY 取出所有状态的任务数；250ms 内重复调用直接读缓存。
+    """
+    key = id(db.get_bind())
+    now = time.monotonic()
+    hit = _status_counts_cache.get(key)
+    if hit and hit[0] > now:
+        return hit[1]
+    stmt = select(models.Task.status, func.count()).group_by(models.Task.status)
+    counts = {status: int(n) for status, n in db.execute(stmt).all()}
+    _status_counts_cache[key] = (now + STATUS_COUNTS_TTL, counts)
+    return counts
 
 def count_queued(db: Session) -> int:
-    stmt = select(func.count()).select_from(models.Task).where(models.Task.status == "QUEUED")
-    return int(db.execute(stmt).scalar() or 0)
+    return status_counts(db).get("QUEUED", 0)
+
+# 每请求都会走的配额查询：语句对象按形状只构造一次，参数全部走 bindparam，
+# 每次执行的缓存键相同，直接命中引擎的编译缓存（query_cache_size）
+def _user_queued_cond(exclude: bool):
+    cond = [models.Task.status == "QUEUED", models.Task.user_id == bindparam("uid")]
+    if exclude:
+        cond.append(models.Task.id != bindparam("exclude_id"))
+    return and_(*cond)
+
+@functools.lru_cache(maxsize=2)
+def _count_user_queued_stmt(exclude: bool):
+    return select(func.count()).select_from(models.Task).where(_user_queued_cond(exclude))
+
+@functools.lru_cache(maxsize=2)
+def _probe_user_queued_stmt(exclude: bool):
+    return (
+        select(literal(1)).select_from(models.Task)
+        .where(_user_queued_cond(exclude))
+        .limit(bindparam("k"))
+    )
+
+def _user_queued_params(user_id: str, exclude_task_id: int | None, **extra) -> dict:
+    params = {"uid": user_id, **extra}
+    if exclude_task_id is not None:
+        params["exclude_id"] = exclude_task_id
+    return params
 
 def count_user_queued(db: Session, user_id: str, exclude_task_id: int | None = None) -> int:
     """
@@ -12,47 +59,178 @@ def count_user_queued(db: Session, user_id: str, exclude_task_id: int | None = N
     """
     if not user_id:
         return 0
-    cond = [models.Task.status == "QUEUED", models.Task.user_id == user_id]
-    if exclude_task_id is not None:
-        cond.append(models.Task.id != exclude_task_id)
-    stmt = select(func.count()).select_from(models.Task).where(and_(*cond))
-    return int(db.execute(stmt).scalar() or 0)
+    stmt = _count_user_queued_stmt(exclude_task_id is not None)
+    return int(db.execute(stmt, _user_queued_params(user_id, exclude_task_id)).scalar() or 0)
+
+def has_at_least_user_queued(db: Session, user_id: str, k: int, exclude_task_id: int | None = None) -> bool:
+    """
+    该用户 QUEUED 任务数是否 ≥ k；只探测前 k 行（LIMIT k），不做完整 COUNT。
+    用于配额判断；需要精确数量（如提示文案）时仍用 count_user_queued。
+    """
+    if k <= 0:
+        return True
+    if not user_id:
+        return False
+    stmt = _probe_user_queued_stmt(exclude_task_id is not None)
+    return len(db.execute(stmt, _user_queued_params(user_id, exclude_task_id, k=k)).all()) >= k
+
+# ---- 排队位置缓存：队列成员/顺序变化时递增 epoch 并清空 ----
+_QUEUE_CACHE_MAX = 1024
+_queue_epoch = 0
+_queue_pos_cache: dict[tuple[int, int], tuple[int, int]] = {}
+
+# 队列变化的订阅者（如分发器的唤醒回调）；可能在任意线程中被调用
+_queue_listeners: list = []
+
+def add_queue_listener(fn) -> None:
+    _queue_listeners.append(fn)
+
+def bump_queue_epoch() -> None:
+    """队列发生变化（入队/出队/重新排序）后调用；ORM 提交会自动调用，批量 UPDATE 需手动调用"""
+    global _queue_epoch
+    _queue_epoch += 1
+    _queue_pos_cache.clear()
+    _status_counts_cache.clear()  # 状态已变，计数缓存一并作废
+    for fn in _queue_listeners:
+        fn()
+
+@event.listens_for(Session, "after_flush")
+def _mark_queue_dirty(session, flush_context):
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        if not isinstance(obj, models.Task):
+            continue
+        state = inspect(obj)
+        if (obj in session.new or obj in session.deleted
+                or state.attrs.status.history.has_changes()
+                or state.attrs.enqueued_at.history.has_changes()):
+            session.info["queue_dirty"] = True
+            return
+
+@event.listens_for(Session, "after_commit")
+def _bump_on_commit(session):
+    # 提交后才递增，避免并发读者把未提交前的结果记在新 epoch 下
+    if session.info.pop("queue_dirty", False):
+        bump_queue_epoch()
+
+@event.listens_for(Session, "after_rollback")
+def _discard_on_rollback(session):
+    session.info.pop("queue_dirty", None)
 
 def queue_position_and_length(db: Session, task: models.Task) -> tuple[int, int]:
     if not task or task.status != "QUEUED":
         return 0, 0
-    total = count_queued(db)
+    key = (task.id, _queue_epoch)
+    hit = _queue_pos_cache.get(key)
+    if hit is not None:
+        return hit
+    if len(_queue_pos_cache) >= _QUEUE_CACHE_MAX:
+        _queue_pos_cache.clear()
+    _queue_pos_cache[key] = result = _queue_position_and_length(db, task)
+    return result
 
+@functools.lru_cache(maxsize=1)
+def _queue_position_stmt():
     # 使用 COALESCE(enqueued_at, created_at) 保证历史数据也能正确排序
     key = func.coalesce(models.Task.enqueued_at, models.Task.created_at)
-    task_key = task.enqueued_at or task.created_at
-
-    earlier_cnt_stmt = select(func.count()).select_from(models.Task).where(
-        and_(
-            models.Task.status == "QUEUED",
-            or_(
-                key < task_key,
-                and_(key == task_key, models.Task.id < task.id)
-            )
-        )
+    task_key = bindparam("task_key", type_=models.Task.created_at.type)
+    earlier = or_(
+        key < task_key,
+        and_(key == task_key, models.Task.id < bindparam("task_id"))
     )
-    ahead = int(db.execute(earlier_cnt_stmt).scalar() or 0)
+
+    # 一条语句同时取“排在前面的数量”与“排队总数”
+    return select(
+        func.coalesce(func.sum(case((earlier, 1), else_=0)), 0).label("ahead"),
+        func.count().label("total"),
+    ).select_from(models.Task).where(models.Task.status == "QUEUED")
+
+def _queue_position_and_length(db: Session, task: models.Task) -> tuple[int, int]:
+    params = {"task_key": task.enqueued_at or task.created_at, "task_id": task.id}
+    ahead, total = db.execute(_queue_position_stmt(), params).one()
+    ahead, total = int(ahead or 0), int(total or 0)
     pos = min(total, ahead + 1) if total > 0 else 0
     return pos, total
 
 def create_task(db: Session, **kwargs) -> models.Task:
-    t = models.Task(**kwargs)
-    db.add(t); db.flush(); db.refresh(t)
+    """一条 INSERT ... RETURNING 建任务并取回整行（含数据库侧默认值），不再 flush + refresh。"""
+    stmt = insert(models.Task).values(**kwargs).returning(models.Task).options(raiseload(models.Task.subtitles))
+    t = db.scalars(stmt).one()
+    # 语句级 INSERT 不经过 flush 钩子：手动标记，提交后由 after_commit 递增队列 epoch
+    db.info["queue_dirty"] = True
     return t
 
 def get_task(db: Session, task_id: int) -> models.Task | None:
     return db.get(models.Task, task_id)
 
+def get_task_fields(db: Session, task_id: int, *columns):
+    """只取任务的若干列（不加载整行与字幕）；任务不存在返回 None。"""
+    return db.execute(select(*columns).where(models.Task.id == task_id)).first()
+
+def transition_task(db: Session, task_id: int, from_statuses: tuple[str, ...] | None = None, **values) -> models.Task | None:
+    """
+    一条 UPDATE ... RETURNING 完成任务状态迁移并取回新行，不先加载整行、也不走 flush/refresh。
+    from_statuses 给定时仅当前状态在其中才更新；未更新（不存在或状态已变）返回 None。
+    """
+    stmt = update(models.Task).where(models.Task.id == task_id)
+    if from_statuses:
+        stmt = stmt.where(models.Task.status.in_(from_statuses))
+    stmt = stmt.values(**values).returning(models.Task).options(raiseload(models.Task.subtitles))
+    t = db.scalars(stmt).first()
+    if t is not None:
+        # 语句级 UPDATE 不经过 flush 钩子：手动标记，提交后由 after_commit 递增队列 epoch
+        db.info["queue_dirty"] = True
+    return t
+
+def delete_subtitles(db: Session, task_id: int) -> None:
+    db.execute(delete(models.Subtitle).where(models.Subtitle.task_id == task_id))
+
+# 列表页（TaskListItem）实际用到的列；样式/消息/租约等字段不查
+_LIST_COLUMNS = (
+    models.Task.id, models.Task.user_id, models.Task.title, models.Task.status,
+    models.Task.progress, models.Task.target_language_display, models.Task.final_video_file,
+    models.Task.video_duration_seconds, models.Task.created_at, models.Task.updated_at,
+)
+
 def list_tasks(db: Session, user_id: str | None = None):
-    stmt = select(models.Task).order_by(models.Task.created_at.desc())
+    """
+    列表查询：只选列表页需要的列，返回行映射（不构造 ORM 对象、不加载字幕）。
+    """
+    stmt = select(*_LIST_COLUMNS).order_by(models.Task.created_at.desc())
     if user_id:
         stmt = stmt.where(models.Task.user_id == user_id)
-    return db.execute(stmt).scalars().all()
+    return db.execute(stmt).mappings().all()
+
+class DataVersion(NamedTuple):
+    key: tuple              # 参与 ETag 计算的版本字段
+    age_seconds: float      # 距最近一次变更的秒数（数据库时钟）
+
+def task_detail_version(db: Session, task_id: int) -> DataVersion | None:
+    """
+    任务详情（含字幕）的版本：任务 updated_at + 字幕条数/最大 updated_at，一条查询取回，不加载任务与字幕。
+    任务不存在返回 None。
+    """
+    sub_where = models.Subtitle.task_id == models.Task.id
+    sub_count = select(func.count()).where(sub_where).scalar_subquery()
+    sub_max = select(func.max(models.Subtitle.updated_at)).where(sub_where).scalar_subquery()
+    stmt = select(
+        models.Task.updated_at, sub_count, sub_max,
+        _seconds_since(models.Task.updated_at), _seconds_since(sub_max),
+    ).where(models.Task.id == task_id)
+    row = db.execute(stmt).first()
+    if row is None:
+        return None
+    updated, n_subs, subs_updated, age_task, age_subs = row
+    ages = [a for a in (age_task, age_subs) if a is not None]
+    return DataVersion((updated, n_subs, subs_updated), min(ages) if ages else 0.0)
+
+def task_list_version(db: Session, user_id: str | None = None) -> DataVersion:
+    """任务列表的版本：条数 + 最大 updated_at（增删改都会改变其一）。"""
+    latest = func.max(models.Task.updated_at)
+    stmt = select(func.count(), latest, _seconds_since(latest))
+    if user_id:
+        stmt = stmt.where(models.Task.user_id == user_id)
+    n, updated, age = db.execute(stmt).one()
+    return DataVersion((n, updated), age if age is not None else float("inf"))
 
 def list_queue(db: Session):
     order_key = func.coalesce(models.Task.enqueued_at, models.Task.created_at)
@@ -63,9 +241,77 @@ def list_queue(db: Session):
     )
     return db.execute(stmt).scalars().all()
 
+# 进度轮询只用到这几列
+_PROGRESS_COLUMNS = (
+    models.Task.status, models.Task.progress, models.Task.msg, models.Task.error_msg,
+    models.Task.final_video_file, models.Task.processing_started_at, models.Task.updated_at,
+)
+
+class TaskQueueStats(NamedTuple):
+    task: models.Task | None
+    queue_position: int
+    queue_length: int
+    running: int
+    processing_seconds: int
+
+def _seconds_since(col):
+    """数据库侧计算 col 距当前（UTC）的秒数；时间列存的是 UTC 无时区值。"""
+    if IS_SQLITE:
+        return (func.julianday("now") - func.julianday(col)) * 86400
+    return func.extract("epoch", func.timezone("UTC", func.now()) - col)
+
+@functools.lru_cache(maxsize=1)
+def _task_with_queue_stats_stmt():
+    order_key = func.coalesce(models.Task.enqueued_at, models.Task.created_at)
+    q = (
+        select(
+            models.Task.id,
+            func.row_number().over(order_by=(order_key.asc(), models.Task.id.asc())).label("rn"),
+            func.count().over().label("ql"),
+        )
+        .where(models.Task.status == "QUEUED")
+        .cte("q")
+    )
+    running = (
+        select(func.count()).select_from(models.Task)
+        .where(models.Task.status == "PROCESSING")
+        .scalar_subquery()
+    )
+    elapsed = case(
+        (and_(models.Task.status == "PROCESSING", models.Task.processing_started_at.is_not(None)),
+         _seconds_since(models.Task.processing_started_at)),
+        else_=0,
+    )
+    return (
+        select(models.Task, q.c.rn, q.c.ql, running, elapsed)
+        .options(load_only(*_PROGRESS_COLUMNS), raiseload(models.Task.subtitles))
+        .outerjoin(q, q.c.id == models.Task.id)
+        .where(models.Task.id == bindparam("task_id"))
+    )
+
+def get_task_with_queue_stats(db: Session, task_id: int) -> TaskQueueStats:
+    """
+    进度接口用：一条语句取回任务（仅进度相关列、不带字幕）+ 排队位置/排队总数 + 运行中任务数
+    + 已处理秒数（由数据库按当前时间算出）。
+    任务不在队列中时位置与总数为 0；任务不存在时 task 为 None。
+    """
+    row = db.execute(_task_with_queue_stats_stmt(), {"task_id": task_id}).first()
+    if row is None:
+        return TaskQueueStats(None, 0, 0, 0, 0)
+    task, rn, ql, running, elapsed = row
+    return TaskQueueStats(task, int(rn or 0), int(ql or 0), int(running or 0), max(0, int(elapsed or 0)))
+
 def count_processing(db: Session) -> int:
-    stmt = select(func.count()).select_from(models.Task).where(models.Task.status == "PROCESSING")
-    return int(db.execute(stmt).scalar() or 0)
+    return status_counts(db).get("PROCESSING", 0)
 
-def get_subtitles(db: Session, task_id: int):
-    return db.execute(select(models.Subtitle).where(models.Subtitle.task_id==task_id).order_by(models.Subtitle.sequence)).scalars().all()
+def get_subtitles(db: Session, task_id: int, yield_per: int = 256):
+    """
+    按 sequence 流式返回字幕（ScalarResult，每批 yield_per 行），调用方边迭代边处理，不一次性载入内存。
+    """
+    stmt = (
+        select(models.Subtitle)
+        .where(models.Subtitle.task_id == task_id)
+        .order_by(models.Subtitle.sequence)
+        .execution_options(yield_per=yield_per)
+    )
+    return db.execute(stmt).scalars()
@@ -1,13 +1,48 @@
 # app/db.py
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy.orm import sessionmaker, declarative_base
 import os
 
 DB_URL = os.getenv("DB_URL", "sqlite:///./video_tasks.db")
+IS_SQLITE = DB_URL.startswith("sqlite")
+IS_SQLITE_MEMORY = IS_SQLITE and (DB_URL in ("sqlite://", "sqlite:///:memory:") or "mode=memory" in DB_URL)
 
-# 对 sqlite 才需要 check_same_thread=False
-connect_args = {"check_same_thread": False} if DB_URL.startswith("sqlite") else {}
-engine = create_engine(DB_URL, connect_args=connect_args)
+# 连接池：默认按 dispatcher 并发 + API 请求量估算，可用环境变量覆盖
+# 每个并行任务约占 2 个连接（任务线程 + 心跳/分发）
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", str(max(8, 2 * int(os.getenv("MAX_PARALLEL_TASKS", "1"))))))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "4"))
+DB_QUERY_CACHE_SIZE = int(os.getenv("DB_QUERY_CACHE_SIZE", "1200"))
+
+# 对 sqlite 才需要 check_same_thread=False；timeout 为写锁等待秒数
+connect_args = {"check_same_thread": False, "timeout": 30} if IS_SQLITE else {}
+engine_kwargs = {"query_cache_size": DB_QUERY_CACHE_SIZE, "echo_pool": False}
+if not IS_SQLITE_MEMORY:
+    # 内存库使用 SingletonThreadPool，不支持这两个参数
+    engine_kwargs.update(pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW)
+if not IS_SQLITE:
+    # 网络数据库的连接可能被服务端/中间件断开，借出前先探活；本地 SQLite 文件无需
+    engine_kwargs.update(pool_pre_ping=True)
+engine = create_engine(DB_URL, connect_args=connect_args, **engine_kwargs)
+
+if IS_SQLITE:
+    @event.listens_for(engine, "connect")
+    def _sqlite_pragmas(dbapi_conn, conn_record):
+        """
+        每个新连接设置一次：
+        - WAL：读不阻塞写，提交不再每次 fsync 主库文件
+        - busy_timeout：写锁冲突时等待而不是立即报 database is locked
+        """
+        cur = dbapi_conn.cursor()
+        try:
+            if not IS_SQLITE_MEMORY:
+                cur.execute("PRAGMA journal_mode=WAL")
+                cur.execute("PRAGMA mmap_size=268435456")
+            cur.execute("PRAGMA synchronous=NORMAL")
+            cur.execute("PRAGMA busy_timeout=30000")
+            cur.execute("PRAGMA temp_store=MEMORY")
+            cur.execute("PRAGMA cache_size=-65536")
+        finally:
+            cur.close()
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
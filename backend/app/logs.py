@@ -1,9 +1,11 @@
 # app/logs.py
 # -*- coding: utf-8 -*-
+import atexit
 import logging
 import os
+import queue
 import sys
-from logging.handlers import RotatingFileHandler
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
 
 # ---- colorama（可选）----
 try:
@@ -30,6 +32,7 @@ LOG_COLOR = os.getenv("LOG_COLOR", "1") == "1"                   # 控制台彩
 LOG_UVICORN_WIRE = os.getenv("LOG_UVICORN_WIRE", "0") == "1"     # 是否放开 uvicorn access 全量日志
 
 _CONFIGURED = False  # 防重复配置
+_LISTENER: QueueListener | None = None  # 文件日志后台线程
 
 # ---- 彩色 Formatter ----
 class ColoredFormatter(logging.Formatter):
@@ -71,6 +74,11 @@ def _make_console_handler() -> logging.Handler:
     return h
 
 def _make_file_handler() -> logging.Handler | None:
+    """
+    文件日志走 QueueHandler：请求线程只把 LogRecord 放进无锁队列，
+    格式化与写盘/轮转由 QueueListener 后台线程完成。
+    """
+    global _LISTENER
     if not LOG_FILE:
         return None
     level = getattr(logging, LOG_LEVEL_FILE, logging.INFO)
@@ -84,7 +92,21 @@ def _make_file_handler() -> logging.Handler | None:
     )
     fh.setLevel(level)
     fh.setFormatter(logging.Formatter(_PLAIN_FMT, _DATE_FMT))  # 文件不带颜色
-    return fh
+
+    if _LISTENER is not None:
+        _LISTENER.stop()
+    q: queue.SimpleQueue = queue.SimpleQueue()
+    _LISTENER = QueueListener(q, fh, respect_handler_level=True)
+    _LISTENER.start()
+    qh = QueueHandler(q)
+    qh.setLevel(level)
+    return qh
+
+def _stop_listener() -> None:
+    if _LISTENER is not None:
+        _LISTENER.stop()
+
+atexit.register(_stop_listener)
 
 def _silence_noisy_loggers():
     # Uvicorn/Starlette 噪声控制
@@ -147,6 +169,9 @@ def attach_request_logger(app) -> None:
 
     @app.middleware("http")
     async def _log_mw(request: Request, call_next):
+        # INFO 未启用时（如仅记录 WARNING）直接放行，不计时也不构造日志参数
+        if not log.isEnabledFor(logging.INFO):
+            return await call_next(request)
         start = time.perf_counter()
         response: Response | None = None
         try:
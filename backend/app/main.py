@@ -1,6 +1,7 @@
 import os, asyncio
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from sqlalchemy.schema import CreateIndex
 from .db import Base, engine
 from .routes import tasks, subtitles
 from .queue import dispatcher
@@ -12,6 +13,12 @@ log = get_logger("main")
 log.info("服务启动中...")
 
 Base.metadata.create_all(bind=engine)
+# create_all 只在建表时建索引：已有数据库按模型补建后来新增的索引
+# （IF NOT EXISTS 由数据库判断；表达式索引无法反射，不能用 checkfirst）
+with engine.begin() as _conn:
+    for _table in Base.metadata.sorted_tables:
+        for _ix in _table.indexes:
+            _conn.execute(CreateIndex(_ix, if_not_exists=True))
 app = FastAPI(title="Video Translate Backend", version="1.0.0")
 attach_request_logger(app)
 
@@ -1,8 +1,8 @@
-from sqlalchemy import Column, Integer, String, Float, Text, DateTime, Boolean, ForeignKey
+from sqlalchemy import Column, Integer, String, Float, Text, DateTime, Boolean, ForeignKey, Index, func
 from sqlalchemy.orm import relationship
-from datetime import datetime, timedelta
 from .db import Base
 
+# 时间戳统一由数据库时钟生成（SQLite 的 CURRENT_TIMESTAMP 为 UTC），INSERT/UPDATE 中内联 SQL，不占绑定参数
 TASK_STATUS = ("QUEUED","PROCESSING","REVIEW","SUCCESS","FAILED")
 QUEUE_FOR   = ("prepare","finalize","reburn")
 
@@ -49,11 +49,14 @@ class Task(Base):
     tts_name = Column(String(128), default="zh-CN-YunfengNeural")
 
     translation_confirmed_at = Column(DateTime, nullable=True)
-    created_at = Column(DateTime, default=datetime.utcnow, index=True)
+    created_at = Column(DateTime, default=func.now(), server_default=func.now(), index=True)
     enqueued_at = Column(DateTime, nullable=True, index=True)
-    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    updated_at = Column(DateTime, default=func.now(), server_default=func.now(), onupdate=func.now())
 
-    subtitles = relationship("Subtitle", back_populates="task", cascade="all, delete-orphan", lazy="selectin")
+    subtitles = relationship(
+        "Subtitle", back_populates="task", cascade="all, delete-orphan", lazy="selectin",
+        order_by="Subtitle.sequence",  # 由数据库排好序，调用方无需再 sorted()
+    )
 
     # --- 运行控制：租约 / 心跳 / 重试 ---
     worker_id    = Column(String(64), nullable=True, index=True)        # 哪个worker持有（如 host:pid）
@@ -63,6 +66,16 @@ class Task(Base):
     attempt      = Column(Integer, default=0)                           # 已尝试次数
     max_attempts = Column(Integer, default=0)                           # 最多自动重试次数
 
+# 排队顺序的部分索引：只收录 QUEUED 行，按 (COALESCE(enqueued_at, created_at), id) 排序
+_QUEUED = Task.status == "QUEUED"
+Index(
+    "ix_tasks_queue_order",
+    func.coalesce(Task.enqueued_at, Task.created_at), Task.id,
+    sqlite_where=_QUEUED, postgresql_where=_QUEUED,
+)
+# 每用户排队配额（count_user_queued / has_at_least_user_queued）：同样只收录 QUEUED 行，索引很小
+Index("ix_tasks_user_queued", Task.user_id, sqlite_where=_QUEUED, postgresql_where=_QUEUED)
+
 class Subtitle(Base):
     __tablename__ = "subtitles"
     id = Column(Integer, primary_key=True, index=True)
@@ -74,7 +87,10 @@ class Subtitle(Base):
     end_time_srt   = Column(String(12), nullable=False)  # "HH:MM:SS,mmm"
     original_text = Column(Text, nullable=False)
     translated_text = Column(Text, nullable=True)
-    created_at = Column(DateTime, default=datetime.utcnow)
-    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    created_at = Column(DateTime, default=func.now(), server_default=func.now())
+    updated_at = Column(DateTime, default=func.now(), server_default=func.now(), onupdate=func.now())
 
     task = relationship("Task", back_populates="subtitles")
+
+# 按任务取字幕（selectin 加载 / 流式列表 / 编辑时的归属校验）均按 (task_id, sequence) 走索引，并免去排序
+Index("ix_subtitle_task_seq", Subtitle.task_id, Subtitle.sequence)
@@ -0,0 +1,108 @@
+# app/processors/cache.py
+# -*- coding: utf-8 -*-
+"""
+ASR / 翻译结果缓存（SQLite，一张键值表）。
+同一段人声重复跑阶段一时，直接取回识别片段与译文，不再重跑 Whisper 和 LLM。
+"""
+import os
+import json
+import time
+import hashlib
+import sqlite3
+import threading
+from typing import Optional
+
+from .utils import MEDIA_ROOT
+
+CACHE_DB_PATH = os.getenv("RESULT_CACHE_DB", os.path.join(MEDIA_ROOT, "result_cache.sqlite3"))
+CACHE_TTL_SECONDS = int(os.getenv("RESULT_CACHE_TTL", str(72 * 3600)))
+# 内容指纹只读文件首尾各 1MB + 文件长度
+_SAMPLE_BYTES = 1 << 20
+
+_CONN: Optional[sqlite3.Connection] = None
+_LOCK = threading.Lock()
+
+
+def _conn() -> sqlite3.Connection:
+    global _CONN
+    if _CONN is None:
+        os.makedirs(os.path.dirname(CACHE_DB_PATH) or ".", exist_ok=True)
+        conn = sqlite3.connect(CACHE_DB_PATH, check_same_thread=False, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS result_cache ("
+            "hash TEXT PRIMARY KEY, payload BLOB NOT NULL, expires_at INTEGER NOT NULL)"
+        )
+        conn.commit()
+        _CONN = conn
+    return _CONN
+
+
+def file_key(path: str) -> str:
+    """文件内容指纹：blake2b(长度 + 首 1MB + 尾 1MB)。"""
+    size = os.path.getsize(path)
+    h = hashlib.blake2b(f"{size}:".encode(), digest_size=20)
+    with open(path, "rb") as f:
+        h.update(f.read(_SAMPLE_BYTES))
+        if size > _SAMPLE_BYTES:
+            f.seek(-min(_SAMPLE_BYTES, size - _SAMPLE_BYTES), os.SEEK_END)
+            h.update(f.read())
+    return h.hexdigest()
+
+
+def asr_config(model_path: str, compute_type: str, batch_size: int) -> str:
+    """识别配置标签：换模型 / 精度 / 批大小后识别片段可能不同，不能复用旧缓存。"""
+    return f"{model_path}:{compute_type}:{batch_size}"
+
+
+def asr_key(vocal_hash: str, asr_cfg: str) -> str:
+    return f"asr:{vocal_hash}:{asr_cfg}"
+
+
+def translation_key(vocal_hash: str, asr_cfg: str, target_lang: str, cps: float, batch_size: int) -> str:
+    # 译文依附于识别片段，同样带上识别配置，避免新旧配置的片段与译文错配
+    return f"{translation_prefix(vocal_hash)}{asr_cfg}:{target_lang}:{cps}:{batch_size}"
+
+
+def translation_prefix(vocal_hash: str) -> str:
+    return f"tr:{vocal_hash}:"
+
+
+def get(key: str) -> Optional[dict]:
+    """命中且未过期返回 payload，否则返回 None；缓存库读写失败一律视为未命中。"""
+    try:
+        with _LOCK:
+            row = _conn().execute(
+                "SELECT payload FROM result_cache WHERE hash = ? AND expires_at > ?",
+                (key, int(time.time())),
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+    except (sqlite3.Error, ValueError):
+        return None
+
+
+def put(key: str, payload: dict, ttl: int = CACHE_TTL_SECONDS) -> None:
+    now = int(time.time())
+    data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+    try:
+        with _LOCK:
+            conn = _conn()
+            conn.execute("DELETE FROM result_cache WHERE expires_at <= ?", (now,))
+            conn.execute(
+                "INSERT OR REPLACE INTO result_cache (hash, payload, expires_at) VALUES (?, ?, ?)",
+                (key, data, now + ttl),
+            )
+            conn.commit()
+    except sqlite3.Error:
+        pass
+
+
+def delete_prefix(prefix: str) -> None:
+    """删除以 prefix 开头的全部条目（如某段人声的所有译文缓存）。"""
+    try:
+        with _LOCK:
+            conn = _conn()
+            conn.execute("DELETE FROM result_cache WHERE substr(hash, 1, ?) = ?", (len(prefix), prefix))
+            conn.commit()
+    except sqlite3.Error:
+        pass
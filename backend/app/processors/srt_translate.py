@@ -2,11 +2,14 @@
 # -*- coding: utf-8 -*-
 
 import os
+import re
 import math
 import argparse
 import requests
-import pysrt
+import numpy as np
 from tqdm import tqdm
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
 
 # ============ 从 上上级目录/.env 读取 OPENAI 配置 ============
 ENV_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..", "..", ".env"))
@@ -19,18 +22,48 @@ except Exception:
     # 如果未安装或加载失败，不影响后续流程（但无法从 .env 自动加载）
     pass
 
+# ---- orjson（可选，解析更快；不可用时回退标准库 json）----
+try:
+    import orjson
+    _json_loads = orjson.loads
+except Exception:
+    import json
+    _json_loads = json.loads
+
 # --------- 基础工具 ---------
+_SRT_BLOCK_SPLIT_RE = re.compile(r"\n[ \t]*\n")
+_SRT_RE = re.compile(
+    r"^\s*(\d+)\s*\n"
+    r"(\d+):(\d\d):(\d\d)[,.](\d{1,3})\s*-->\s*(\d+):(\d\d):(\d\d)[,.](\d{1,3})[^\n]*"
+    r"(?:\n(.*))?$",
+    re.S,
+)
+
+
+def _ordinal(h, m, s, ms):
+    return ((int(h) * 3600 + int(m) * 60 + int(s)) * 1000) + int(ms)
+
+
 def read_srt(path):
-    subs_raw = pysrt.open(path, encoding="utf-8")
+    """
+    直接用正则解析 SRT 为 dict 列表（不构造 pysrt 对象）：
+    {"index", "start_ordinal", "end_ordinal", "text"}
+    """
+    with open(path, "rb") as f:
+        content = f.read().decode("utf-8-sig")
+    content = content.replace("\r\n", "\n").replace("\r", "\n")
     subs = []
-    for i in range(len(subs_raw)):
-        sub = subs_raw[i]
-        temp = {}
-        temp["index"] = sub.index
-        temp["start_ordinal"] = sub.start.ordinal
-        temp["end_ordinal"] = sub.end.ordinal
-        temp["text"] = sub.text
-        subs.append(temp)
+    for block in _SRT_BLOCK_SPLIT_RE.split(content):
+        m = _SRT_RE.match(block)
+        if not m:
+            continue
+        g = m.groups()
+        subs.append({
+            "index": int(g[0]),
+            "start_ordinal": _ordinal(*g[1:5]),
+            "end_ordinal": _ordinal(*g[5:9]),
+            "text": (g[9] or "").strip("\n"),
+        })
     return subs
 
 
@@ -38,24 +71,54 @@ def duration_seconds(sub):
     return max(0.0, (sub["end_ordinal"] - sub["start_ordinal"]) / 1000.0)
 
 
+# str.isspace() 为真的全部字符；str.translate 删除后取长度，整体在 C 层完成
+_WS_TABLE = dict.fromkeys(
+    [*range(0x09, 0x0E), *range(0x1C, 0x21), 0x85, 0xA0, 0x1680,
+     *range(0x2000, 0x200B), 0x2028, 0x2029, 0x202F, 0x205F, 0x3000],
+    None,
+)
+
+
 def visible_len(s, exclude_spaces=False):
     if exclude_spaces:
-        return sum(1 for ch in s if not ch.isspace())
+        return len(s.translate(_WS_TABLE))
     return len(s)
 
 
+def cps_limits(subs, cps, exclude_spaces=False):
+    """
+    一次性计算所有字幕的 (时长秒, 最大字数, 当前字数) 三个数组。
+    """
+    n = len(subs)
+    starts = np.fromiter((s["start_ordinal"] for s in subs), dtype=np.int64, count=n)
+    ends = np.fromiter((s["end_ordinal"] for s in subs), dtype=np.int64, count=n)
+    dur = np.maximum(0.01, (ends - starts) / 1000.0)
+    max_chars = np.floor(dur * cps).astype(np.int64)
+    lengths = np.fromiter((visible_len(s["text"], exclude_spaces) for s in subs), dtype=np.int64, count=n)
+    return dur, max_chars, lengths
+
+
 def clamp(v, lo, hi):
     return max(lo, min(hi, v))
 
 
-def add_seconds_to_time(srt_time, seconds):
-    ms = srt_time.ordinal + int(round(seconds * 1000))
+def add_seconds_to_ordinal(ordinal, seconds):
+    ms = ordinal + int(round(seconds * 1000))
     if ms < 0:
         ms = 0
-    return pysrt.SubRipTime(milliseconds=ms)
+    return ms
 
 
 # --------- LLM 接口（仅 OPENAI 兼容 Chat Completions） ---------
+# 批次并发数（同时在途的请求数上限）
+TRANSLATE_CONCURRENCY = max(1, int(os.getenv("TRANSLATE_CONCURRENCY", "8")))
+
+# 进程级共享 Session：复用 TCP/TLS 连接，连接池大小与并发数一致
+_http = requests.Session()
+_http.mount("https://", requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=TRANSLATE_CONCURRENCY))
+_http.mount("http://", requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=TRANSLATE_CONCURRENCY))
+
+
 def call_chat_api(messages, model, api_base, api_key, temperature=0.0, max_tokens=2048):
     url = api_base.rstrip("/") + "/chat/completions"
     headers = {
@@ -68,7 +131,7 @@ def call_chat_api(messages, model, api_base, api_key, temperature=0.0, max_token
         "temperature": temperature,
         "max_tokens": max_tokens,
     }
-    resp = requests.post(url, headers=headers, json=payload, timeout=120)
+    resp = _http.post(url, headers=headers, json=payload, timeout=120)
     if resp.status_code != 200:
         raise RuntimeError(f"Chat API error {resp.status_code}: {resp.text[:2000]}")
     data = resp.json()
@@ -90,27 +153,46 @@ Hard rules (must all be satisfied):
 - Respect MAX_CHARS for each id; shorten politely if needed.
 - Return strictly in JSON with id->text mapping. No extra commentary.
 """
+# 所有批次共用同一个 system 消息
+BATCH_SYS_MESSAGE = {"role": "system", "content": BATCH_SYS_PROMPT}
+
+
+# 提示词中与批次无关的固定部分，只构造一次
+_BATCH_PROMPT_HEAD = "Target language: {}\nFor each item, obey MAX_CHARS characters (inclusive).\nItems:"
+_BATCH_PROMPT_TAIL = '\nOutput JSON like:\n{\n  "1": "...",\n  "2": "..."\n}'
+_BATCH_ITEM_TMPL = "\n- id={}, MAX_CHARS={}\n<<<\n{}\n>>>".format
+
+
+@lru_cache(maxsize=32)
+def _batch_prompt_builder(target_lang):
+    """
+    按目标语言特化的提示词构造器：表头只格式化一次，之后每批只拼接条目本身。
+    """
+    head = _BATCH_PROMPT_HEAD.format(target_lang)
+    tail = _BATCH_PROMPT_TAIL
+    item = _BATCH_ITEM_TMPL
+
+    def build(items):
+        parts = [head]
+        parts.extend(item(it["id"], it["max_chars"], it["text"]) for it in items)
+        parts.append(tail)
+        return "".join(parts)
+
+    return build
 
 
 def build_batch_prompt(items, target_lang):
-    lines = []
-    lines.append(f"Target language: {target_lang}")
-    lines.append("For each item, obey MAX_CHARS characters (inclusive).")
-    lines.append("Items:")
-    for it in items:
-        lines.append(
-            f"- id={it['id']}, MAX_CHARS={it['max_chars']}\n<<<\n{it['text']}\n>>>"
-        )
-    lines.append('Output JSON like:\n{\n  "1": "...",\n  "2": "..."\n}')
-    return "\n".join(lines)
+    return _batch_prompt_builder(target_lang)(items)
+
+
+_JSON_BLOCK_RE = re.compile(r"\{[\s\S]*\}")
 
 
 def parse_json_mapping(txt):
-    import json, re
-    m = re.search(r"\{[\s\S]*\}", txt)
+    m = _JSON_BLOCK_RE.search(txt)
     if m:
         txt = m.group(0)
-    return json.loads(txt)
+    return _json_loads(txt)
 
 
 def batch_translate(
@@ -126,7 +208,7 @@ def batch_translate(
 
     user_prompt = build_batch_prompt(items, target_lang)
     messages = [
-        {"role": "system", "content": BATCH_SYS_PROMPT},
+        BATCH_SYS_MESSAGE,
         {"role": "user", "content": user_prompt},
     ]
     out = call_chat_api(messages, model, api_base, api_key)
@@ -149,6 +231,12 @@ Return only the condensed text with line breaks kept. No commentary.
 
 
 def compress_to_limit(text, max_chars, model, api_base, api_key):
+    # 重复字幕（歌词、口头禅等）很常见，相同输入直接复用上一次的精简结果
+    return _compress_to_limit_cached(text, max_chars, model, api_base, api_key)
+
+
+@lru_cache(maxsize=2048)
+def _compress_to_limit_cached(text, max_chars, model, api_base, api_key):
     user_prompt = f"""\
 Condense the following subtitle to at most {max_chars} characters (inclusive).
 Keep it natural and readable. Maintain line breaks ('\\n') where they help readability.
@@ -166,12 +254,12 @@ Keep it natural and readable. Maintain line breaks ('\\n') where they help reada
     return out.strip()[:max_chars]
 
 
-# --------- 时间轴微调算法（pysrt 版） ---------
+# --------- 时间轴微调算法（毫秒序数版） ---------
 def adjust_timeline_for_cps(
     subs, idx, cps, exclude_spaces, min_gap=0.10, max_shift=1.0
 ):
     cur = subs[idx]
-    cur_len = visible_len(cur.text, exclude_spaces)
+    cur_len = visible_len(cur["text"], exclude_spaces)
     if cur_len == 0:
         return False
 
@@ -187,13 +275,13 @@ def adjust_timeline_for_cps(
     extra_from_prev = 0.0
     if idx > 0:
         prev = subs[idx - 1]
-        gap_prev = (cur.start.ordinal - prev.end.ordinal) / 1000.0
+        gap_prev = (cur["start_ordinal"] - prev["end_ordinal"]) / 1000.0
         extra_from_prev = max(0.0, gap_prev - min_gap)
 
     extra_from_next = 0.0
     if idx < len(subs) - 1:
         nxt = subs[idx + 1]
-        gap_next = (nxt.start.ordinal - cur.end.ordinal) / 1000.0
+        gap_next = (nxt["start_ordinal"] - cur["end_ordinal"]) / 1000.0
         extra_from_next = max(0.0, gap_next - min_gap)
 
     extra_from_prev = min(extra_from_prev, max_shift)
@@ -214,21 +302,78 @@ def adjust_timeline_for_cps(
     if borrow_prev + borrow_next <= 1e-6:
         return False
 
-    cur.start = add_seconds_to_time(cur.start, -borrow_prev)
-    cur.end = add_seconds_to_time(cur.end, +borrow_next)
+    cur["start_ordinal"] = add_seconds_to_ordinal(cur["start_ordinal"], -borrow_prev)
+    cur["end_ordinal"] = add_seconds_to_ordinal(cur["end_ordinal"], +borrow_next)
 
     if idx > 0:
         prev = subs[idx - 1]
-        if (cur.start.ordinal - prev.end.ordinal) / 1000.0 < min_gap:
-            cur.start = add_seconds_to_time(prev.end, min_gap)
+        if (cur["start_ordinal"] - prev["end_ordinal"]) / 1000.0 < min_gap:
+            cur["start_ordinal"] = add_seconds_to_ordinal(prev["end_ordinal"], min_gap)
     if idx < len(subs) - 1:
         nxt = subs[idx + 1]
-        if (nxt.start.ordinal - cur.end.ordinal) / 1000.0 < min_gap:
-            cur.end = add_seconds_to_time(nxt.start, -min_gap)
+        if (nxt["start_ordinal"] - cur["end_ordinal"]) / 1000.0 < min_gap:
+            cur["end_ordinal"] = add_seconds_to_ordinal(nxt["start_ordinal"], -min_gap)
 
     return True
 
 
+def _cps_pass(subs, cps, exclude_spaces, model, api_base, api_key, max_shift, min_gap, no_compress_pass):
+    """
+    批量翻译完成后的收尾：超 CPS 的条目先请求精简，仍超限再微调时间轴。
+    返回 (mapping, msg)；mapping 的键为字幕 index。
+    """
+    # 派生值（时长/最大字数/字数）只算一次并缓存在数组里；
+    # 处理第 i 条只会改动第 i 条自身，改动后就地刷新第 i 项，最后直接据此汇总超限项
+    durs, limits, lengths = cps_limits(subs, cps, exclude_spaces)
+    for i in np.flatnonzero(lengths > limits).tolist():
+        sub = subs[i]
+        dur = float(durs[i])
+        max_chars = int(limits[i])
+        length = int(lengths[i])
+
+        if not no_compress_pass:
+            sub["text"] = compress_to_limit(
+                text=sub["text"],
+                max_chars=max_chars,
+                model=model,
+                api_base=api_base,
+                api_key=api_key,
+            )
+            length = lengths[i] = visible_len(sub["text"], exclude_spaces)
+            if length <= max_chars:
+                continue
+
+        needed = length / cps
+        deficit = needed - dur
+        if deficit > 0 and adjust_timeline_for_cps(
+            subs=subs,
+            idx=i,
+            cps=cps,
+            exclude_spaces=exclude_spaces,
+            min_gap=min_gap,
+            max_shift=max_shift,
+        ):
+            durs[i] = max(0.01, duration_seconds(sub))
+            limits[i] = math.floor(durs[i] * cps)
+
+    still_violations = [
+        (subs[i]["index"], int(lengths[i]), int(limits[i]))
+        for i in np.flatnonzero(lengths > limits).tolist()
+    ]
+
+    mapping = {int(sub["index"]): sub["text"] for sub in subs}
+
+    if still_violations:
+        head = ", ".join(
+            [f"id={sid}:{L}>{M}" for sid, L, M in still_violations[:5]]
+        )
+        more = "" if len(still_violations) <= 5 else f" 等共 {len(still_violations)} 条"
+        msg = f"已写出文件，但仍有部分字幕超过 CPS：{head}{more}（建议人工复核或放宽限制）。"
+    else:
+        msg = "翻译完成，所有字幕均满足 CPS 限制。"
+    return mapping, msg
+
+
 def translate_srt(
     subs: list[dict],
     target_lang: str = "zh",
@@ -246,75 +391,117 @@ def translate_srt(
         api_base = os.getenv("OPENAI_API_BASE") or args.api_base
         api_key = os.getenv("OPENAI_API_KEY") or ""
         model = os.getenv("LLM_MODEL") or args.model
-        for start in range(0, len(subs), batch_size):
-            end = min(len(subs), start + batch_size)
-            batch_translate(
-                subs=subs,
-                start_idx=start,
-                end_idx=end,
-                cps=cps,
-                target_lang=target_lang,
-                model=model,
-                api_base=api_base,
-                api_key=api_key,
-                exclude_spaces=exclude_spaces,
-            )
-
-        for i in range(len(subs)):
-            sub = subs[i]
-            dur = max(0.01, duration_seconds(sub))
-            max_chars = int(math.floor(dur * cps))
-            length = visible_len(sub["text"], exclude_spaces)
-            if length <= max_chars:
-                continue
-
-            if not no_compress_pass:
-                sub["text"] = compress_to_limit(
-                    text=sub["text"],
-                    max_chars=max_chars,
+        # 各批次写回的下标区间互不重叠，可并发请求
+        ranges = [(start, min(len(subs), start + batch_size)) for start in range(0, len(subs), batch_size)]
+        with ThreadPoolExecutor(max_workers=min(TRANSLATE_CONCURRENCY, max(1, len(ranges)))) as pool:
+            futures = [
+                pool.submit(
+                    batch_translate,
+                    subs=subs,
+                    start_idx=start,
+                    end_idx=end,
+                    cps=cps,
+                    target_lang=target_lang,
                     model=model,
                     api_base=api_base,
                     api_key=api_key,
-                )
-                length = visible_len(sub["text"], exclude_spaces)
-                if length <= max_chars:
-                    continue
-
-            needed = length / cps
-            deficit = needed - dur
-            if deficit > 0:
-                adjust_timeline_for_cps(
-                    subs=subs,
-                    idx=i,
-                    cps=cps,
                     exclude_spaces=exclude_spaces,
-                    min_gap=min_gap,
-                    max_shift=max_shift,
                 )
+                for start, end in ranges
+            ]
+            try:
+                for f in futures:
+                    f.result()  # 任一批次失败即抛出
+            except Exception:
+                pool.shutdown(wait=False, cancel_futures=True)
+                raise
+
+        mapping, msg = _cps_pass(
+            subs, cps, exclude_spaces, model, api_base, api_key, max_shift, min_gap, no_compress_pass,
+        )
+        return mapping, True, msg
 
-        still_violations = []
-        for sub in subs:
-            dur = max(0.01, duration_seconds(sub))
-            max_chars = int(math.floor(dur * cps))
-            length = visible_len(sub["text"], exclude_spaces)
-            if length > max_chars:
-                still_violations.append((sub["index"], length, max_chars))
+    except Exception as e:
+        return {}, False, f"翻译失败：{e}"
 
-        mapping = {int(sub["index"]): sub["text"] for sub in subs}
 
-        if still_violations:
-            head = ", ".join(
-                [f"id={sid}:{L}>{M}" for sid, L, M in still_violations[:5]]
-            )
-            more = "" if len(still_violations) <= 5 else f" 等共 {len(still_violations)} 条"
-            msg = f"已写出文件，但仍有部分字幕超过 CPS：{head}{more}（建议人工复核或放宽限制）。"
-        else:
-            msg = "翻译完成，所有字幕均满足 CPS 限制。"
+class StreamingTranslator:
+    """
+    边识别边翻译：add() 逐条收字幕，每凑满 batch_size 条就把这一批提交给线程池请求 LLM，
+    与后续的识别重叠；finish() 补发尾批、等全部批次完成，再做与 translate_srt 相同的 CPS 收尾。
+    作为上下文管理器使用，提前退出（取消/异常）时丢弃尚未开始的批次。
+    """
 
-        return mapping, True, msg
+    def __init__(
+        self,
+        target_lang: str = "zh",
+        cps: float = 15.0,
+        exclude_spaces: bool = False,
+        batch_size: int = 20,
+        max_shift: float = 1.0,
+        min_gap: float = 0.10,
+        no_compress_pass: bool = False,
+    ):
+        self.target_lang = target_lang
+        self.cps = cps
+        self.exclude_spaces = exclude_spaces
+        self.batch_size = batch_size
+        self.max_shift = max_shift
+        self.min_gap = min_gap
+        self.no_compress_pass = no_compress_pass
+        # 缺省值与命令行参数的默认值一致
+        self.api_base = os.getenv("OPENAI_API_BASE") or "https://api.openai.com/v1"
+        self.api_key = os.getenv("OPENAI_API_KEY") or ""
+        self.model = os.getenv("LLM_MODEL") or "gpt-4o-mini"
+        self.subs: list[dict] = []
+        self._submitted = 0
+        self._futures = []
+        self._pool = ThreadPoolExecutor(max_workers=TRANSLATE_CONCURRENCY)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self._pool.shutdown(wait=False, cancel_futures=True)
+        return False
 
-    except Exception as e:
-        return {}, False, f"翻译失败：{e}"
+    def _submit(self, end: int) -> None:
+        # 各批次写回的下标区间互不重叠；主线程只在末尾追加，与批次线程不冲突
+        self._futures.append(self._pool.submit(
+            batch_translate,
+            subs=self.subs,
+            start_idx=self._submitted,
+            end_idx=end,
+            cps=self.cps,
+            target_lang=self.target_lang,
+            model=self.model,
+            api_base=self.api_base,
+            api_key=self.api_key,
+            exclude_spaces=self.exclude_spaces,
+        ))
+        self._submitted = end
+
+    def add(self, sub: dict) -> None:
+        """sub 形如 translate_srt 的输入项：index / start_ordinal / end_ordinal / text。"""
+        self.subs.append(sub)
+        if len(self.subs) - self._submitted >= self.batch_size:
+            self._submit(len(self.subs))
+
+    def finish(self):
+        """返回 (mapping, success, message)，与 translate_srt 一致。"""
+        try:
+            if self._submitted < len(self.subs):
+                self._submit(len(self.subs))
+            for f in self._futures:
+                f.result()  # 任一批次失败即抛出
+            mapping, msg = _cps_pass(
+                self.subs, self.cps, self.exclude_spaces, self.model, self.api_base, self.api_key,
+                self.max_shift, self.min_gap, self.no_compress_pass,
+            )
+            return mapping, True, msg
+        except Exception as e:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            return {}, False, f"翻译失败：{e}"
 
 
 def translate_srt_file(
@@ -356,6 +543,66 @@ def translate_srt_file(
         return {}, False, f"翻译失败：{e}"
 
 
+def subs_from_db(db, task_id: int) -> list[dict]:
+    """
+    直接从数据库字幕表构造 translate_srt 所需的 dict 列表（只查所需列，不落盘、不解析 SRT）。
+    """
+    from sqlalchemy import select
+    from app.models import Subtitle
+
+    stmt = (
+        select(Subtitle.sequence, Subtitle.start_time, Subtitle.end_time, Subtitle.original_text)
+        .where(Subtitle.task_id == task_id)
+        .order_by(Subtitle.sequence)
+    )
+    return [
+        {
+            "index": int(seq),
+            "start_ordinal": int(round(st * 1000)),
+            "end_ordinal": int(round(et * 1000)),
+            "text": text,
+        }
+        for seq, st, et, text in db.execute(stmt).tuples()
+    ]
+
+
+def translate_srt_db(
+    db,
+    task_id: int,
+    target_lang: str = "zh",
+    cps: float = 15.0,
+    exclude_spaces: bool = False,
+    model: str = "gpt-4o-mini",
+    api_base: str = "",
+    api_key: str = "",
+    batch_size: int = 20,
+    max_shift: float = 1.0,
+    min_gap: float = 0.10,
+    no_compress_pass: bool = False,
+):
+    """
+    与 translate_srt_file 相同，但字幕来自数据库（按 sequence 排序）。
+    返回: (mapping: dict[int, str], success: bool, message: str)，mapping 的键为 sequence
+    """
+    try:
+        subs = subs_from_db(db, task_id)
+    except Exception as e:
+        return {}, False, f"翻译失败：{e}"
+    return translate_srt(
+        subs=subs,
+        target_lang=target_lang,
+        cps=cps,
+        exclude_spaces=exclude_spaces,
+        model=model,
+        api_base=api_base,
+        api_key=api_key,
+        batch_size=batch_size,
+        max_shift=max_shift,
+        min_gap=min_gap,
+        no_compress_pass=no_compress_pass,
+    )
+
+
 # --------- 仅 OPENAI：从 .env / 环境变量解析配置 ---------
 def resolve_openai_config(args):
     """
@@ -378,7 +625,7 @@ def resolve_openai_config(args):
 # --------- 主流程 ---------
 def main():
     parser = argparse.ArgumentParser(
-        description="Translate SRT with CPS control and timeline tweaking (pysrt). [OPENAI only]"
+        description="Translate SRT with CPS control and timeline tweaking. [OPENAI only]"
     )
     parser.add_argument("--input", default="output.srt", help="Input .srt path")
     parser.add_argument("--output", default="output-t.srt", help="Output .srt path")
@@ -0,0 +1,107 @@
+# app/processors/subtts/audio.py
+# -*- coding: utf-8 -*-
+"""
+TTS 后端共用的进程内音频工具（soundfile + librosa + numpy）。
+统一输出单声道 float32，采样率默认 48k；不再为每条字幕 fork ffmpeg。
+"""
+import math
+import threading
+from typing import List, Tuple
+
+import numpy as np
+import soundfile as sf
+import librosa
+
+SAMPLE_RATE = 48000
+# 超出目标时长不多于该比例、且超出部分是静音时不做相位声码器变速，直接截断 + 淡出
+# （XTTS 句后补 10000 个采样的静音；edge-tts 的 MP3 在末个音素后很快结束，尾部可能仍是语音）
+STRETCH_SKIP_RATIO = 1.02
+# 被截掉部分的峰值不高于该幅度（约 -40 dBFS）才算静音
+TAIL_SILENCE_PEAK = 0.01
+FADE_OUT_SEC = 0.01
+# 分句合成后拼接处的交叉淡化长度（采样数），避免接缝爆音
+CROSSFADE_SAMPLES = 48
+
+
+def resample(y: np.ndarray, orig_sr: int, sr: int = SAMPLE_RATE) -> np.ndarray:
+    """单声道 float32 重采样到 sr（edge-tts / XTTS 均输出 24k）。"""
+    if orig_sr != sr and len(y):
+        y = librosa.resample(y, orig_sr=orig_sr, target_sr=sr)
+    return np.ascontiguousarray(y, dtype=np.float32)
+
+
+def load_audio(path: str, sr: int = SAMPLE_RATE) -> np.ndarray:
+    """读取音频为单声道 float32，并重采样到 sr。"""
+    y, file_sr = sf.read(path, dtype="float32", always_2d=True)
+    y = y.mean(axis=1) if y.shape[1] > 1 else y[:, 0]
+    return resample(y, file_sr, sr)
+
+
+def fit_to_duration(y: np.ndarray, target_sec: float, sr: int = SAMPLE_RATE) -> np.ndarray:
+    """比目标时长长则变速压缩到目标时长；短于目标则原样返回（后续补静音）。"""
+    d = len(y) / float(sr)
+    if d <= 0 or target_sec <= 0 or d < target_sec:
+        return y
+    ratio = d / target_sec
+    target_len = int(round(target_sec * sr))
+    if ratio <= STRETCH_SKIP_RATIO and float(np.abs(y[target_len:]).max(initial=0.0)) <= TAIL_SILENCE_PEAK:
+        y2 = y[:target_len].copy()
+        fade = min(len(y2), int(FADE_OUT_SEC * sr))
+        if fade:
+            y2[-fade:] *= np.linspace(1.0, 0.0, fade, dtype=np.float32)
+        return y2
+    y2 = librosa.effects.time_stretch(y, rate=ratio)
+    return y2.astype(np.float32, copy=False)
+
+
+def concat_crossfade(parts: List[np.ndarray], n: int = CROSSFADE_SAMPLES) -> np.ndarray:
+    """顺序拼接多段波形，每个接缝处做 n 个采样的 Hann 交叉淡化。"""
+    parts = [p for p in parts if len(p)]
+    if not parts:
+        return np.zeros(0, dtype=np.float32)
+    out = parts[0]
+    for p in parts[1:]:
+        k = min(n, len(out), len(p))
+        if k:
+            fade_in = np.sin(np.linspace(0.0, np.pi / 2, k, dtype=np.float32)) ** 2
+            mid = out[-k:] * (1.0 - fade_in) + p[:k] * fade_in
+            out = np.concatenate([out[:-k], mid, p[k:]])
+        else:
+            out = np.concatenate([out, p])
+    return out
+
+
+class Mixdown:
+    """
+    总轨混音：按采样偏移把各段波形直接累加到一块预分配的 float32 缓冲上，
+    无需生成前置静音文件，也不用 N 路输入的 amix。
+    """
+
+    def __init__(self, total_sec: float, sr: int = SAMPLE_RATE):
+        self.sr = sr
+        self.buf = np.zeros(int(math.ceil(max(0.0, total_sec) * sr)) + 1, dtype=np.float32)
+        self.length = 0
+        self._lock = threading.Lock()  # 多路并行合成时可能从多个线程累加
+
+    def add(self, y: np.ndarray, start_sec: float) -> None:
+        off = int(round(max(0.0, start_sec) * self.sr))
+        end = off + len(y)
+        with self._lock:
+            if end > len(self.buf):
+                # 变速取整误差可能略超预估长度，按需扩容
+                self.buf = np.concatenate([self.buf, np.zeros(end - len(self.buf) + self.sr, dtype=np.float32)])
+            self.buf[off:end] += y
+            self.length = max(self.length, end)
+
+    @property
+    def duration(self) -> float:
+        return self.length / float(self.sr)
+
+    def write(self, out_path: str) -> Tuple[np.ndarray, int]:
+        """写出 WAV，并返回写出的混音 (float32 单声道, sr)，供调用方直接交给最终合成，不必回读文件。"""
+        mix = self.buf[:self.length]
+        peak = float(np.abs(mix).max()) if self.length else 0.0
+        if peak > 1.0:
+            mix = mix / peak  # 仅在削波时归一化
+        sf.write(out_path, mix, self.sr)
+        return mix, self.sr
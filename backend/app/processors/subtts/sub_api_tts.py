@@ -26,6 +26,7 @@
 import os
 from typing import Optional, Tuple, Literal
 from app.logs import get_logger
+from app.processors.subtts.timeline import parse_srt_items
 log = get_logger(__name__)
 
 # 获取当前文件路径
@@ -59,6 +60,12 @@ DEFAULT_ENGINE: EngineLiteral = "auto"
 DEFAULT_LANGUAGE = "en"
 DEFAULT_MODE = "shift"  # 与两个后端默认一致
 
+# 后端可用性与默认消解策略在导入后即固定，导入时算好
+_HAS_EDGE = _edge_mod is not None
+_HAS_XTTS = _xtts_mod is not None
+_EDGE_DEFAULT_MODE = getattr(_edge_mod, "RESOLVE_MODE", DEFAULT_MODE) if _HAS_EDGE else DEFAULT_MODE
+_XTTS_DEFAULT_MODE = getattr(_xtts_mod, "RESOLVE_MODE", DEFAULT_MODE) if _HAS_XTTS else DEFAULT_MODE
+
 
 def _pick_engine(
     engine: EngineLiteral, has_edge: bool, has_xtts: bool, ref_wav: Optional[str]
@@ -94,6 +101,7 @@ def srt_to_tts(
     resolve_mode: Optional[str] = None,
     voiceid: Optional[str] = None,
     task_id: Optional[int] = None,
+    mix_out: Optional[dict] = None,
 ) -> Tuple[bool, str]:
     """
     规则：
@@ -101,14 +109,24 @@ def srt_to_tts(
       - voiceid != "auto": 先使用 edge-tts；只要失败/异常/不可用，再回退 XTTS
                            （XTTS 使用固定 sample 路径作为参考音色）。
 
+    mix_out 非 None 时，成功的后端把写出的混音 (pcm, sr) 放进 mix_out["pcm"]。
+
     返回 (ok, msg)
     """
     log.info(f"[srt_to_tts] voiceid={voiceid} lang={language} refp={refp_or_tname}")
-    has_edge = _edge_mod is not None
-    has_xtts = _xtts_mod is not None
+    has_edge = _HAS_EDGE
+    has_xtts = _HAS_XTTS
     log.info(f"has_edge={has_edge} has_xtts={has_xtts}")
-    edge_mode = resolve_mode if resolve_mode else (getattr(_edge_mod, "RESOLVE_MODE", DEFAULT_MODE) if has_edge else DEFAULT_MODE)
-    xtts_mode = resolve_mode if resolve_mode else (getattr(_xtts_mod, "RESOLVE_MODE", DEFAULT_MODE) if has_xtts else DEFAULT_MODE)
+    edge_mode = resolve_mode or _EDGE_DEFAULT_MODE
+    xtts_mode = resolve_mode or _XTTS_DEFAULT_MODE
+
+    # 只解析一次 SRT，edge / XTTS（含回退）共用；解析失败交给后端按原逻辑报错
+    items = None
+    try:
+        if os.path.exists(srt_path):
+            items = parse_srt_items(srt_path)
+    except Exception as e:
+        log.warning(f"[srt_to_tts] 预解析字幕失败，交由后端处理：{type(e).__name__}: {e}")
 
     # -------- 情况 A：voiceid == "auto" -> 只用 XTTS --------
     if voiceid == "auto":
@@ -127,6 +145,8 @@ def srt_to_tts(
                 language=language,
                 resolve_mode=xtts_mode,
                 task_id=task_id, 
+                parsed_items=items,
+                mix_out=mix_out,
             )
         except Exception as e:
             return False, f"[错误] XTTS 合成失败：{type(e).__name__}: {e}"
@@ -149,6 +169,8 @@ def srt_to_tts(
                 language=language,
                 resolve_mode=edge_mode,
                 task_id=task_id, 
+                parsed_items=items,
+                mix_out=mix_out,
             )
             log.info(f"edge tts DONE -> {ok} {msg}")
             if ok:
@@ -179,6 +201,8 @@ def srt_to_tts(
             out_path=out_path,
             language=language,
             resolve_mode=xtts_mode,
+            parsed_items=items,
+            mix_out=mix_out,
         )
         if ok2:
             return True, f"[edge-tts 未成功，已回退至 XTTS] {edge_err}"
@@ -1,22 +1,19 @@
 # subtts/sub_edge_tts.py
 # -*- coding: utf-8 -*-
 import os
+import re
 import sys
 import json
-import pysrt
 import tempfile
 import threading
 import asyncio
-from typing import List, Tuple, Optional
+from typing import Callable, List, Tuple, Optional
 
 import edge_tts
 
 from app.cancel import is_stop_requested
-from app.processors.utils import (
-    killable_run,
-    killable_check_output,
-)
-
+from app.processors.subtts.timeline import parse_srt_items, build_non_overlapping_timeline
+from app.processors.subtts.audio import load_audio, fit_to_duration, concat_crossfade, Mixdown
 from app.logs import get_logger
 log = get_logger(__name__)
 
@@ -29,76 +26,13 @@ RESOLVE_MODE = "shift"
 SAFE_GAP = 0.02
 MIN_DUR = 0.10
 
-def run_cmd(cmd: List[str], task_id: Optional[int] = None) -> str:
-    return killable_check_output(cmd, task_id=task_id)
-
-
-def ffprobe_duration(path: str, task_id: Optional[int] = None) -> float:
-    cmd = ["ffprobe", "-v", "error", "-show_entries", "format=duration", "-of", "default=noprint_wrappers=1:nokey=1", path]
-    return float(run_cmd(cmd, task_id=task_id))
-
-
-def atempo_chain_ratio(ratio: float) -> List[float]:
-    steps: List[float] = []
-    cur = 1.0
-    while abs(cur - ratio) > 1e-4:
-        step = max(0.5, min(2.0, ratio / cur))
-        if 0.9999 < step < 1.0001:
-            break
-        steps.append(step)
-        cur *= step
-    return steps
-
-
-def time_stretch_to(in_wav: str, target_sec: float, out_wav: str, task_id: Optional[int] = None) -> None:
-    try:
-        d = ffprobe_duration(in_wav, task_id=task_id)
-    except Exception:
-        killable_run(["ffmpeg", "-y", "-i", in_wav, out_wav], task_id=task_id, check=True)
-        return
-    if d <= 0 or target_sec <= 0 or d < target_sec:
-        killable_run(["ffmpeg", "-y", "-i", in_wav, out_wav], task_id=task_id, check=True)
-        return
-    steps = atempo_chain_ratio(d / target_sec)
-    filt = ",".join([f"atempo={s}" for s in steps]) if steps else "anull"
-    killable_run(["ffmpeg", "-y", "-i", in_wav, "-filter:a", filt, out_wav], task_id=task_id, check=True)
-
-def pad_to_start(in_wav: str, start_sec: float, out_wav: str, sr: int = SAMPLE_RATE, task_id: Optional[int] = None) -> None:
-    if start_sec <= 0:
-        killable_run(["ffmpeg", "-y", "-i", in_wav, out_wav], task_id=task_id, check=True)
-        return
-    tmp_sil = out_wav + ".sil.wav"
-    killable_run(["ffmpeg", "-y", "-f", "lavfi", "-i", f"anullsrc=r={sr}:cl=mono", "-t", f"{start_sec:.3f}", tmp_sil], task_id=task_id, check=True)
-    killable_run(["ffmpeg", "-y", "-i", tmp_sil, "-i", in_wav, "-filter_complex", "[0:a][1:a]concat=n=2:v=0:a=1", out_wav], task_id=task_id, check=True)
-    try:
-        os.remove(tmp_sil)
-    except Exception:
-        pass
-
-
-def build_non_overlapping_timeline(
-    items: List[Tuple[float, float, str]],
-    mode: str = RESOLVE_MODE,
-    safe_gap: float = SAFE_GAP,
-) -> List[Tuple[float, float, str]]:
-    result: List[Tuple[float, float, str]] = []
-    prev_end = 0.0
-    for start, end, text in items:
-        start = max(0.0, float(start))
-        end = max(start + MIN_DUR, float(end))
-        orig_dur = end - start
-        if mode == "shift":
-            adj_start = max(start, prev_end + safe_gap)
-            adj_end = adj_start + max(MIN_DUR, orig_dur)
-        elif mode == "compress":
-            adj_start = max(start, prev_end + safe_gap)
-            adj_end = max(adj_start + MIN_DUR, min(end, adj_start + orig_dur))
-        else:
-            raise ValueError("RESOLVE_MODE 只能为 'shift' 或 'compress'")
-        result.append((adj_start, adj_end, text))
-        prev_end = adj_end
-    return result
+# 同时在途的 edge-tts 请求数（纯网络等待，适当放大可近线性提速）
+EDGE_TTS_CONCURRENCY = max(1, int(os.getenv("EDGE_TTS_CONCURRENCY", "8")))
 
+# 超过该长度的字幕按句拆开并发合成后再拼接（长句单请求耗时线性增长，常成为关键路径）
+LONG_TEXT_THRESH = 200
+MIN_PART_CHARS = 40
+_SENT_SPLIT_RE = re.compile(r"(?<=[.?!])\s+|(?<=[。！？])")
 
 def _speed_to_rate(speed: float) -> str:
     pct = int(round((speed - 1.0) * 100))
@@ -106,27 +40,101 @@ def _speed_to_rate(speed: float) -> str:
     return f"{sign}{pct}%"
 
 
+# BASE_SPEED 为常量，rate 字符串在导入时算好
+_EDGE_RATE_DEFAULT = _speed_to_rate(BASE_SPEED)
+
+
 async def _edge_tts_save_async(text: str, out_path: str, voice: str, rate: str) -> None:
     communicate = edge_tts.Communicate(text=text, voice=voice, rate=rate)
     await communicate.save(out_path)
 
 
-def edge_tts_to_file(text: str, out_path: str, voice: str, rate: str, task_id: Optional[int] = None) -> None:
-    # 在进入合成前检查一次
-    if task_id is not None and is_stop_requested(task_id):
-        raise RuntimeError("Cancelled")
+_BG_LOOP: Optional[asyncio.AbstractEventLoop] = None
+_BG_THREAD: Optional[threading.Thread] = None
+_BG_LOCK = threading.Lock()
+
+
+def _get_bg_loop() -> asyncio.AbstractEventLoop:
+    """
+    常驻后台事件循环（守护线程，惰性创建）：整个进程的 edge-tts 合成共用，
+    不再每个 SRT / 每条字幕都 asyncio.run 新建并销毁事件循环。
+    """
+    global _BG_LOOP, _BG_THREAD
+    if _BG_LOOP is not None and _BG_THREAD is not None and _BG_THREAD.is_alive():
+        return _BG_LOOP
+    with _BG_LOCK:
+        if _BG_LOOP is None or _BG_THREAD is None or not _BG_THREAD.is_alive():
+            loop = asyncio.new_event_loop()
+            t = threading.Thread(target=loop.run_forever, name="edge-tts-loop", daemon=True)
+            t.start()
+            _BG_LOOP, _BG_THREAD = loop, t
+        return _BG_LOOP
+
+
+def split_sentences(text: str) -> List[str]:
+    """按句末标点切分；过短的句子并入前一句，避免产生大量零碎请求。"""
+    parts: List[str] = []
+    for sen in _SENT_SPLIT_RE.split(text):
+        sen = sen.strip()
+        if not sen:
+            continue
+        if parts and len(parts[-1]) < MIN_PART_CHARS:
+            sep = "" if parts[-1][-1] in "。！？" else " "
+            parts[-1] = f"{parts[-1]}{sep}{sen}"
+        else:
+            parts.append(sen)
+    return parts or [text]
+
+
+async def _synth_all(
+    jobs: List[Tuple[str, str]],
+    voice: str,
+    rate: str,
+    task_id: Optional[int] = None,
+    concurrency: int = EDGE_TTS_CONCURRENCY,
+    on_done: Optional[Callable[[int], None]] = None,
+) -> None:
+    """
+    单个事件循环内并发合成全部 (text, out_path)：
+      - Semaphore 限制同时在途的请求数；
+      - 后台协程轮询 stop，命中后取消全部在途请求；
+      - 每条完成后回调 on_done(下标)，供调用方流水线式处理；
+      - 任一条失败即取消其余条目并上抛。
+    """
+    sem = asyncio.Semaphore(max(1, concurrency))
+    stop = asyncio.Event()
+
+    async def _one(k: int, text: str, out_path: str) -> None:
+        async with sem:
+            if stop.is_set():
+                raise asyncio.CancelledError()
+            await _edge_tts_save_async(text, out_path, voice, rate)
+        if on_done is not None:
+            on_done(k)
+
+    tasks = [asyncio.ensure_future(_one(k, text, out_path)) for k, (text, out_path) in enumerate(jobs)]
+
+    async def _watch_stop() -> None:
+        while not stop.is_set():
+            await asyncio.sleep(0.2)
+            if is_stop_requested(task_id):
+                stop.set()
+                for t in tasks:
+                    t.cancel()
+
+    watcher = asyncio.ensure_future(_watch_stop()) if task_id is not None else None
     try:
-        asyncio.get_running_loop()
-        def _runner():
-            asyncio.run(_edge_tts_save_async(text, out_path, voice, rate))
-        t = threading.Thread(target=_runner, daemon=True)
-        t.start()
-        t.join()
-    except RuntimeError:
-        asyncio.run(_edge_tts_save_async(text, out_path, voice, rate))
-    # 合成结束后再检查一次（尽快上抛取消）
-    if task_id is not None and is_stop_requested(task_id):
-        raise RuntimeError("Cancelled")
+        await asyncio.gather(*tasks)
+    except BaseException:
+        for t in tasks:
+            t.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if stop.is_set():
+            raise RuntimeError("Cancelled") from None
+        raise
+    finally:
+        if watcher is not None:
+            watcher.cancel()
 
 
 def srt_to_tts(
@@ -136,65 +144,80 @@ def srt_to_tts(
     language: str = "en",
     resolve_mode: str = RESOLVE_MODE,
     task_id: Optional[int] = None,  # <--- 新增
+    parsed_items: Optional[List[Tuple[float, float, str]]] = None,
+    mix_out: Optional[dict] = None,
 ) -> Tuple[bool, str]:
     try:
         log.info(f"开始处理字幕文件edge：{srt_path}")
-        if not os.path.exists(srt_path):
+        if parsed_items is None and not os.path.exists(srt_path):
             return False, f"[错误] 找不到字幕文件：{srt_path}"
 
-        subs = pysrt.open(srt_path, encoding="utf-8")
-        raw_items: List[Tuple[float, float, str]] = [(s.start.ordinal/1000.0, s.end.ordinal/1000.0, s.text) for s in subs]
+        # 调用方已解析过（如 sub_api_tts 回退路径）则直接复用
+        raw_items = parsed_items if parsed_items is not None else parse_srt_items(srt_path)
         schedule = build_non_overlapping_timeline(raw_items, resolve_mode, SAFE_GAP)
 
-        rate = _speed_to_rate(BASE_SPEED)
-
-        tmpdir = tempfile.mkdtemp(prefix="srt_tts_")
-        segments: List[str] = []
-
-        try:
-            for i, (adj_start, adj_end, text) in enumerate(schedule, 1):
-                log.info(f"字幕处理：{i}/{len(schedule)} {text}")
-                if task_id is not None and is_stop_requested(task_id):
-                    raise RuntimeError("Cancelled")
-                target_dur = max(MIN_DUR, adj_end - adj_start)
-                raw = os.path.join(tmpdir, f"raw_{i:04d}.wav")
-                fit = os.path.join(tmpdir, f"fit_{i:04d}.wav")
-                pad = os.path.join(tmpdir, f"pad_{i:04d}.wav")
-
-                edge_tts_to_file(text=text, out_path=raw, voice=tts_name, rate=rate, task_id=task_id)
-
-                if task_id is not None and is_stop_requested(task_id):
-                    raise RuntimeError("Cancelled")
-
-                time_stretch_to(raw, target_dur, fit, task_id=task_id)
-                pad_to_start(fit, adj_start, pad, sr=SAMPLE_RATE, task_id=task_id)
-                segments.append(pad)
-
-            if not segments:
+        rate = _EDGE_RATE_DEFAULT
+
+        mix = Mixdown(max((e for _, e, _ in schedule), default=0.0), SAMPLE_RATE)
+
+        # 退出时整目录 rmtree 清理，无需逐个 listdir/remove
+        with tempfile.TemporaryDirectory(prefix="srt_tts_", ignore_cleanup_errors=True) as tmpdir:
+            if task_id is not None and is_stop_requested(task_id):
+                raise RuntimeError("Cancelled")
+            # 每条字幕一个或多个合成任务（长句拆句）；edge-tts 实际输出为 mp3，扩展名需如实，soundfile 才能按格式解码
+            jobs: List[Tuple[str, str]] = []
+            job_seg: List[int] = []
+            raws: List[List[str]] = []
+            for i, (_, _, text) in enumerate(schedule, 1):
+                parts = split_sentences(text) if len(text) > LONG_TEXT_THRESH else [text]
+                paths = [os.path.join(tmpdir, f"raw_{i:04d}_{j:02d}.mp3") for j in range(len(parts))]
+                jobs.extend(zip(parts, paths))
+                job_seg.extend([i - 1] * len(parts))
+                raws.append(paths)
+            pending = [len(paths) for paths in raws]
+            ready = [threading.Event() for _ in schedule]
+
+            def _on_done(k: int) -> None:
+                # 仅在后台事件循环线程中调用，计数无需加锁
+                seg = job_seg[k]
+                pending[seg] -= 1
+                if pending[seg] == 0:
+                    ready[seg].set()
+
+            log.info(f"并发合成 {len(schedule)} 条字幕 / {len(jobs)} 个请求（并发 {EDGE_TTS_CONCURRENCY}）")
+
+            # 合成提交到常驻后台事件循环并发进行（网络 I/O 为主）；
+            # 主线程按顺序等第 i 条就绪后立刻对齐时长并累加进总轨
+            ahead = asyncio.run_coroutine_threadsafe(_synth_all(
+                jobs, voice=tts_name, rate=rate, task_id=task_id, on_done=_on_done,
+            ), _get_bg_loop())
+            try:
+                for i, ((adj_start, adj_end, text), paths) in enumerate(zip(schedule, raws), 1):
+                    while not ready[i - 1].wait(0.2):
+                        if ahead.done():
+                            ahead.result()  # 合成失败/取消在此上抛
+                    log.info(f"字幕处理：{i}/{len(schedule)} {text}")
+                    if task_id is not None and is_stop_requested(task_id):
+                        raise RuntimeError("Cancelled")
+                    target_dur = max(MIN_DUR, adj_end - adj_start)
+                    y = concat_crossfade([load_audio(p, SAMPLE_RATE) for p in paths])
+                    y = fit_to_duration(y, target_dur, SAMPLE_RATE)
+                    mix.add(y, adj_start)
+                ahead.result()
+            finally:
+                # 主线程异常退出时取消后台仍在途的合成
+                if not ahead.done():
+                    ahead.cancel()
+
+            if not schedule:
                 return False, "[错误] 字幕为空，未生成任何音频。"
 
-            cmd = ["ffmpeg", "-y"]
-            for p in segments:
-                cmd += ["-i", p]
-            fc = "".join([f"[{i}:a]" for i in range(len(segments))]) + f"amix=inputs={len(segments)}:normalize=0[a]"
-            cmd += ["-filter_complex", fc, "-map", "[a]", "-ar", str(SAMPLE_RATE), out_path]
-            killable_run(cmd, task_id=task_id, check=True)
+            pcm = mix.write(out_path)
+            if mix_out is not None:
+                mix_out["pcm"] = pcm  # 交回调用方直送最终合成，不经全局缓存
 
-            try:
-                total = ffprobe_duration(out_path, task_id=task_id)
-                return True, f"[INFO] 生成成功：{out_path}（时长 {total:.3f}s）"
-            except Exception:
-                return True, f"[INFO] 生成成功：{out_path}"
-        finally:
-            try:
-                for fn in os.listdir(tmpdir):
-                    try:
-                        os.remove(os.path.join(tmpdir, fn))
-                    except Exception:
-                        pass
-                os.rmdir(tmpdir)
-            except Exception:
-                pass
+            # 时长直接取自混音缓冲，不再为日志起 ffprobe
+            return True, f"[INFO] 生成成功：{out_path}（时长 {mix.duration:.3f}s）"
 
     except RuntimeError as e:
         if str(e) == "Cancelled":
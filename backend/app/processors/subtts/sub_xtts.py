@@ -3,18 +3,21 @@
 import os
 import sys
 import time
-import pysrt
 import queue
-import tempfile
+import atexit
+import contextlib
 import multiprocessing as mp
+from multiprocessing import shared_memory
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_EXCEPTION
 from dataclasses import dataclass
 from typing import List, Tuple, Optional
 
+import numpy as np
+
 from app.cancel import is_stop_requested
-from app.processors.utils import (
-    killable_run,
-    killable_check_output,
-)
+from app.processors.subtts.timeline import parse_srt_items, build_non_overlapping_timeline
+from app.processors.subtts.audio import resample, fit_to_duration, Mixdown
 from app.logs import get_logger
 log = get_logger(__name__)
 
@@ -26,141 +29,251 @@ RESOLVE_MODE = "shift"    # "shift" | "compress"
 SAFE_GAP = 0.02
 MIN_DUR = 0.10
 
-# -------- 小工具 --------
-def run_cmd(cmd: List[str], task_id: Optional[int] = None) -> str:
-    return killable_check_output(cmd, task_id=task_id)
-
-def ffprobe_duration(path: str, task_id: Optional[int] = None) -> float:
-    cmd = ["ffprobe","-v","error","-show_entries","format=duration","-of","default=noprint_wrappers=1:nokey=1",path]
-    out = run_cmd(cmd, task_id=task_id).strip()
-    return float(out) if out else 0.0
-
-def atempo_chain_ratio(ratio: float) -> List[float]:
-    steps: List[float] = []
-    cur = 1.0
-    while abs(cur - ratio) > 1e-4:
-        step = max(0.5, min(2.0, ratio / cur))
-        if 0.9999 < step < 1.0001:
-            break
-        steps.append(step)
-        cur *= step
-    return steps
-
-def time_stretch_to(in_wav: str, target_sec: float, out_wav: str, task_id: Optional[int] = None) -> None:
-    try:
-        d = ffprobe_duration(in_wav, task_id=task_id)
-    except Exception:
-        killable_run(["ffmpeg", "-y", "-i", in_wav, out_wav], task_id=task_id, check=True)
-        return
-    if d <= 0 or target_sec <= 0 or d < target_sec:
-        killable_run(["ffmpeg", "-y", "-i", in_wav, out_wav], task_id=task_id, check=True)
-        return
-    steps = atempo_chain_ratio(d / target_sec)
-    filt = ",".join([f"atempo={s}" for s in steps]) if steps else "anull"
-    killable_run(["ffmpeg", "-y", "-i", in_wav, "-filter:a", filt, out_wav], task_id=task_id, check=True)
-
-def pad_to_start(in_wav: str, start_sec: float, out_wav: str, sr: int = SAMPLE_RATE, task_id: Optional[int] = None) -> None:
-    if start_sec <= 0:
-        killable_run(["ffmpeg", "-y", "-i", in_wav, out_wav], task_id=task_id, check=True)
-        return
-    tmp_sil = out_wav + ".sil.wav"
-    killable_run(["ffmpeg", "-y", "-f", "lavfi", "-i", f"anullsrc=r={sr}:cl=mono", "-t", f"{start_sec:.3f}", tmp_sil], task_id=task_id, check=True)
-    killable_run(["ffmpeg", "-y", "-i", tmp_sil, "-i", in_wav, "-filter_complex", "[0:a][1:a]concat=n=2:v=0:a=1", out_wav], task_id=task_id, check=True)
-    try:
-        os.remove(tmp_sil)
-    except Exception:
-        pass
-
-def build_non_overlapping_timeline(
-    items: List[Tuple[float, float, str]],
-    mode: str = RESOLVE_MODE,
-    safe_gap: float = SAFE_GAP,
-) -> List[Tuple[float, float, str]]:
-    result: List[Tuple[float, float, str]] = []
-    prev_end = 0.0
-    for start, end, text in items:
-        start = max(0.0, float(start))
-        end = max(start + MIN_DUR, float(end))
-        orig_dur = end - start
-        if mode == "shift":
-            adj_start = max(start, prev_end + safe_gap)
-            adj_end = adj_start + max(MIN_DUR, orig_dur)
-        elif mode == "compress":
-            adj_start = max(start, prev_end + safe_gap)
-            adj_end = max(adj_start + MIN_DUR, min(end, adj_start + orig_dur))
-        else:
-            raise ValueError("RESOLVE_MODE 只能为 'shift' 或 'compress'")
-        result.append((adj_start, adj_end, text))
-        prev_end = adj_end
-    return result
+# worker -> 父进程的 PCM 经共享内存块传递（按 24k 单声道 float32 计容量），轮换使用
+XTTS_SHM_BLOCKS = 4
+XTTS_SHM_SEC = 60
+XTTS_OUTPUT_SR = 24000
+
+# 多卡时把时间轴切成 K 段连续区间，每段一个常驻 worker 并固定到一张卡上
+XTTS_NUM_GPUS = max(1, int(os.getenv("XTTS_NUM_GPUS", "1")))
+
+# 推理精度：fp16 | bf16 | fp32；半精度下自回归解码的显存带宽减半，个别音色有杂音时可退回 fp32
+XTTS_DTYPE = os.getenv("XTTS_DTYPE", "fp16").strip().lower()
 
 # -------- Worker 进程实现：常驻加载 XTTS 模型 --------
 @dataclass
 class SynthReq:
     text: str
-    out_path: str
     language: str
     speaker_wav: Optional[str]
+    slot: int = -1        # 本条使用的共享内存块；-1 表示走队列传输
+    rid: int = 0          # 请求号，响应按它归属（可有多条在途）
+
+@dataclass
+class ChunkResp:
+    audio: Optional[np.ndarray] = None  # 共享内存写不下时随消息传递的 PCM（float32，单声道）
+    offset: int = 0                     # 否则为共享内存块内的 [offset, offset+n)
+    n: int = 0
+    rid: int = 0
 
 @dataclass
 class SynthResp:
     ok: bool
     err: str
+    sr: int = 0
+    audio: Optional[np.ndarray] = None  # 父进程拼好的整条音频
+    rid: int = 0                        # -1 表示进程级错误（如模型加载失败），不属于某条请求
+
+# 句后静音（与 Synthesizer.tts 一致的 10000 个采样）：只分配一次，各句复用同一只读缓冲
+_SENTENCE_TAIL = np.zeros(10000, dtype=np.float32)
+_SENTENCE_TAIL.setflags(write=False)
+
+def _to_pcm(wav) -> np.ndarray:
+    return np.asarray(wav.cpu() if hasattr(wav, "cpu") else wav, dtype=np.float32).reshape(-1)
 
-def _xtts_worker_main(req_q: mp.Queue, resp_q: mp.Queue):
+class _ChunkEmitter:
+    """子进程侧：把本条 PCM 顺序写入共享内存块，只在队列上发 (offset, n)；写不下的部分退回 pickle。"""
+
+    def __init__(self, resp_q: mp.Queue, buf: Optional[np.ndarray], rid: int):
+        self.resp_q = resp_q
+        self.buf = buf
+        self.rid = rid
+        self.pos = 0
+
+    def __call__(self, pcm: np.ndarray) -> None:
+        n = len(pcm)
+        if self.buf is not None and self.pos + n <= len(self.buf):
+            self.buf[self.pos:self.pos + n] = pcm
+            self.resp_q.put(ChunkResp(offset=self.pos, n=n, rid=self.rid))
+            self.pos += n
+        else:
+            self.resp_q.put(ChunkResp(audio=pcm, rid=self.rid))
+
+def _xtts_stream(tts, latents_cache: dict, item: SynthReq, emit: _ChunkEmitter) -> int:
+    """
+    流式合成单条：inference_stream 每解出一段 PCM 就经 emit 送回父进程，返回采样率。
+    提供参考音色时，说话人条件（gpt_cond_latent / speaker_embedding）按参考文件只算一次。
     """
-    子进程：常驻加载 XTTS；串行处理合成请求。
+    sr = tts.synthesizer.output_sample_rate
+    if not item.speaker_wav:
+        wav = tts.tts(text=item.text, speed=BASE_SPEED, language=item.language, speaker_wav=item.speaker_wav)
+        emit(_to_pcm(wav))
+        return sr
+    model = tts.synthesizer.tts_model
+    cfg = model.config
+    key = (item.speaker_wav, os.path.getmtime(item.speaker_wav))
+    latents = latents_cache.get(key)
+    if latents is None:
+        # 条件参数取自模型配置，与 tts()（Xtts.synthesize -> full_inference）一致，克隆音色不变
+        latents = model.get_conditioning_latents(
+            audio_path=[item.speaker_wav],
+            gpt_cond_len=cfg.gpt_cond_len,
+            gpt_cond_chunk_len=cfg.gpt_cond_chunk_len,
+            max_ref_length=cfg.max_ref_len,
+            sound_norm_refs=cfg.sound_norm_refs,
+        )
+        latents_cache[key] = latents
+    gpt_cond_latent, speaker_embedding = latents
+    # 采样参数同样沿用配置（tts() 路径的取值），只换成流式输出
+    sampling = dict(
+        temperature=cfg.temperature,
+        length_penalty=cfg.length_penalty,
+        repetition_penalty=cfg.repetition_penalty,
+        top_k=cfg.top_k,
+        top_p=cfg.top_p,
+    )
+    for sen in tts.synthesizer.split_into_sentences(item.text):
+        for chunk in model.inference_stream(
+            sen, item.language, gpt_cond_latent, speaker_embedding,
+            stream_chunk_size=20, speed=BASE_SPEED, **sampling,
+        ):
+            emit(_to_pcm(chunk))
+        emit(_SENTENCE_TAIL)
+    return sr
+
+def _inference_ctx(torch, dtype_name: str):
+    """推理上下文：inference_mode + （CUDA 可用且非 fp32 时）autocast 半精度。"""
+    amp_dtype = {"fp16": torch.float16, "bf16": torch.bfloat16}.get(dtype_name)
+    stack = contextlib.ExitStack()
+    stack.enter_context(torch.inference_mode())
+    if amp_dtype is not None and torch.cuda.is_available():
+        stack.enter_context(torch.autocast("cuda", dtype=amp_dtype))
+    return stack
+
+def _xtts_worker_main(req_q: mp.Queue, resp_q: mp.Queue, shm_names: Tuple[str, ...] = (), gpu: Optional[int] = None):
+    """
+    子进程：常驻加载 XTTS；按投递顺序串行处理合成请求（父进程可提前投递下一条）。
     说明：
       - 子进程里导入 TTS.api，避免父进程 GPU/线程状态污染；
-      - 每条执行 tts_to_file；出错把错误文本写回；
+      - 参考音色的条件向量在进程内缓存，同一 SRT 只跑一次 speaker encoder；
+      - 音频流式写入父进程分配的共享内存块，ChunkResp 只带偏移，不落盘也不 pickle 大数组；
+        每条以 SynthResp 结束，出错把错误文本写回；
       - 不做 stop 判断，父进程如需立即停止可直接 terminate 本进程。
     """
     try:
+        if gpu is not None:
+            # 须在导入 torch/TTS 之前设置
+            os.environ["CUDA_VISIBLE_DEVICES"] = str(gpu)
         # 惰性导入，保证父进程不持有大模型资源
+        import torch  # noqa
         from TTS.api import TTS  # noqa
         tts = TTS(MODEL_NAME, gpu=True, progress_bar=False)
+        latents_cache: dict = {}
+        shms = [shared_memory.SharedMemory(name=n) for n in shm_names]
+        bufs = [np.ndarray((shm.size // 4,), dtype=np.float32, buffer=shm.buf) for shm in shms]
         while True:
             item = req_q.get()  # 阻塞，父进程会 terminate
             if item is None:
                 resp_q.put(SynthResp(True, ""))  # 作为优雅退出的 ack
                 break
             assert isinstance(item, SynthReq)
-            os.makedirs(os.path.dirname(item.out_path), exist_ok=True)
             try:
-                tts.tts_to_file(
-                    text=item.text,
-                    file_path=item.out_path,
-                    speed=BASE_SPEED,
-                    language=item.language,
-                    speaker_wav=item.speaker_wav,
-                )
-                resp_q.put(SynthResp(True, ""))
+                buf = bufs[item.slot] if 0 <= item.slot < len(bufs) else None
+                with _inference_ctx(torch, XTTS_DTYPE):
+                    sr = _xtts_stream(tts, latents_cache, item, _ChunkEmitter(resp_q, buf, item.rid))
+                resp_q.put(SynthResp(True, "", sr=sr, rid=item.rid))  # 本条结束标记
             except Exception as e:
-                resp_q.put(SynthResp(False, f"{type(e).__name__}: {e}"))
+                resp_q.put(SynthResp(False, f"{type(e).__name__}: {e}", rid=item.rid))
     except Exception as e:
         # 若模型加载失败或进程级异常，通知父进程
         try:
-            resp_q.put(SynthResp(False, f"WorkerInitError: {type(e).__name__}: {e}"))
+            resp_q.put(SynthResp(False, f"WorkerInitError: {type(e).__name__}: {e}", rid=-1))
         except Exception:
             pass
         # 直接退出
         sys.exit(1)
 
 class XTTSWorker:
-    def __init__(self):
+    def __init__(self, gpu: Optional[int] = None):
+        self.gpu = gpu
         ctx = mp.get_context("spawn")  # 更稳健；如在 Linux 也可用 "fork"
+        # 请求队列容纳“当前条 + 预投递的下一条 + 重试”；响应队列只传偏移等小消息，
+        # 留足深度让子进程在父进程对齐/混音上一条时不被阻塞
         self.req_q: mp.Queue = ctx.Queue(maxsize=4)
-        self.resp_q: mp.Queue = ctx.Queue(maxsize=4)
-        self.p: mp.Process = ctx.Process(target=_xtts_worker_main, args=(self.req_q, self.resp_q), daemon=True)
+        self.resp_q: mp.Queue = ctx.Queue(maxsize=64)
+        self.shms: List[shared_memory.SharedMemory] = []
+        try:
+            for _ in range(XTTS_SHM_BLOCKS):
+                self.shms.append(shared_memory.SharedMemory(create=True, size=XTTS_SHM_SEC * XTTS_OUTPUT_SR * 4))
+        except Exception as e:
+            log.warning(f"[XTTS] 共享内存不可用，退回队列传输：{e}")
+            self._release_shms()
+        self._views = [np.ndarray((shm.size // 4,), dtype=np.float32, buffer=shm.buf) for shm in self.shms]
+        self._seq = 0
+        # 在途请求：rid -> 共享内存块 / 已收到的 PCM 块；已结束但尚未被 poll 取走的结果
+        self._slots: dict = {}
+        self._chunks: dict = {}
+        self._done: dict = {}
+        names = tuple(shm.name for shm in self.shms)
+        self.p: mp.Process = ctx.Process(target=_xtts_worker_main, args=(self.req_q, self.resp_q, names, gpu), daemon=True)
         self.p.start()
 
-    def synth(self, text: str, out_path: str, language: str, speaker_wav: Optional[str], timeout: float | None) -> Tuple[bool, str]:
-        self.req_q.put(SynthReq(text, out_path, language, speaker_wav))
-        try:
-            resp: SynthResp = self.resp_q.get(timeout=timeout)  # 等待单条返回
-            return resp.ok, resp.err
-        except queue.Empty:
-            return False, "Timeout"
+    def _release_shms(self) -> None:
+        self._views = []
+        for shm in self.shms:
+            try:
+                shm.unlink()
+            except Exception:
+                pass
+            try:
+                shm.close()  # 仍有视图未释放时会失败，映射随对象回收
+            except Exception:
+                pass
+        self.shms = []
+
+    def submit(self, text: str, language: str, speaker_wav: Optional[str]) -> int:
+        """投递一条合成请求、不等待结果，返回请求号；配合 poll，可在取上一条结果前先投递下一条。"""
+        self._seq += 1
+        rid = self._seq
+        # 块数多于在途条数，子进程写下一条时不会覆盖父进程尚未拷出的块
+        slot = rid % len(self.shms) if self.shms else -1
+        self._slots[rid] = slot
+        self._chunks[rid] = []
+        self.req_q.put(SynthReq(text, language, speaker_wav, slot, rid))
+        return rid
+
+    def poll(self, rid: int, timeout: float | None, task_id: Optional[int] = None) -> SynthResp:
+        """
+        等待请求 rid 结束并返回结果；成功时 resp.audio 为整条音频。
+        途中收到的其他在途请求的块/结果先暂存，之后 poll 它们时直接返回。
+        短超时轮询 resp_q，期间可感知 stop 与子进程退出。
+        """
+        if rid not in self._chunks and rid not in self._done:
+            return SynthResp(False, f"UnknownRequest: {rid}")
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while rid not in self._done:
+            wait = 0.5 if deadline is None else min(0.5, deadline - time.monotonic())
+            if wait <= 0:
+                return SynthResp(False, "Timeout")
+            try:
+                msg = self.resp_q.get(timeout=wait)
+            except queue.Empty:
+                if task_id is not None and is_stop_requested(task_id):
+                    return SynthResp(False, "Cancelled")
+                if not self.p.is_alive():
+                    return SynthResp(False, "WorkerExited")
+                continue
+            if msg.rid < 0:
+                return msg
+            chunks = self._chunks.get(msg.rid)
+            if chunks is None:
+                continue  # 已被放弃的请求（如上次任务中途异常退出时的预投递）
+            if isinstance(msg, ChunkResp):
+                # 共享内存块会被后续请求复用，收到即拷出
+                view = self._views[self._slots[msg.rid]] if self._slots[msg.rid] >= 0 else None
+                chunks.append(msg.audio if msg.audio is not None else view[msg.offset:msg.offset + msg.n].copy())
+                continue
+            del self._chunks[msg.rid], self._slots[msg.rid]
+            if msg.ok:
+                msg.audio = np.concatenate(chunks) if chunks else np.zeros(0, dtype=np.float32)
+            self._done[msg.rid] = msg
+        return self._done.pop(rid)
+
+    def discard(self) -> None:
+        """放弃所有在途/未取走的请求，其后续响应到达时直接丢弃。"""
+        self._slots.clear()
+        self._chunks.clear()
+        self._done.clear()
 
     def close(self, graceful: bool = True):
         try:
@@ -182,6 +295,63 @@ class XTTSWorker:
                     self.p.join(timeout=2.0)
                 except Exception:
                     pass
+            self._release_shms()
+
+# -------- 常驻 worker：按卡缓存，跨 srt_to_tts 调用复用，模型只加载一次 --------
+_WORKERS: dict = {}
+_LANE_LOCKS: dict = {}
+_WORKERS_LOCK = threading.Lock()
+
+def _get_worker(gpu: Optional[int]) -> XTTSWorker:
+    """取该卡上的常驻 worker；不存在或已退出时惰性创建。"""
+    with _WORKERS_LOCK:
+        w = _WORKERS.get(gpu)
+        if w is None or not w.p.is_alive():
+            w = _WORKERS[gpu] = XTTSWorker(gpu=gpu)
+        return w
+
+def _restart_worker(old: XTTSWorker) -> XTTSWorker:
+    old.close(graceful=False)
+    with _WORKERS_LOCK:
+        w = _WORKERS[old.gpu] = XTTSWorker(gpu=old.gpu)
+        return w
+
+def _lane_lock(gpu: Optional[int]) -> threading.Lock:
+    """同一 worker 同时只服务一个 srt_to_tts（请求/响应队列不可交错）。"""
+    with _WORKERS_LOCK:
+        return _LANE_LOCKS.setdefault(gpu, threading.Lock())
+
+def _close_workers() -> None:
+    with _WORKERS_LOCK:
+        ws = list(_WORKERS.values())
+        _WORKERS.clear()
+    for w in ws:
+        try:
+            w.close(graceful=True)
+        except Exception:
+            pass
+
+atexit.register(_close_workers)
+
+def _partition_lanes(schedule: List[Tuple[float, float, str]], k: int) -> List[range]:
+    """
+    按文本长度（合成耗时的近似）把时间轴切成 min(k, n) 段非空连续区间，返回 1 起的下标区间。
+    第 j 个切点取累计长度最接近 j/k 的位置，再夹在 [上一切点 + 1, n - 剩余段数] 内，保证每段至少一条。
+    """
+    n = len(schedule)
+    if n == 0:
+        return []
+    k = max(1, min(k, n))
+    weights = np.cumsum([max(1, len(t)) for _, _, t in schedule])
+    bounds = [0]
+    for j in range(1, k):
+        target = weights[-1] * j / k
+        c = int(np.searchsorted(weights, target))  # weights[c] >= target
+        if c > 0 and target - weights[c - 1] <= weights[c] - target:
+            c -= 1  # 前一条更接近目标
+        bounds.append(min(max(c + 1, bounds[-1] + 1), n - (k - j)))
+    bounds.append(n)
+    return [range(a + 1, b + 1) for a, b in zip(bounds, bounds[1:])]
 
 # -------- 对外主流程（与原函数签名一致） --------
 def srt_to_tts(
@@ -191,120 +361,146 @@ def srt_to_tts(
     language: str = "en",
     resolve_mode: str = RESOLVE_MODE,
     task_id: Optional[int] = None,
+    parsed_items: Optional[List[Tuple[float, float, str]]] = None,
+    mix_out: Optional[dict] = None,
 ) -> Tuple[bool, str]:
     """
     逐条字幕合成：
-      - XTTS 在**程序内部**的常驻子进程中只加载一次；
+      - XTTS 在**程序内部**的常驻子进程中只加载一次，跨调用复用（进程退出时关闭）；
       - 父进程之间隔每条都可检查 stop，若已请求停止，直接终止子进程实现**立即停止**；
-      - 单条正在 tts_to_file 时若收到 stop，也直接 terminate 子进程实现即时打断；
-      - 输出做时长对齐、前置静音、amix 汇总（48k）。
+      - 单条正在合成时若收到 stop，也直接 terminate 子进程实现即时打断；
+      - XTTS_NUM_GPUS>1 时按卡数切分时间轴，各段由独立 worker 并行合成；
+      - 输出做时长对齐，按起点偏移在内存中混音汇总（48k）。
     """
     try:
-        if not os.path.exists(srt_path):
+        if parsed_items is None and not os.path.exists(srt_path):
             return False, f"[错误] 找不到字幕文件：{srt_path}"
         if ref_wav_path is not None and not os.path.exists(ref_wav_path):
             return False, f"[错误] 找不到参考音色：{ref_wav_path}"
 
-        subs = pysrt.open(srt_path, encoding="utf-8")
-        raw_items: List[Tuple[float, float, str]] = [
-            (s.start.ordinal/1000.0, s.end.ordinal/1000.0, s.text) for s in subs
-        ]
+        # 调用方已解析过（如 sub_api_tts 回退路径）则直接复用
+        raw_items = parsed_items if parsed_items is not None else parse_srt_items(srt_path)
         schedule = build_non_overlapping_timeline(raw_items, resolve_mode, SAFE_GAP)
 
-        # ---- 启动常驻 XTTS worker（程序内加载模型）----
-        worker = XTTSWorker()
-        tmpdir = tempfile.mkdtemp(prefix="srt_tts_")
-        segments: List[str] = []
+        # ---- 取常驻 XTTS worker（首次使用时加载模型；多卡时每段一个，各自固定一张卡）----
+        lanes = _partition_lanes(schedule, XTTS_NUM_GPUS)
+        # 多卡配置下即使只切出一段也固定到 0 号卡，与多段时的 gpu=0 worker 共用（同一模型、同一把锁）；
+        # 只有单卡配置才用不设 CUDA_VISIBLE_DEVICES 的默认 worker
+        gpus = [k if XTTS_NUM_GPUS > 1 else None for k in range(len(lanes))]
+        locks = [_lane_lock(g) for g in gpus]
+        workers: List[XTTSWorker] = []
+        aborted = threading.Event()
+        mix = Mixdown(max((e for _, e, _ in schedule), default=0.0), SAMPLE_RATE)
         # 单条合成最长等待（防卡死），可视需要调大
         per_item_timeout = 300.0
 
-        try:
-            for i, (adj_start, adj_end, text) in enumerate(schedule, 1):
-                log.info(f"[XTTS] 处理 {i}/{len(schedule)}: {text}")
+        def collect(k: int, i: int, rid: int) -> np.ndarray:
+            """取回第 k 个 worker 上第 i 条（1 起）的结果并校验，必要时重启/重试，返回 48k 波形。"""
+            worker = workers[k]
+            text = schedule[i - 1][2]
 
-                # 进入前检查 stop
-                if task_id is not None and is_stop_requested(task_id):
+            # 进入前检查 stop
+            if task_id is not None and is_stop_requested(task_id):
+                raise RuntimeError("Cancelled")
+
+            # --- 合成（在子进程里；可通过 terminate 立停） ---
+            resp = worker.poll(rid, timeout=per_item_timeout, task_id=task_id)
+            if resp.err == "Cancelled":
+                raise RuntimeError("Cancelled")
+            if not resp.ok:
+                err = resp.err
+                # 如果是初始化失败或进程退出，尝试**重启一次**并重试当前条
+                if "WorkerInitError" in (err or "") or err in ("Timeout", "WorkerExited") or not worker.p.is_alive():
+                    log.warning(f"[XTTS] worker 异常（{err}），尝试重启一次...")
+                    worker = workers[k] = _restart_worker(worker)
+                    resp = worker.poll(worker.submit(text, language, ref_wav_path), timeout=per_item_timeout, task_id=task_id)
+                    if resp.err == "Cancelled":
+                        raise RuntimeError("Cancelled")
+                    if not resp.ok:
+                        raise RuntimeError(f"XTTS 合成失败：{resp.err or err}")
+                else:
+                    raise RuntimeError(f"XTTS 合成失败：{err}")
+
+            # 合成后也检查是否被停止
+            if task_id is not None and is_stop_requested(task_id):
+                raise RuntimeError("Cancelled")
+
+            # 输出校验（偶发空音频）
+            if resp.audio is None or not len(resp.audio):
+                # 再给一次机会：重试当前条（排在已预投递的下一条之后，下一条的结果会先暂存）
+                log.warning(f"[XTTS] 输出为空，重试一次：第 {i} 条")
+                resp = worker.poll(worker.submit(text, language, ref_wav_path), timeout=per_item_timeout, task_id=task_id)
+                if resp.err == "Cancelled":
                     raise RuntimeError("Cancelled")
+                if not resp.ok:
+                    raise RuntimeError(f"XTTS 输出为空：第 {i} 条; 重试失败：{resp.err}")
+                if resp.audio is None or not len(resp.audio):
+                    raise RuntimeError(f"XTTS 输出为空：第 {i} 条")
+            return resample(resp.audio, resp.sr, SAMPLE_RATE)
+
+        def run_lane(k: int, idxs: range) -> None:
+            # 提前投递：父进程取第 i 条结果并重采样/对齐/混音时，子进程已在合成第 i+1 条
+            def submit(i: int) -> Tuple[XTTSWorker, int]:
+                return workers[k], workers[k].submit(schedule[i - 1][2], language, ref_wav_path)
+
+            ahead = submit(idxs[0])
+            for i in idxs:
+                if aborted.is_set():
+                    return  # 其他段已失败，尽快收尾
+                adj_start, adj_end, text = schedule[i - 1]
+                log.info(f"[XTTS] 处理 {i}/{len(schedule)}: {text}")
+                worker, rid = ahead
+                if worker is not workers[k]:
+                    rid = submit(i)[1]  # 上一条重启过 worker，旧进程上的预投递已作废
+                if i < idxs[-1]:
+                    ahead = submit(i + 1)
+                y = collect(k, i, rid)
 
                 target_dur = max(MIN_DUR, adj_end - adj_start)
-                raw = os.path.join(tmpdir, f"raw_{i:04d}.wav")
-                fit = os.path.join(tmpdir, f"fit_{i:04d}.wav")
-                pad = os.path.join(tmpdir, f"pad_{i:04d}.wav")
-
-                # --- 合成（仍为阻塞操作，但在子进程里；可通过 terminate 立停） ---
-                ok, err = worker.synth(text=text, out_path=raw, language=language, speaker_wav=ref_wav_path, timeout=per_item_timeout)
-                if not ok:
-                    # 如果是初始化失败或进程退出，尝试**重启一次**并重试当前条
-                    if "WorkerInitError" in (err or "") or err == "Timeout" or not worker.p.is_alive():
-                        log.warning(f"[XTTS] worker 异常（{err}），尝试重启一次...")
-                        worker.close(graceful=False)
-                        worker = XTTSWorker()
-                        ok2, err2 = worker.synth(text=text, out_path=raw, language=language, speaker_wav=ref_wav_path, timeout=per_item_timeout)
-                        if not ok2:
-                            raise RuntimeError(f"XTTS 合成失败：{err2 or err}")
-                    else:
-                        raise RuntimeError(f"XTTS 合成失败：{err}")
-
-                # 合成后也检查是否被停止
-                if task_id is not None and is_stop_requested(task_id):
-                    raise RuntimeError("Cancelled")
 
-                # 输出校验（偶发空文件）
-                dur = 0.0
-                try:
-                    dur = ffprobe_duration(raw, task_id=task_id)
-                except Exception:
-                    pass
-                if dur <= 0:
-                    # 再给一次机会：重试当前条
-                    log.warning(f"[XTTS] 输出无效或损坏，重试一次：{raw}")
-                    ok3, err3 = worker.synth(text=text, out_path=raw, language=language, speaker_wav=ref_wav_path, timeout=per_item_timeout)
-                    if not ok3:
-                        raise RuntimeError(f"XTTS 输出无效或损坏：{raw}; 重试失败：{err3}")
-                    dur = ffprobe_duration(raw, task_id=task_id)
-                    if dur <= 0:
-                        raise RuntimeError(f"XTTS 输出无效或损坏：{raw}")
-
-                # --- 对齐长度 + 前置静音 ---
-                time_stretch_to(raw, target_sec=target_dur, out_wav=fit, task_id=task_id)
-                pad_to_start(fit, adj_start, pad, sr=SAMPLE_RATE, task_id=task_id)
-                segments.append(pad)
-
-            if not segments:
+                # --- 对齐长度后按起点偏移累加进总轨 ---
+                y = fit_to_duration(y, target_dur, SAMPLE_RATE)
+                mix.add(y, adj_start)
+
+        for lk in locks:
+            lk.acquire()
+        try:
+            workers[:] = [_get_worker(g) for g in gpus]
+            if len(lanes) == 1:
+                run_lane(0, lanes[0])
+            elif lanes:
+                with ThreadPoolExecutor(max_workers=len(lanes)) as lane_pool:
+                    futs = [lane_pool.submit(run_lane, k, idxs) for k, idxs in enumerate(lanes)]
+                    done, _ = wait(futs, return_when=FIRST_EXCEPTION)
+                    for f in done:
+                        if f.exception() is not None:
+                            aborted.set()
+                            raise f.exception()
+
+            if not schedule:
                 return False, "[错误] 字幕为空，未生成任何音频。"
 
             # --- 汇总混音 ---
-            cmd = ["ffmpeg", "-y"]
-            for p in segments:
-                cmd += ["-i", p]
-            fc = "".join([f"[{i}:a]" for i in range(len(segments))]) + f"amix=inputs={len(segments)}:normalize=0[a]"
-            cmd += ["-filter_complex", fc, "-map", "[a]", "-ar", str(SAMPLE_RATE), out_path]
-            killable_run(cmd, task_id=task_id, check=True)
+            pcm = mix.write(out_path)
+            if mix_out is not None:
+                mix_out["pcm"] = pcm  # 交回调用方直送最终合成，不经全局缓存
 
-            try:
-                total = ffprobe_duration(out_path, task_id=task_id)
-                return True, f"[INFO] 生成成功：{out_path}（时长 {total:.3f}s）"
-            except Exception:
-                return True, f"[INFO] 生成成功：{out_path}"
+            # 时长直接取自混音缓冲，不再为日志起 ffprobe
+            return True, f"[INFO] 生成成功：{out_path}（时长 {mix.duration:.3f}s）"
         finally:
-            # 先关 worker（如 stop 请求直接 terminate）
-            try:
-                if task_id is not None and is_stop_requested(task_id):
-                    worker.close(graceful=False)
-                else:
-                    worker.close(graceful=True)
-            except Exception:
-                pass
-            # 清理临时目录
-            try:
-                for fn in os.listdir(tmpdir):
+            # worker 常驻复用；仅在 stop 时直接 terminate（可能仍有半条在途），下次使用时自动重建
+            if task_id is not None and is_stop_requested(task_id):
+                for worker in workers:
                     try:
-                        os.remove(os.path.join(tmpdir, fn))
+                        worker.close(graceful=False)
                     except Exception:
                         pass
-                os.rmdir(tmpdir)
-            except Exception:
-                pass
+            else:
+                # 异常提前退出时可能仍有预投递在途，丢弃其结果，避免下次调用误收
+                for worker in workers:
+                    worker.discard()
+            for lk in locks:
+                lk.release()
 
     except RuntimeError as e:
         if str(e) == "Cancelled":
@@ -0,0 +1,81 @@
+# app/processors/subtts/timeline.py
+# -*- coding: utf-8 -*-
+"""
+TTS 后端共用：SRT 解析与无重叠时间轴。
+两者都是纯函数，带缓存；edge-tts 失败回退 XTTS 时不再重复解析/重算。
+"""
+import os
+from functools import lru_cache
+from typing import List, Tuple
+
+import numpy as np
+import pysrt
+
+SAFE_GAP = 0.02
+MIN_DUR = 0.10
+# 条目数达到该值才走 NumPy 向量化（小列表时 Python 循环反而更快）
+VECTORIZE_MIN_ITEMS = 256
+
+Item = Tuple[float, float, str]
+
+
+@lru_cache(maxsize=16)
+def _parse_srt_cached(srt_path: str, mtime_ns: int, size: int) -> Tuple[Item, ...]:
+    subs = pysrt.open(srt_path, encoding="utf-8")
+    return tuple((s.start.ordinal / 1000.0, s.end.ordinal / 1000.0, s.text) for s in subs)
+
+
+def parse_srt_items(srt_path: str) -> Tuple[Item, ...]:
+    """解析 SRT 为 (start_sec, end_sec, text)；按 (路径, mtime, 大小) 缓存，文件改动后自动失效。"""
+    st = os.stat(srt_path)
+    return _parse_srt_cached(os.path.abspath(srt_path), st.st_mtime_ns, st.st_size)
+
+
+def _shift_vectorized(items: Tuple[Item, ...], safe_gap: float) -> Tuple[Item, ...]:
+    """
+    shift 模式的递推 adj_start_i = max(start_i, adj_end_{i-1} + gap)、adj_end_i = adj_start_i + dur_i
+    改写为前缀最大值：令 C_i = Σ_{k<i}(dur_k + gap)，则 adj_start_i - C_i = max_{k<=i}(start_k - C_k)
+    （首条的下界为 gap，对应 prev_end=0）。
+    """
+    starts = np.maximum(0.0, np.fromiter((it[0] for it in items), dtype=np.float64, count=len(items)))
+    ends = np.fromiter((it[1] for it in items), dtype=np.float64, count=len(items))
+    durs = np.maximum(starts + MIN_DUR, ends) - starts
+    steps = durs + safe_gap
+    offsets = np.concatenate(([0.0], np.cumsum(steps[:-1])))
+    x = starts - offsets
+    x[0] = max(x[0], safe_gap)
+    adj_starts = np.maximum.accumulate(x) + offsets
+    adj_ends = adj_starts + durs
+    return tuple(zip(adj_starts.tolist(), adj_ends.tolist(), (it[2] for it in items)))
+
+
+@lru_cache(maxsize=16)
+def _timeline_cached(items: Tuple[Item, ...], mode: str, safe_gap: float) -> Tuple[Item, ...]:
+    if mode == "shift" and len(items) >= VECTORIZE_MIN_ITEMS:
+        return _shift_vectorized(items, safe_gap)
+    # compress 模式带截断，不满足结合律，仍逐条递推
+    result: List[Item] = []
+    prev_end = 0.0
+    for start, end, text in items:
+        start = max(0.0, float(start))
+        end = max(start + MIN_DUR, float(end))
+        orig_dur = end - start
+        if mode == "shift":
+            adj_start = max(start, prev_end + safe_gap)
+            adj_end = adj_start + max(MIN_DUR, orig_dur)
+        elif mode == "compress":
+            adj_start = max(start, prev_end + safe_gap)
+            adj_end = max(adj_start + MIN_DUR, min(end, adj_start + orig_dur))
+        else:
+            raise ValueError("RESOLVE_MODE 只能为 'shift' 或 'compress'")
+        result.append((adj_start, adj_end, text))
+        prev_end = adj_end
+    return tuple(result)
+
+
+def build_non_overlapping_timeline(
+    items: List[Item],
+    mode: str = "shift",
+    safe_gap: float = SAFE_GAP,
+) -> List[Item]:
+    return list(_timeline_cached(tuple(items), mode, safe_gap))
@@ -1,11 +1,20 @@
 # app/processors/utils.py
 # -*- coding: utf-8 -*-
-import os, re, time
-import shutil, signal
-from pathlib import Path
+import os, re, time, select
+import shutil, signal, contextlib, threading, functools
+import subprocess
 from subprocess import Popen, PIPE
-from faster_whisper import WhisperModel
-from app.cancel import is_stop_requested, register_process, unregister_process
+from typing import Literal
+import ctranslate2
+import numpy as np
+import soundfile as sf
+from faster_whisper import WhisperModel, BatchedInferencePipeline
+try:
+    # faster-whisper 依赖 PyAV，通常已安装；缺失时探测类操作退回 ffprobe 子进程
+    import av
+except ImportError:  # pragma: no cover
+    av = None
+from app.cancel import is_stop_requested, register_process, unregister_process, stop_eventfd
 
 from app.logs import get_logger
 log = get_logger(__name__)
@@ -16,39 +25,84 @@ MEDIA_ROOT = os.getenv("MEDIA_ROOT", os.path.abspath("./media"))
 MODEL_PATH = os.getenv("WHISPER_MODEL_PATH", os.path.join(CURRENT_DIR, "../../../models/Systran/faster-whisper-large-v2"))
 FRONTEND_MEDIA_ROOT = os.getenv("FRONTEND_MEDIA_ROOT", os.path.join(CURRENT_DIR, "../../../frontend/media")).strip()
 
+# Whisper 推理设备与精度：默认 GPU 用 int8_float16（int8 权重 + fp16 计算），CPU 用 int8；可用环境变量覆盖
+WHISPER_DEVICE = os.getenv("WHISPER_DEVICE", "auto")
+WHISPER_COMPUTE_TYPE = os.getenv("WHISPER_COMPUTE_TYPE", "").strip() or None
+# VAD 切段后按批送入编码器；<=1 时退回逐段 transcribe
+WHISPER_BATCH_SIZE = int(os.getenv("WHISPER_BATCH_SIZE", "16"))
+# 服务启动时后台预加载 Whisper，首个任务不再等待模型载入
+WHISPER_PRELOAD = os.getenv("WHISPER_PRELOAD", "1") == "1"
+
+# WhisperModel 进程内单例：按 (模型路径, 设备, 精度) 缓存，避免每次识别都重新加载权重；
+# 批处理管线只是模型的薄包装，随模型一起缓存
+_WHISPER_CACHE: dict[tuple, tuple[WhisperModel, BatchedInferencePipeline]] = {}
+_WHISPER_LOCK = threading.Lock()
+
+# 软字幕（不烧录）时可直接 -c:v copy 进 MP4 的视频编码；其余编码仍需转码
+_MP4_COPY_CODECS = frozenset({"h264", "hevc", "mpeg4", "av1"})
+# 本地 PCM/WAV 输入的格式参数都在头部，无需 ffmpeg 默认的 5MB/5s 探测
+_PCM_PROBE_ARGS = ["-probesize", "32k", "-analyzeduration", "0"]
+
+# 烧字幕时的视频编码器：auto 时探测硬件编码器（NVENC → QSV），不可用再用 libx264；也可直接指定编码器名
+VIDEO_ENCODER = os.getenv("VIDEO_ENCODER", "auto").strip()
+_X264_ARGS = ["-c:v", "libx264", "-crf", "18", "-preset", "veryfast"]
+_HW_ENCODER_ARGS = {
+    "h264_nvenc": ["-c:v", "h264_nvenc", "-preset", "p4", "-rc", "vbr", "-cq", "19", "-b:v", "0"],
+    "h264_qsv": ["-c:v", "h264_qsv", "-global_quality", "19"],
+}
+# 成片暂存目录（本地盘 / tmpfs）：MP4 封装要回写 moov，输出必须可 seek，不能走管道；
+# MEDIA_ROOT 在 NFS 等慢盘上时先在这里写完，再整块拷过去，ffmpeg 的零碎写不再拖慢编码。留空则直接写目标路径
+MUX_SCRATCH_DIR = os.getenv("MUX_SCRATCH_DIR", "").strip() or None
+
+# 人声分离：htdemucs 常驻进程内；按块推理，块间可响应 stop（块间 1s 线性交叉淡化）
+DEMUCS_MODEL = os.getenv("DEMUCS_MODEL", "htdemucs")
+DEMUCS_BLOCK_SEC = float(os.getenv("DEMUCS_BLOCK_SEC", "60"))
+DEMUCS_OVERLAP_SEC = 1.0
+# TTS 参考音色片段时长：XTTS get_conditioning_latents 默认只取参考音频前 30 秒（max_ref_length）
+VOCAL_REF_SECONDS = float(os.getenv("VOCAL_REF_SECONDS", "30"))
+_DEMUCS = None
+_DEMUCS_LOCK = threading.Lock()      # 惰性加载
+_DEMUCS_RUN_LOCK = threading.Lock()  # 同一模型串行推理，避免多任务并发占满显存
+
+# ffmpeg 滤镜参数里的路径转义（反斜杠 / 冒号 / 单引号），一次 translate 完成
+_FFMPEG_ESC_TABLE = str.maketrans({"\\": "\\\\", ":": "\\:", "'": "\\'"})
+
 class ValidationError(Exception):
     pass
 
+@functools.lru_cache(maxsize=4096)
+def _ensured(parent: str) -> None:
+    os.makedirs(parent, exist_ok=True)
+
 def ensure_dir(p: str):
-    os.makedirs(os.path.dirname(p), exist_ok=True)
+    """确保 p 的父目录存在；同一目录只建一次（运行期不会删除媒体目录，临时目录路径各不相同）。"""
+    _ensured(os.path.dirname(p) or ".")
 
 def format_srt_timestamp(seconds: float) -> str:
     ms = max(0, int(round(seconds * 1000)))
-    h = ms // 3600000
-    ms %= 3600000
-    m = ms // 60000
-    ms %= 60000
-    s = ms // 1000
-    ms %= 1000
+    h, ms = divmod(ms, 3600000)
+    m, ms = divmod(ms, 60000)
+    s, ms = divmod(ms, 1000)
     return f"{h:02d}:{m:02d}:{s:02d},{ms:03d}"
 
 # —— 通用解析：SRT 或 秒 —— #
+_RE_SRT = re.compile(r"^(\d{1,2}):(\d{2}):(\d{2})(?:[.,](\d{1,3}))?$")
+
 def parse_time_to_seconds(v: str) -> float:
     """
     支持：
         - HH:MM:SS,mmm / HH:MM:SS.mmm
         - 纯秒数（整数或小数），例如 12 或 12.345
     """
-    _re_srt = re.compile(r"^(\d{1,2}):(\d{2}):(\d{2})([.,](\d{1,3}))?$")
-    v = (str(v) or "").strip()
+    v = (v if isinstance(v, str) else str(v)).strip()
     if not v:
         raise ValidationError("时间不能为空。")
-    m = _re_srt.match(v)
+    m = _RE_SRT.match(v)
     if m:
         h = int(m.group(1))
         mnt = int(m.group(2))
         s = int(m.group(3))
-        ms = int((m.group(5) or "0").ljust(3, "0")[:3])  # 补足到毫秒3位
+        ms = int((m.group(4) or "0").ljust(3, "0")[:3])  # 补足到毫秒3位
         return h * 3600 + mnt * 60 + s + ms / 1000.0
     # 纯秒
     try:
@@ -62,7 +116,7 @@ def parse_time_to_seconds(v: str) -> float:
         )
 
 # ---------------- 可取消子进程执行器 ----------------
-def _start_popen(cmd: list[str]):
+def _start_popen(cmd: list[str], text: bool = True, stdin=None):
     """
     以**新进程组**启动子进程，便于整组 kill（Linux/macOS）。
     """
@@ -72,44 +126,122 @@ def _start_popen(cmd: list[str]):
         kwargs["preexec_fn"] = os.setsid  # type: ignore
     except Exception:
         pass
-    return Popen(cmd, stdout=PIPE, stderr=PIPE, text=True, **kwargs)
+    return Popen(cmd, stdin=stdin, stdout=PIPE, stderr=PIPE, text=text, **kwargs)
+
+
+def _feed_stdin(p: Popen, data) -> threading.Thread:
+    """后台线程把 data（bytes 或任意连续缓冲区）写进子进程 stdin 后关闭；子进程提前退出/被杀时静默结束。"""
+    def _run():
+        try:
+            p.stdin.write(data)
+        except (BrokenPipeError, OSError, ValueError):
+            pass
+        finally:
+            with contextlib.suppress(OSError, ValueError):
+                p.stdin.close()
+    t = threading.Thread(target=_run, name="ffmpeg-stdin", daemon=True)
+    t.start()
+    return t
+
+def _wait_pidfd(p: Popen, task_id: int | None) -> bool:
+    """
+    阻塞到子进程退出（返回 True）或任务被 stop（返回 False）。
+    Linux：pidfd_open + 取消 eventfd 一起 select.poll，事件驱动、无定时唤醒；
+    不支持时（非 Linux / 内核 < 5.3）退回 wait(timeout=0.2) 循环，间隙检查 stop。
+    """
+    if hasattr(os, "pidfd_open") and hasattr(os, "eventfd") and hasattr(select, "poll"):
+        try:
+            pidfd = os.pidfd_open(p.pid)
+        except OSError:
+            pidfd = None  # 内核不支持，走轮询
+        if pidfd is not None:
+            try:
+                with stop_eventfd(task_id) if task_id is not None else contextlib.nullcontext() as stop_fd:
+                    poller = select.poll()
+                    poller.register(pidfd, select.POLLIN)
+                    if stop_fd is not None:
+                        poller.register(stop_fd, select.POLLIN)
+                    # 先取 fd 再查标记：request_stop 先置标记后写 fd，不会漏掉
+                    if is_stop_requested(task_id):
+                        return False
+                    poller.poll()  # 进程退出或 stop 之前不会返回
+                    return not is_stop_requested(task_id)
+            finally:
+                os.close(pidfd)
+    while True:
+        if is_stop_requested(task_id):
+            return False
+        try:
+            p.wait(timeout=0.2)  # 子进程退出即返回，不必睡满 0.2s
+            return True
+        except subprocess.TimeoutExpired:
+            pass
 
-def killable_run(cmd: list[str], task_id: int | None = None, check: bool = True) -> int:
+def _kill_group(p: Popen) -> None:
+    """
+    整组 TERM→KILL。子进程以 setsid 启动，pgid 即 p.pid；在 wait 回收之前僵尸会一直占着这个号，
+    直接 killpg(p.pid) 不会因号被复用而误杀别的进程组，也省去 getpgid 与其间的竞态窗口。
+    TERM 后用 pidfd 等组长退出（不回收），最多 0.3s，再对整组补 KILL 清理残留子进程。
+    """
+    if p.returncode is not None:
+        return  # 已回收，号可能已被复用，不再发信号
+    try:
+        os.killpg(p.pid, signal.SIGTERM)
+    except OSError:
+        pass
+    pidfd = None
+    if hasattr(os, "pidfd_open") and hasattr(select, "poll"):
+        try:
+            pidfd = os.pidfd_open(p.pid)
+        except OSError:
+            pass
+    if pidfd is not None:
+        try:
+            poller = select.poll()
+            poller.register(pidfd, select.POLLIN)
+            poller.poll(300)
+        finally:
+            os.close(pidfd)
+    else:
+        time.sleep(0.3)
+    try:
+        os.killpg(p.pid, signal.SIGKILL)
+    except OSError:
+        pass
+
+def killable_run(cmd: list[str], task_id: int | None = None, check: bool = True, input=None) -> int:
     """
     可被 /stop 立即中断的子进程执行器（非阻塞读取版）。
-    - 轮询进程状态；不在循环里 read()，避免阻塞；
+    - 事件驱动等待进程退出或 stop（见 _wait_pidfd）；等待期间不 read()，避免阻塞；
     - 退出后再一次性 communicate() 取回输出；
+    - input 给定时由后台线程写入 stdin（二进制，如 ffmpeg 的 pipe:0 输入）；
     - 如 stop，则整组 TERM→KILL 并抛 RuntimeError("Cancelled")
     """
-    p = _start_popen(cmd)
+    if input is None:
+        p = _start_popen(cmd)
+        feeder = None
+    else:
+        p = _start_popen(cmd, text=False, stdin=PIPE)
+        feeder = _feed_stdin(p, input)
     if task_id is not None:
         register_process(task_id, p)
     try:
-        while True:
-            rc = p.poll()
-            if rc is not None:
-                # 进程已结束，再一次性取出输出，避免管道残留
-                out, err = p.communicate()
-                if check and rc != 0:
-                    err_tail = (err or "")[-2000:]
-                    raise RuntimeError(f"Command failed ({rc}): {' '.join(cmd)}\n{err_tail}")
-                return rc
-
-            if task_id is not None and is_stop_requested(task_id):
-                try:
-                    pgid = os.getpgid(p.pid)
-                    os.killpg(pgid, signal.SIGTERM)
-                except Exception:
-                    pass
-                time.sleep(0.3)
-                try:
-                    pgid = os.getpgid(p.pid)
-                    os.killpg(pgid, signal.SIGKILL)
-                except Exception:
-                    pass
-                raise RuntimeError("Cancelled")
-
-            time.sleep(0.2)
+        # request_stop 自身也会杀进程组，进程因此退出时同样按取消处理
+        if not _wait_pidfd(p, task_id) or is_stop_requested(task_id):
+            _kill_group(p)
+            raise RuntimeError("Cancelled")
+        # 进程已结束，再一次性取出输出，避免管道残留
+        if feeder is not None:
+            feeder.join()
+            p.stdin = None  # 已由写线程关闭，免得 communicate() 再去 flush
+        out, err = p.communicate()
+        if isinstance(err, bytes):
+            err = err.decode("utf-8", "replace")
+        rc = p.returncode
+        if check and rc != 0:
+            err_tail = (err or "")[-2000:]
+            raise RuntimeError(f"Command failed ({rc}): {' '.join(cmd)}\n{err_tail}")
+        return rc
     finally:
         if task_id is not None:
             unregister_process(task_id, p)
@@ -117,39 +249,43 @@ def killable_run(cmd: list[str], task_id: int | None = None, check: bool = True)
 
 def killable_check_output(cmd: list[str], task_id: int | None = None) -> str:
     """
-    非阻塞读取版：循环中不读管道；结束后统一 communicate()。
+    非阻塞读取版：等待期间不读管道；结束后统一 communicate()。
     """
     p = _start_popen(cmd)
     if task_id is not None:
         register_process(task_id, p)
     try:
-        while True:
-            rc = p.poll()
-            if rc is not None:
-                out, err = p.communicate()
-                if rc != 0:
-                    raise RuntimeError(f"Command failed ({rc}): {' '.join(cmd)}\n{(err or '')[-2000:]}")
-                return out or ""
-
-            if task_id is not None and is_stop_requested(task_id):
-                try:
-                    pgid = os.getpgid(p.pid)
-                    os.killpg(pgid, signal.SIGTERM)
-                except Exception:
-                    pass
-                time.sleep(0.3)
-                try:
-                    pgid = os.getpgid(p.pid)
-                    os.killpg(pgid, signal.SIGKILL)
-                except Exception:
-                    pass
-                raise RuntimeError("Cancelled")
-
-            time.sleep(0.2)
+        if not _wait_pidfd(p, task_id) or is_stop_requested(task_id):
+            _kill_group(p)
+            raise RuntimeError("Cancelled")
+        out, err = p.communicate()
+        rc = p.returncode
+        if rc != 0:
+            raise RuntimeError(f"Command failed ({rc}): {' '.join(cmd)}\n{(err or '')[-2000:]}")
+        return out or ""
     finally:
         if task_id is not None:
             unregister_process(task_id, p)
+
+
+@functools.lru_cache(maxsize=256)
+def _duration_cached(path: str, mtime_ns: int, size: int) -> float | None:
+    with av.open(path) as c:
+        if c.duration is None:
+            return None
+        return c.duration / av.time_base
+
+
 def get_media_duration_seconds(path: str, task_id: int | None = None) -> float:
+    """媒体时长（秒）：PyAV 读容器头，按 (路径, mtime, 大小) 缓存；不可用或读不出时退回 ffprobe。"""
+    if av is not None:
+        try:
+            st = os.stat(path)
+            dur = _duration_cached(os.path.abspath(path), st.st_mtime_ns, st.st_size)
+            if dur is not None:
+                return dur
+        except Exception:
+            pass
     out = killable_check_output(
         ["ffprobe", "-v", "error", "-show_entries", "format=duration", "-of", "default=noprint_wrappers=1:nokey=1", path],
         task_id=task_id,
@@ -157,6 +293,68 @@ def get_media_duration_seconds(path: str, task_id: int | None = None) -> float:
     return float(out.strip())
 
 
+@functools.lru_cache(maxsize=256)
+def _video_codec_cached(path: str, mtime_ns: int, size: int) -> str | None:
+    with av.open(path) as c:
+        vs = c.streams.video
+        return vs[0].codec_context.name if vs else None
+
+
+def get_video_codec(path: str, task_id: int | None = None) -> str | None:
+    """首条视频流的编码名（如 h264）：PyAV 读容器头，按 (路径, mtime, 大小) 缓存；不可用时退回 ffprobe，读不出返回 None。"""
+    if av is not None:
+        try:
+            st = os.stat(path)
+            return _video_codec_cached(os.path.abspath(path), st.st_mtime_ns, st.st_size)
+        except Exception:
+            pass
+    try:
+        out = killable_check_output(
+            ["ffprobe", "-v", "error", "-select_streams", "v:0", "-show_entries", "stream=codec_name", "-of", "csv=p=0", path],
+            task_id=task_id,
+        )
+    except RuntimeError as e:
+        if str(e) == "Cancelled":
+            raise
+        return None
+    return out.strip() or None
+
+
+def _fadvise(fd: int, advice_name: str) -> None:
+    advice = getattr(os, advice_name, None)
+    if advice is not None and hasattr(os, "posix_fadvise"):
+        try:
+            os.posix_fadvise(fd, 0, 0, advice)
+        except OSError:
+            pass
+
+
+def _fast_copy(src: str, dst: str) -> None:
+    """
+    Linux 上用 copy_file_range 在内核内拷贝（同文件系统时 btrfs/XFS 可直接 reflink），数据不经用户态；
+    不支持时退回 shutil.copy（前端只读内容，不需要 copy2 的 copystat）。
+    一次性拷贝：源按顺序读，完成后建议内核丢弃两端页缓存，不挤掉模型权重等热数据。
+    不用硬链接：源文件可能被后续 ffmpeg -y 原地截断重写，会连带改坏已发布的文件。
+    """
+    with open(src, "rb") as fi:
+        _fadvise(fi.fileno(), "POSIX_FADV_SEQUENTIAL")
+        copied = False
+        if hasattr(os, "copy_file_range"):
+            try:
+                with open(dst, "wb") as fo:
+                    while os.copy_file_range(fi.fileno(), fo.fileno(), 1 << 30):
+                        pass
+                    _fadvise(fo.fileno(), "POSIX_FADV_DONTNEED")
+                copied = True
+            except OSError:
+                pass  # 如 EXDEV（旧内核跨文件系统）/ 文件系统不支持
+        if not copied:
+            shutil.copy(src, dst)
+            with open(dst, "rb") as fo:
+                _fadvise(fo.fileno(), "POSIX_FADV_DONTNEED")
+        _fadvise(fi.fileno(), "POSIX_FADV_DONTNEED")
+
+
 def publish_to_frontend_media(local_abs_path: str, rel_subdir: str = "final_videos") -> str | None:
     """
     将后端本地生成的文件复制到“前端 MEDIA_ROOT/rel_subdir/文件名”。
@@ -173,35 +371,145 @@ def publish_to_frontend_media(local_abs_path: str, rel_subdir: str = "final_vide
     dst_dir = os.path.join(root, rel_subdir)
     dst = os.path.join(dst_dir, fname)
     tmp = dst + ".part"
-    shutil.copy2(local_abs_path, tmp)     # 先复制到临时文件
+    _fast_copy(local_abs_path, tmp)       # 先复制到临时文件
     os.replace(tmp, dst)                  # 原子替换
     return os.path.relpath(dst, root)
 
 
-def extract_audio_from_video(video_path: str, audio_path: str, task_id: int | None = None):
+# 抽音规格：asr 给 Whisper（其内部本就转 16k 单声道，体积约为 48k 立体声的 1/6）；
+# sep/both 给人声分离，保留 48k 立体声，同时要识别的调用方再按需重采样
+_AUDIO_TARGET_ARGS = {
+    "asr": ["-ac", "1", "-ar", "16000"],
+    "sep": ["-ac", "2", "-ar", "48000"],
+    "both": ["-ac", "2", "-ar", "48000"],
+}
+
+
+def extract_audio_from_video(
+    video_path: str,
+    audio_path: str,
+    task_id: int | None = None,
+    target: Literal["asr", "sep", "both"] = "sep",
+):
     ensure_dir(audio_path)
-    cmd = ["ffmpeg", "-y", "-hide_banner", "-nostats", "-v", "error", "-i", video_path, "-vn", "-ac", "2", "-ar", "48000", "-acodec", "pcm_s16le", audio_path]
+    cmd = [
+        "ffmpeg", "-y", "-hide_banner", "-nostats", "-v", "error", "-i", video_path, "-vn",
+        *_AUDIO_TARGET_ARGS[target], "-acodec", "pcm_s16le", audio_path,
+    ]
     killable_run(cmd, task_id=task_id, check=True)
 
 
-def separate_vocals_and_bgm(audio_path: str, vocal_save_path: str, bgm_save_path: str, task_id: int | None = None):
-    # 与原逻辑一致：demucs two-stems
-    cmd = ["demucs", "--name", "htdemucs", "--two-stems", "vocals", audio_path]
-    killable_run(cmd, task_id=task_id, check=True)
+def _get_demucs():
+    """惰性加载并常驻 demucs 模型（首次调用才导入 torch/demucs），返回 (model, device)。"""
+    global _DEMUCS
+    with _DEMUCS_LOCK:
+        if _DEMUCS is None:
+            import torch
+            from demucs.pretrained import get_model
+            model = get_model(DEMUCS_MODEL)
+            model.cpu()
+            model.eval()
+            _DEMUCS = (model, "cuda" if torch.cuda.is_available() else "cpu")
+        return _DEMUCS
 
-    audio_filename = Path(audio_path).stem
-    base_dir = Path("separated") / "htdemucs" / audio_filename
-    v_path, nv_path = base_dir / "vocals.wav", base_dir / "no_vocals.wav"
-    if not v_path.exists() or not nv_path.exists():
-        raise FileNotFoundError("Demucs输出不存在")
+
+def decode_audio(path: str, sr: int, channels: int = 2, task_id: int | None = None) -> np.ndarray:
+    """
+    ffmpeg 解码 + 重采样为 float32 PCM，经管道直接读进内存（不落临时 WAV），返回 (channels, n)。
+    边跑边由 communicate 读管道，不会因管道写满而卡住；stop 时 request_stop 会杀掉已登记的进程组，communicate 随即返回。
+    """
+    cmd = [
+        "ffmpeg", "-hide_banner", "-nostats", "-v", "error", "-i", path, "-vn",
+        "-ac", str(channels), "-ar", str(sr), "-f", "f32le", "pipe:1",
+    ]
+    p = _start_popen(cmd, text=False)
+    if task_id is not None:
+        register_process(task_id, p)
+    try:
+        out, err = p.communicate()
+    finally:
+        if task_id is not None:
+            unregister_process(task_id, p)
+    if is_stop_requested(task_id):
+        raise RuntimeError("Cancelled")
+    if p.returncode != 0:
+        raise RuntimeError(f"Command failed ({p.returncode}): {' '.join(cmd)}\n{err.decode('utf-8', 'replace')[-2000:]}")
+    return np.frombuffer(out, dtype=np.float32).reshape(-1, channels).T
+
+
+def separation_input_format() -> tuple[int, int]:
+    """人声分离模型期望的 (采样率, 声道数)；解码时直接按它输出，省掉进程内重采样。"""
+    model, _ = _get_demucs()
+    return model.samplerate, model.audio_channels
+
+
+def vocal_ref_path(vocal_path: str) -> str:
+    """人声对应的 TTS 参考音色短片段路径（与人声同目录）。"""
+    return os.path.splitext(vocal_path)[0] + "_ref.wav"
+
+
+def separate_vocals_and_bgm(
+    audio_path: str | np.ndarray,
+    vocal_save_path: str,
+    bgm_save_path: str,
+    task_id: int | None = None,
+    sr: int | None = None,
+    ref_save_path: str | None = None,
+):
+    """
+    与原 `demucs --two-stems vocals` 等价：人声 + 其余音轨之和（伴奏），参数取 CLI 默认值。
+    进程内推理，模型只加载一次，直接写到目标路径；按块推理，块间检查 stop。
+    audio_path 也可直接给 decode_audio 的 (channels, n) 数组（此时须给 sr）。
+    ref_save_path 给定时另存人声前 VOCAL_REF_SECONDS 秒，作为 TTS 参考音色（免得阶段二整段读入人声）。
+    """
+    import torch
+    from demucs.apply import apply_model
+    from demucs.audio import convert_audio, save_audio
+
+    model, device = _get_demucs()
+    if isinstance(audio_path, np.ndarray):
+        y = audio_path
+    else:
+        y, sr = sf.read(audio_path, dtype="float32", always_2d=True)
+        y = y.T
+    wav = convert_audio(torch.from_numpy(np.ascontiguousarray(y)), sr, model.samplerate, model.audio_channels)
+
+    ref = wav.mean(0)
+    mean, std = ref.mean(), ref.std()
+    wav = (wav - mean) / std
+
+    vi = model.sources.index("vocals")
+    length = wav.shape[-1]
+    block = max(1, int(DEMUCS_BLOCK_SEC * model.samplerate))
+    ov = int(DEMUCS_OVERLAP_SEC * model.samplerate)
+    vocals = torch.zeros_like(wav)
+    others = torch.zeros_like(wav)
+    for a in range(0, length, block):
+        if is_stop_requested(task_id):
+            raise RuntimeError("Cancelled")
+        e = min(length, a + block + ov)
+        with _DEMUCS_RUN_LOCK, torch.inference_mode():
+            src = apply_model(model, wav[None, :, a:e], device=device, shifts=1, split=True, overlap=0.25)[0]
+        w = torch.ones(e - a)
+        head = min(ov, e - a) if a > 0 else 0       # 与上一块尾部重叠的区间
+        tail = e - (a + block) if a + block < length else 0  # 与下一块头部重叠的区间
+        if head:
+            w[:head] = torch.linspace(0, 1, ov + 2)[1:head + 1]
+        if tail > 0:
+            w[-tail:] = 1 - torch.linspace(0, 1, ov + 2)[1:tail + 1]
+        vocals[:, a:e] += src[vi] * w
+        others[:, a:e] += (src.sum(0) - src[vi]) * w
+    if is_stop_requested(task_id):
+        raise RuntimeError("Cancelled")
 
     ensure_dir(vocal_save_path)
     ensure_dir(bgm_save_path)
-    # 使用 Python 复制，避免再起子进程
-    shutil.copy2(str(v_path), vocal_save_path)
-    shutil.copy2(str(nv_path), bgm_save_path)
-    # 清理 demucs 目录
-    shutil.rmtree(base_dir.parent, ignore_errors=True)
+    vocals = vocals * std + mean
+    save_audio(vocals, vocal_save_path, samplerate=model.samplerate)
+    save_audio(others * std + mean, bgm_save_path, samplerate=model.samplerate)
+    if ref_save_path:
+        ensure_dir(ref_save_path)
+        save_audio(vocals[:, :int(VOCAL_REF_SECONDS * model.samplerate)], ref_save_path, samplerate=model.samplerate)
 
 
 def mux_video_with_audio(video_in: str, audio_in: str, video_out: str, task_id: int | None = None):
@@ -222,55 +530,192 @@ def mux_video_with_audio(video_in: str, audio_in: str, video_out: str, task_id:
     killable_run(cmd, task_id=task_id, check=True)
 
 
-def transcribe_vocal_to_subtitles(vocal_path: str, model_path: str | None = None, task_id: int | None = None) -> list:
+def _resolve_whisper_device(device: str, compute_type: str | None) -> tuple[str, str]:
+    if device == "auto":
+        device = "cuda" if ctranslate2.get_cuda_device_count() > 0 else "cpu"
+    if not compute_type:
+        compute_type = "int8_float16" if device == "cuda" else "int8"
+    return device, compute_type
+
+
+def _get_whisper(
+    model_path: str,
+    device: str = WHISPER_DEVICE,
+    compute_type: str | None = WHISPER_COMPUTE_TYPE,
+) -> tuple[WhisperModel, BatchedInferencePipeline]:
+    """取缓存的 (WhisperModel, 批处理管线)；首次调用时加载（加锁，避免并发任务重复加载）。"""
+    device, compute_type = _resolve_whisper_device(device, compute_type)
+    key = (model_path, device, compute_type)
+    with _WHISPER_LOCK:
+        ent = _WHISPER_CACHE.get(key)
+        if ent is None:
+            model = WhisperModel(model_path, device=device, compute_type=compute_type)
+            ent = _WHISPER_CACHE[key] = (model, BatchedInferencePipeline(model=model))
+        return ent
+
+
+def whisper_config() -> tuple[str, str, int]:
+    """当前识别配置 (模型路径, 解析后的精度, 批大小)：默认参数下 iter_transcribe_vocal 实际使用的组合，供结果缓存区分。"""
+    _, compute_type = _resolve_whisper_device(WHISPER_DEVICE, WHISPER_COMPUTE_TYPE)
+    return os.path.abspath(MODEL_PATH), compute_type, WHISPER_BATCH_SIZE
+
+
+def warmup_whisper() -> None:
+    """按默认参数加载 Whisper 单例（幂等）；供服务启动时在后台线程调用。"""
+    _get_whisper(MODEL_PATH, compute_type=WHISPER_COMPUTE_TYPE)
+
+
+def iter_transcribe_vocal(
+    vocal_path: str,
+    model_path: str | None = None,
+    task_id: int | None = None,
+    compute_type: str | None = None,
+):
     """
-    语音识别（支持在迭代过程中检测 stop 请求，尽快返回已识别片段）
+    流式语音识别：逐段 yield {"sequence","start_time","end_time","original_text"}，
+    调用方可边识别边处理（如提交翻译）；检测到 stop 请求即停止迭代。
     """
-    model = WhisperModel(model_path or MODEL_PATH, device="auto", compute_type="float16")
-    segments, _ = model.transcribe(vocal_path, beam_size=5, vad_filter=True, word_timestamps=False)
-    out = []
+    model, pipe = _get_whisper(model_path or MODEL_PATH, compute_type=compute_type or WHISPER_COMPUTE_TYPE)
+    if WHISPER_BATCH_SIZE > 1:
+        segments, _ = pipe.transcribe(
+            vocal_path, batch_size=WHISPER_BATCH_SIZE, beam_size=5, vad_filter=True, word_timestamps=False,
+        )
+    else:
+        segments, _ = model.transcribe(vocal_path, beam_size=5, vad_filter=True, word_timestamps=False)
     for i, seg in enumerate(segments, 1):
         # 片段粒度的 stop 检查
         if task_id is not None and is_stop_requested(task_id):
-            break
+            return
         txt = (seg.text or "").strip()
         if not txt:
             continue
-        out.append({"sequence": i, "start_time": seg.start, "end_time": seg.end, "original_text": txt})
-    return out
+        yield {"sequence": i, "start_time": seg.start, "end_time": seg.end, "original_text": txt}
 
 
-def make_final_video(
-    bg_video_path: str,
+def transcribe_vocal_to_subtitles(
+    vocal_path: str,
+    model_path: str | None = None,
+    task_id: int | None = None,
+    compute_type: str | None = None,
+) -> list:
+    """
+    语音识别（支持在迭代过程中检测 stop 请求，尽快返回已识别片段）
+    """
+    return list(iter_transcribe_vocal(vocal_path, model_path, task_id, compute_type))
+
+
+def has_audio_stream(path: str, task_id: int | None = None) -> bool:
+    """是否含音频流：PyAV 在进程内读容器头，无需起 ffprobe；读取失败视为无音频。"""
+    try:
+        if av is not None:
+            with av.open(path) as c:
+                return len(c.streams.audio) > 0
+        out = killable_check_output(
+            ["ffprobe", "-v", "error", "-select_streams", "a", "-show_entries", "stream=index", "-of", "csv=p=0", path],
+            task_id=task_id,
+        )
+        return out.strip() != ""
+    except Exception:
+        return False
+
+
+@functools.lru_cache(maxsize=1)
+def _detect_hw_encoder() -> str | None:
+    """
+    进程内只探测一次：ffmpeg 编进了该编码器不代表机器上有对应硬件，
+    因此对每个候选实际编码几帧空画面，成功才采用。
+    """
+    try:
+        listed = subprocess.run(
+            ["ffmpeg", "-hide_banner", "-encoders"], capture_output=True, text=True, timeout=10,
+        ).stdout
+    except Exception:
+        return None
+    for enc in _HW_ENCODER_ARGS:
+        if enc not in listed:
+            continue
+        try:
+            r = subprocess.run(
+                ["ffmpeg", "-hide_banner", "-v", "error", "-f", "lavfi", "-i", "color=s=256x256:d=0.2",
+                 "-c:v", enc, "-f", "null", "-"],
+                capture_output=True, timeout=20,
+            )
+        except Exception:
+            continue
+        if r.returncode == 0:
+            log.info(f"视频编码使用硬件编码器：{enc}")
+            return enc
+    return None
+
+
+def _video_encoder_args() -> list[str]:
+    if VIDEO_ENCODER == "auto":
+        enc = _detect_hw_encoder()
+        return list(_HW_ENCODER_ARGS[enc]) if enc else list(_X264_ARGS)
+    if VIDEO_ENCODER in _HW_ENCODER_ARGS:
+        return list(_HW_ENCODER_ARGS[VIDEO_ENCODER])
+    return list(_X264_ARGS)
+
+
+def _mux_scratch_path(out_path: str) -> str | None:
+    """暂存目录与目标在不同设备上时返回暂存路径；未配置或同盘时返回 None（直接写目标）。"""
+    if not MUX_SCRATCH_DIR:
+        return None
+    try:
+        os.makedirs(MUX_SCRATCH_DIR, exist_ok=True)
+        if os.stat(MUX_SCRATCH_DIR).st_dev == os.stat(os.path.dirname(out_path) or ".").st_dev:
+            return None
+    except OSError:
+        return None
+    return os.path.join(MUX_SCRATCH_DIR, f"{os.getpid()}_{threading.get_ident()}_{os.path.basename(out_path)}")
+
+
+def compose_translated_video(
+    src_video_path: str,
     tts_wav_path: str,
     subtitle_path: str,
     out_video_path: str,
+    bgm_audio_path: str | None = None,
     burn_subtitle: bool = True,
     bgm_volume: float = 1.0,
     tts_volume: float = 1.0,
     task_id: int | None = None,
+    tts_pcm: tuple[np.ndarray, int] | None = None,
 ):
+    """
+    一次 ffmpeg 完成：取 src 的画面（烧字幕或软封装）+ 背景音与 TTS 混音。
+    - bgm_audio_path 给定时直接用分离出的伴奏 WAV 作背景音，无需先 mux 出去人声视频再解码其 AAC；
+    - 否则用 src 自带音轨（若有）作背景音；
+    - tts_pcm=(float32 单声道, sr) 给定时 TTS 经 stdin 管道输入，不再回读 tts_wav_path。
+    """
     ensure_dir(out_video_path)
-
-    def has_audio(p: str) -> bool:
-        try:
-            out = killable_check_output(
-                ["ffprobe", "-v", "error", "-select_streams", "a", "-show_entries", "stream=index", "-of", "csv=p=0", p],
-                task_id=task_id,
-            )
-            return out.strip() != ""
-        except Exception:
-            return False
-
-    bg_has_audio = has_audio(bg_video_path)
+    scratch = _mux_scratch_path(out_video_path)
+    dest = scratch or out_video_path
 
     def esc(p: str) -> str:
-        return p.replace("\\", "\\\\").replace(":", "\\:").replace("'", "\\'")
+        return p.translate(_FFMPEG_ESC_TABLE)
 
-    sub_filter = f"subtitles='{esc(os.path.abspath(subtitle_path))}'"
+    sub_abs = subtitle_path if os.path.isabs(subtitle_path) else os.path.abspath(subtitle_path)
+    sub_filter = f"subtitles='{esc(sub_abs)}'"
 
-    if bg_has_audio:
-        audio_chain = f"[0:a]volume={bgm_volume}[a0];[1:a]volume={tts_volume}[a1];[a0][a1]amix=inputs=2:duration=shortest:dropout_transition=2[aout]"
+    if tts_pcm is not None:
+        pcm, pcm_sr = tts_pcm
+        tts_input = [*_PCM_PROBE_ARGS, "-f", "f32le", "-ar", str(pcm_sr), "-ac", "1", "-i", "pipe:0"]
+        feed = memoryview(np.ascontiguousarray(pcm, dtype=np.float32)).cast("B")
+    else:
+        tts_input = [*_PCM_PROBE_ARGS, "-i", tts_wav_path]
+        feed = None
+    inputs = ["-i", src_video_path, *tts_input]
+    if bgm_audio_path:
+        inputs += [*_PCM_PROBE_ARGS, "-i", bgm_audio_path]
+        bgm_label = "[2:a]"
+    elif has_audio_stream(src_video_path, task_id=task_id):
+        bgm_label = "[0:a]"
+    else:
+        bgm_label = None
+
+    if bgm_label:
+        audio_chain = f"{bgm_label}volume={bgm_volume}[a0];[1:a]volume={tts_volume}[a1];[a0][a1]amix=inputs=2:duration=shortest:dropout_transition=2[aout]"
     else:
         audio_chain = f"[1:a]volume={tts_volume}[aout]"
 
@@ -280,58 +725,103 @@ def make_final_video(
         cmd = [
             "ffmpeg", "-y",
             "-hide_banner", "-nostats", "-v", "error",
-            "-i", bg_video_path,
-            "-i", tts_wav_path,
+            *inputs,
             "-filter_complex", fc,
             "-map", "[vout]",
             "-map", "[aout]",
-            "-c:v", "libx264",
-            "-crf", "18",
-            "-preset", "veryfast",
+            *_video_encoder_args(),
             "-c:a", "aac",
             "-b:a", "192k",
             "-shortest",
-            out_video_path,
+            dest,
         ]
     else:
+        sub_idx = inputs.count("-i")
+        # 软字幕：视频流兼容 MP4 时直接拷贝，不兼容（如 VP8/WMV）才转码
+        if get_video_codec(src_video_path, task_id=task_id) in _MP4_COPY_CODECS:
+            v_codec = ["-c:v", "copy"]
+        else:
+            v_codec = _video_encoder_args()
         cmd = [
             "ffmpeg", "-y",
             "-hide_banner", "-nostats", "-v", "error",
-            "-i", bg_video_path,
-            "-i", tts_wav_path,
+            *inputs,
             "-i", subtitle_path,
             "-filter_complex", audio_chain,
             "-map", "0:v:0",
             "-map", "[aout]",
-            "-map", "2:0",
-            "-c:v", "copy",
+            "-map", f"{sub_idx}:0",
+            *v_codec,
             "-c:a", "aac",
             "-b:a", "192k",
             "-c:s", "mov_text",
             "-metadata:s:s:0", "language=zho",
             "-shortest",
-            out_video_path,
+            dest,
         ]
 
-    killable_run(cmd, task_id=task_id, check=True)
+    try:
+        try:
+            killable_run(cmd, task_id=task_id, check=True, input=feed)
+        except RuntimeError as e:
+            # 硬件编码运行期失败（如 NVENC 并发会话数用尽）时用 libx264 重来一次
+            if str(e) == "Cancelled" or "libx264" in cmd or "copy" in cmd:
+                raise
+            log.warning(f"硬件编码失败，退回 libx264：{str(e)[-300:]}")
+            i = cmd.index("-c:v")
+            j = cmd.index("-c:a")
+            cmd[i:j] = _X264_ARGS
+            killable_run(cmd, task_id=task_id, check=True, input=feed)
+        if scratch:
+            # 整块拷到目标盘的 .part 再原子替换，读方不会看到半个文件
+            _fast_copy(scratch, out_video_path + ".part")
+            os.replace(out_video_path + ".part", out_video_path)
+    finally:
+        if scratch:
+            with contextlib.suppress(OSError):
+                os.remove(scratch)
+
+
+def make_final_video(
+    bg_video_path: str,
+    tts_wav_path: str,
+    subtitle_path: str,
+    out_video_path: str,
+    burn_subtitle: bool = True,
+    bgm_volume: float = 1.0,
+    tts_volume: float = 1.0,
+    task_id: int | None = None,
+):
+    """以去人声视频（自带伴奏音轨）为底合成最终视频。"""
+    compose_translated_video(
+        bg_video_path, tts_wav_path, subtitle_path, out_video_path,
+        burn_subtitle=burn_subtitle, bgm_volume=bgm_volume, tts_volume=tts_volume, task_id=task_id,
+    )
+
+
+def _hex24(body: str) -> int:
+    """6 位十六进制串转整数；长度不对或非法时按白色处理。"""
+    if len(body) != 6:
+        return 0xFFFFFF
+    try:
+        return int(body, 16)
+    except ValueError:
+        return 0xFFFFFF
 
 
 def _norm_hex_color_to_ass(c: str, alpha_0_255: int = 0) -> str:
     c = (c or "").strip()
     if c.startswith("&H"):
+        # 已是 ASS 的 (AA)BBGGRR，仅替换 alpha
         body = c[2:]
-        if len(body) == 6:
-            return f"&H{alpha_0_255:02X}{body.upper()}"
-        elif len(body) == 8:
-            return f"&H{alpha_0_255:02X}{body[2:].upper()}"
-        else:
-            return f"&H{alpha_0_255:02X}FFFFFF"
+        if len(body) == 8:
+            body = body[2:]
+        return "&H%02X%06X" % (alpha_0_255, _hex24(body))
     if c.startswith("#"):
         c = c[1:]
-    if len(c) != 6:
-        c = "FFFFFF"
-    rr, gg, bb = c[0:2], c[2:4], c[4:6]
-    return f"&H{alpha_0_255:02X}{bb.upper()}{gg.upper()}{rr.upper()}"
+    v = _hex24(c)
+    # #RRGGBB → &HAABBGGRR
+    return "&H%02X%02X%02X%02X" % (alpha_0_255, v & 0xFF, (v >> 8) & 0xFF, v >> 16)
 
 
 def dump_subtitles_to_ass(
@@ -377,21 +867,34 @@ Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text
 """
 
     def to_ass_time(sec: float) -> str:
-        if sec < 0:
-            sec = 0
-        h = int(sec // 3600)
-        m = int((sec % 3600) // 60)
-        s = sec % 60
-        return f"{h:d}:{m:02d}:{s:06.3f}".replace(".", ",")
-
-    lines = [header]
-    for sub in subtitles:
-        start = to_ass_time(float(sub.start_time))
-        end = to_ass_time(float(sub.end_time))
-        text = ((sub.translated_text or sub.original_text or "").replace("\n", r"\N"))
-        lines.append(f"Dialogue: 0,{start},{end},BoxBG,,0,0,{margin_v},,{{\\q2}}{text}")
-        lines.append(f"Dialogue: 1,{start},{end},Stroke,,0,0,{margin_v},,{{\\q2}}{text}")
+        # 先取整到毫秒再 divmod，直接拼出逗号分隔，避免 59.9996 这类进位成 "60,000"
+        total_ms = max(0, int(round(sec * 1000)))
+        h, r = divmod(total_ms, 3600000)
+        m, r = divmod(r, 60000)
+        s, ms = divmod(r, 1000)
+        return f"{h:d}:{m:02d}:{s:02d},{ms:03d}"
+
+    # 一次性把 ORM 属性取成普通元组，写出循环里不再走 SQLAlchemy 描述符
+    rows = [
+        (float(sub.start_time), float(sub.end_time), sub.translated_text or sub.original_text or "")
+        for sub in subtitles
+    ]
 
     ensure_dir(ass_path)
-    with open(ass_path, "w", encoding="utf-8") as f:
-        f.write("\n".join(lines))
+    # 二进制流式写出：每 64 条拼一块、整体编码一次，绕开文本层逐次编码；不在内存里攒整份文件
+    block: list[str] = []
+    with open(ass_path, "wb", buffering=1 << 20) as f:
+        f.write(header.encode("utf-8"))
+        for st, et, text in rows:
+            start = to_ass_time(st)
+            end = to_ass_time(et)
+            text = text.replace("\n", r"\N")
+            block.append(
+                f"Dialogue: 0,{start},{end},BoxBG,,0,0,{margin_v},,{{\\q2}}{text}\n"
+                f"Dialogue: 1,{start},{end},Stroke,,0,0,{margin_v},,{{\\q2}}{text}\n"
+            )
+            if len(block) >= 64:
+                f.write("".join(block).encode("utf-8"))
+                block.clear()
+        if block:
+            f.write("".join(block).encode("utf-8"))
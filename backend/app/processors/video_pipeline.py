@@ -11,18 +11,23 @@ from sqlalchemy.orm import Session
 from .utils import (                      # 这些函数内部应已接入 killable_run 等
     MEDIA_ROOT,
     get_media_duration_seconds,
-    extract_audio_from_video,
+    decode_audio,
+    separation_input_format,
     separate_vocals_and_bgm,
     mux_video_with_audio,
-    transcribe_vocal_to_subtitles,
+    iter_transcribe_vocal,
+    whisper_config,
     dump_subtitles_to_ass,
     make_final_video,
+    compose_translated_video,
     publish_to_frontend_media,
     format_srt_timestamp,
+    vocal_ref_path,
 )
 from app.logs import get_logger
 from ..models import Task, Subtitle
-from .srt_translate import translate_srt
+from .srt_translate import StreamingTranslator
+from . import cache as result_cache
 from .subtts.sub_api_tts import srt_to_tts
 from app.cancel import is_stop_requested
 
@@ -31,6 +36,18 @@ log = get_logger(__name__)
 MAX_VIDEO_SECONDS = int(os.getenv("MAX_VIDEO_SECONDS", "300"))
 MAX_PARALLEL_TASKS = int(os.getenv("MAX_PARALLEL_TASKS", "1"))
 
+# 各阶段产物目录：导入时建好一次，阶段内不再逐个 makedirs
+_DIRS = {
+    k: os.path.join(MEDIA_ROOT, k)
+    for k in ("vocals", "bgm", "videos_novocals", "srts", "ass", "tts", "final_videos")
+}
+for _d in _DIRS.values():
+    os.makedirs(_d, exist_ok=True)
+
+# 各阶段允许进入的任务状态
+_ALLOWED_FINALIZE = frozenset({"REVIEW", "PROCESSING", "SUCCESS"})
+_ALLOWED_REBURN = frozenset({"SUCCESS", "REVIEW", "PROCESSING"})
+
 
 # ------------------------ 内部小工具 ------------------------ #
 def _map_target_lang(lang: str) -> str:
@@ -53,17 +70,40 @@ def _cancel_if_needed(db: Session, task: Task, msg: str = "任务已被取消")
     return False
 
 
-def _advance(db: Session, task: Task, progress: int, msg: str) -> bool:
+def _advance(db: Session, task: Task, progress: int, msg: str, commit: bool = True) -> bool:
     """
     原子更新进度 + 检查停止。若检测到取消，会同时写回取消状态并返回 True。
+    commit=False 时只改内存中的进度，随本阶段下一次提交一并落库。
     """
     task.progress = max(progress, task.progress or progress)
     task.msg = msg
     db.add(task)
-    db.commit()
+    if commit:
+        db.commit()
     return _cancel_if_needed(db, task, msg=msg)
 
 
+def _write_srt(srt_path: str, subtitles) -> None:
+    """
+    整份 SRT 先在内存拼好，一次 os.write 落盘（不再每条字幕 3 次小写）；subtitles 需已按 sequence 排序。
+    时间戳直接用入库/编辑时已格式化好的 start_time_srt / end_time_srt。
+    """
+    buf = bytearray()
+    for sub in subtitles:
+        buf += (
+            f"{sub.sequence}\n"
+            f"{sub.start_time_srt} --> {sub.end_time_srt}\n"
+            f"{(sub.translated_text or sub.original_text or '').strip()}\n\n"
+        ).encode("utf-8")
+    fd = os.open(srt_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+        view = memoryview(buf)
+        while view:
+            view = view[os.write(fd, view):]
+    finally:
+        os.close(fd)
+
+
 def _fail(db: Session, task: Task, err_msg: str, status: str) -> None:
     task.status = status
     task.error_msg = err_msg
@@ -92,12 +132,13 @@ def process_prepare(db: Session, task: Task):
         task.status = "PROCESSING"
         task.progress = max(5, task.progress or 5)
         task.msg = "开始处理"
-        db.add(task); db.commit(); db.flush()
+        db.add(task)  # 每个阶段只在开头提交一次：开始状态随下一阶段的进度一并落库
 
         if _cancel_if_needed(db, task, "已停止：开始处理阶段"):
             return
 
         video_path = os.path.join(MEDIA_ROOT, task.video_file)
+        ts = f"{task.created_at:%Y%m%d_%H%M%S}"
 
         # —— 读时长（保护：超限直接失败）—— #
         if task.video_duration_seconds < 0.1:
@@ -108,102 +149,123 @@ def process_prepare(db: Session, task: Task):
             if duration > MAX_VIDEO_SECONDS:
                 _fail(db, task, f"视频过长：{duration:.1f}s（限制≤{MAX_VIDEO_SECONDS}s）", "FAILED")
                 return
-            db.add(task); db.commit()
 
-        with tempfile.TemporaryDirectory() as tmp:
-            # 1) 抽音
-            if _advance(db, task, 10, "音频提取中..."):
-                return
-            audio_path = os.path.join(tmp, "audio.wav")
-            extract_audio_from_video(video_path, audio_path, task_id=task.id)
-
-            # 2) 分离人声/伴奏
-            if _advance(db, task, 15, "人声分离中..."):
-                return
-            vocal_path = os.path.join(
-                MEDIA_ROOT, "vocals", f"vocal_{task.id}_{task.created_at:%Y%m%d_%H%M%S}.wav"
-            )
-            bgm_path = os.path.join(
-                MEDIA_ROOT, "bgm", f"bgm_{task.id}_{task.created_at:%Y%m%d_%H%M%S}.wav"
-            )
-            os.makedirs(os.path.dirname(vocal_path), exist_ok=True)
-            os.makedirs(os.path.dirname(bgm_path), exist_ok=True)
-            separate_vocals_and_bgm(audio_path, vocal_path, bgm_path, task_id=task.id)
-            task.vocal_file = os.path.relpath(vocal_path, MEDIA_ROOT)
-            db.add(task); db.commit()
-
-            # 3) 生成去人声视频
-            if _advance(db, task, 20, "背景视频合成中..."):
-                return
-            bg_video = os.path.join(
-                MEDIA_ROOT, "videos_novocals", f"video_novocals_{task.id}_{task.created_at:%Y%m%d_%H%M%S}.mp4"
-            )
-            os.makedirs(os.path.dirname(bg_video), exist_ok=True)
-            mux_video_with_audio(video_path, bgm_path, bg_video, task_id=task.id)
-            task.bg_video_file = os.path.relpath(bg_video, MEDIA_ROOT)
-            db.add(task); db.commit()
+        # 1) 抽音：ffmpeg 按分离模型的采样率/声道解码，经管道直接进内存，不落临时 WAV
+        if _advance(db, task, 10, "音频提取中..."):
+            return
+        sep_sr, sep_channels = separation_input_format()
+        pcm = decode_audio(video_path, sep_sr, sep_channels, task_id=task.id)
 
-            # 4) ASR
-            if _advance(db, task, 25, "音频识别中..."):
-                return
-            segs = transcribe_vocal_to_subtitles(vocal_path, task_id=task.id)
+        # 2) 分离人声/伴奏
+        if _advance(db, task, 15, "人声分离中...", commit=False):
+            return
+        vocal_path = os.path.join(_DIRS["vocals"], f"vocal_{task.id}_{ts}.wav")
+        bgm_path = os.path.join(_DIRS["bgm"], f"bgm_{task.id}_{ts}.wav")
+        separate_vocals_and_bgm(
+            pcm, vocal_path, bgm_path, task_id=task.id, sr=sep_sr, ref_save_path=vocal_ref_path(vocal_path),
+        )
+        del pcm
+        task.vocal_file = os.path.relpath(vocal_path, MEDIA_ROOT)
+
+        # 3) 生成去人声视频
+        if _advance(db, task, 20, "背景视频合成中...", commit=False):
+            return
+        bg_video = os.path.join(_DIRS["videos_novocals"], f"video_novocals_{task.id}_{ts}.mp4")
+        mux_video_with_audio(video_path, bgm_path, bg_video, task_id=task.id)
+        task.bg_video_file = os.path.relpath(bg_video, MEDIA_ROOT)
 
-            # 清理旧字幕并入库新字幕
-            task.subtitles.clear()
-            db.flush()
+        # 4) ASR + 5) 翻译：识别出的片段每凑满一批即提交 LLM 翻译，与后续识别重叠进行
+        # （本次提交同时落库上一阶段的 vocal_file / bg_video_file）
+        if _advance(db, task, 25, "音频识别中..."):
+            return
+        # 同一段人声（内容指纹相同）重复处理时，直接复用缓存的识别片段 / 译文
+        target_lang = _map_target_lang(task.target_language)
+        cps, batch_size = 15.0, 20
+        vocal_hash = result_cache.file_key(vocal_path)
+        asr_cfg = result_cache.asr_config(*whisper_config())
+        asr_key = result_cache.asr_key(vocal_hash, asr_cfg)
+        tr_key = result_cache.translation_key(vocal_hash, asr_cfg, target_lang, cps, batch_size)
+        cached_asr = result_cache.get(asr_key)
+        cached_tr = result_cache.get(tr_key) if cached_asr is not None else None
+        segs = cached_asr["segs"] if cached_asr is not None else []
+
+        def _llm_item(s: Dict[str, Any]) -> Dict[str, Any]:
+            return {
+                "index": int(s["sequence"]),
+                "start_ordinal": int(round(s["start_time"] * 1000)),
+                "end_ordinal": int(round(s["end_time"] * 1000)),
+                "text": s["original_text"],
+            }
+
+        with StreamingTranslator(
+            target_lang=target_lang,
+            cps=cps,
+            exclude_spaces=False,
+            batch_size=batch_size,
+            max_shift=1.0,
+            min_gap=0.10,
+            no_compress_pass=False,
+        ) as translator:
+            if cached_asr is None:
+                for s in iter_transcribe_vocal(vocal_path, task_id=task.id):
+                    segs.append(s)
+                    translator.add(_llm_item(s))
+                if not is_stop_requested(task.id):  # 被取消时片段不完整，不入缓存
+                    result_cache.put(asr_key, {"segs": segs})
+            elif cached_tr is None:
+                log.info(f"[task#{task.id}] ASR 命中缓存（{len(segs)} 条）")
+                for s in segs:
+                    translator.add(_llm_item(s))
+
+            # 清理旧字幕并入库新字幕（尾批翻译仍在进行）：一条 DELETE + 一次 executemany INSERT
+            db.query(Subtitle).filter(Subtitle.task_id == task.id).delete(synchronize_session=False)
+            rows = []
             for s in segs:
                 st = float(s["start_time"]); et = float(s["end_time"])
-                task.subtitles.append(Subtitle(
-                    sequence=s["sequence"],
-                    start_time=st, end_time=et,
-                    start_time_srt=format_srt_timestamp(st),
-                    end_time_srt=format_srt_timestamp(et),
-                    original_text=s["original_text"]
-                ))
-            db.flush()
-
-            # 5) 翻译（支持取消）
-            if _advance(db, task, 30, "字幕翻译中..."):
+                rows.append({
+                    "task_id": task.id,
+                    "sequence": s["sequence"],
+                    "start_time": st, "end_time": et,
+                    "start_time_srt": format_srt_timestamp(st),
+                    "end_time_srt": format_srt_timestamp(et),
+                    "original_text": s["original_text"],
+                })
+            db.bulk_insert_mappings(Subtitle, rows)
+            db.expire(task, ["subtitles"])  # 集合已过期，后续访问时重新加载
+
+            # 翻译不额外传 task_id；在收尾前后做取消检测即可
+            if _advance(db, task, 30, "字幕翻译中...", commit=False):
                 return
-            subs_for_llm = [
-                {
-                    "index": int(s["sequence"]),
-                    "start_ordinal": int(round(s["start_time"] * 1000)),
-                    "end_ordinal": int(round(s["end_time"] * 1000)),
-                    "text": s["original_text"],
-                }
-                for s in segs
-            ]
-
-            # translate_srt 内部一般较快，不额外传 task_id；在调用前后做取消检测即可
             if _cancel_if_needed(db, task, "已停止：翻译前"):
                 return
-            mapping, ok, msg = translate_srt(
-                subs_for_llm,
-                target_lang=_map_target_lang(task.target_language),
-                cps=15.0,
-                exclude_spaces=False,
-                batch_size=20,
-                max_shift=1.0,
-                min_gap=0.10,
-                no_compress_pass=False,
-            )
-            if _cancel_if_needed(db, task, "已停止：翻译后"):
-                return
-
-            if not ok:
-                _fail(db, task, msg or "字幕翻译失败", "FAILED")
-                return
+            if cached_tr is not None:
+                log.info(f"[task#{task.id}] 译文命中缓存")
+                mapping = {int(k): v for k, v in cached_tr["mapping"].items()}
+                ok, msg = True, cached_tr["msg"]
+            else:
+                mapping, ok, msg = translator.finish()
+                if ok:
+                    result_cache.put(tr_key, {"mapping": mapping, "msg": msg})
+        if _cancel_if_needed(db, task, "已停止：翻译后"):
+            return
 
-            for sub in task.subtitles:
-                sub.translated_text = mapping.get(int(sub.sequence), sub.original_text)
+        if not ok:
+            _fail(db, task, msg or "字幕翻译失败", "FAILED")
+            return
 
-            # —— 进入 REVIEW —— #
-            task.status = "REVIEW"
-            task.progress = 60
-            task.msg = "翻译完成，等待人工确认"
-            db.add(task); db.commit()
-            log.info(f"[task#{task.id}] 进入 REVIEW")
+        # 只取主键/序号/原文三列，一次 executemany UPDATE 写回译文，不逐行走 ORM 脏检查
+        db.bulk_update_mappings(Subtitle, [
+            {"id": sid, "translated_text": mapping.get(int(seq), orig)}
+            for sid, seq, orig in db.query(Subtitle.id, Subtitle.sequence, Subtitle.original_text)
+            .filter(Subtitle.task_id == task.id)
+        ])
+
+        # —— 进入 REVIEW —— #
+        task.status = "REVIEW"
+        task.progress = 60
+        task.msg = "翻译完成，等待人工确认"
+        db.add(task); db.commit()
+        log.info(f"[task#{task.id}] 进入 REVIEW")
 
     except Exception as e:
         if str(e) == "Cancelled":
@@ -221,7 +283,7 @@ def process_finalize(db: Session, task: Task):
     - 整个阶段支持取消。
     """
     try:
-        if task.status not in ("REVIEW", "PROCESSING", "SUCCESS"):
+        if task.status not in _ALLOWED_FINALIZE:
             log.warning(f"[task#{task.id}] 状态不允许进入最终合成：{task.status}")
             # _fail(db, task, "状态不允许进入最终合成", task.status)
             return
@@ -237,105 +299,117 @@ def process_finalize(db: Session, task: Task):
         if _cancel_if_needed(db, task, "已停止：准备合成"):
             return
 
-        with tempfile.TemporaryDirectory() as tmp:
-            # —— 输出 SRT（TTS 输入）—— #
-            srt_dir = os.path.join(MEDIA_ROOT, "srts")
-            os.makedirs(srt_dir, exist_ok=True)
-            srt_path = os.path.join(srt_dir, f"subs_{task.id}_{task.created_at:%Y%m%d_%H%M%S}.srt")
-            with open(srt_path, "w", encoding="utf-8") as f:
-                for sub in sorted(task.subtitles, key=lambda x: x.sequence):
-                    f.write(f"{sub.sequence}\n")
-                    f.write(f"{format_srt_timestamp(sub.start_time)} --> {format_srt_timestamp(sub.end_time)}\n")
-                    f.write(f"{(sub.translated_text or sub.original_text or '').strip()}\n\n")
-
-            if _cancel_if_needed(db, task, "已停止：写入SRT后"):
-                return
+        # —— 输出 SRT（TTS 输入）—— #
+        ts = f"{task.created_at:%Y%m%d_%H%M%S}"
+        srt_path = os.path.join(_DIRS["srts"], f"subs_{task.id}_{ts}.srt")
+        subs = task.subtitles  # 关系已按 sequence 排序
+        _write_srt(srt_path, subs)
 
-            # —— 如需 ASS，再额外生成用于最终视频烧录 —— #
-            use_ass = (task.subtitle_format or "ass").lower() == "ass"
-            if use_ass:
-                ass_dir = os.path.join(MEDIA_ROOT, "ass")
-                os.makedirs(ass_dir, exist_ok=True)
-                ass_path = os.path.join(ass_dir, f"subs_{task.id}_{task.created_at:%Y%m%d_%H%M%S}.ass")
-                dump_subtitles_to_ass(
-                    subtitles=sorted(task.subtitles, key=lambda x: x.sequence),
-                    ass_path=ass_path,
-                    title=task.title,
-                    font_name=task.sub_font_name,
-                    font_size=task.sub_font_size,
-                    font_bold=task.sub_font_bold,
-                    font_italic=task.sub_font_italic,
-                    font_underline=task.sub_font_underline,
-                    font_color=task.sub_font_color,
-                    outline_color=task.sub_outline_color,
-                    back_color=task.sub_back_color,
-                    outline_width=task.sub_outline_width,
-                    back_opacity=task.sub_back_opacity,
-                    alignment=task.sub_alignment or 2,
-                    margin_v=10,
-                )
-                subtitle_for_video = ass_path
-            else:
-                subtitle_for_video = srt_path
+        if _cancel_if_needed(db, task, "已停止：写入SRT后"):
+            return
 
-            if _cancel_if_needed(db, task, "已停止：字幕准备就绪"):
-                return
+        # —— 如需 ASS，再额外生成用于最终视频烧录 —— #
+        use_ass = (task.subtitle_format or "ass").lower() == "ass"
+        if use_ass:
+            ass_path = os.path.join(_DIRS["ass"], f"subs_{task.id}_{ts}.ass")
+            dump_subtitles_to_ass(
+                subtitles=subs,
+                ass_path=ass_path,
+                title=task.title,
+                font_name=task.sub_font_name,
+                font_size=task.sub_font_size,
+                font_bold=task.sub_font_bold,
+                font_italic=task.sub_font_italic,
+                font_underline=task.sub_font_underline,
+                font_color=task.sub_font_color,
+                outline_color=task.sub_outline_color,
+                back_color=task.sub_back_color,
+                outline_width=task.sub_outline_width,
+                back_opacity=task.sub_back_opacity,
+                alignment=task.sub_alignment or 2,
+                margin_v=10,
+            )
+            subtitle_for_video = ass_path
+        else:
+            subtitle_for_video = srt_path
 
-            # —— TTS —— #
-            tts_dir = os.path.join(MEDIA_ROOT, "tts")
-            os.makedirs(tts_dir, exist_ok=True)
-            tts_out = os.path.join(tts_dir, f"tts_{task.id}_{task.created_at:%Y%m%d_%H%M%S}.wav")
+        if _cancel_if_needed(db, task, "已停止：字幕准备就绪"):
+            return
 
-            refp_or_tname = (
-                os.path.join(MEDIA_ROOT, task.vocal_file)
-                if (task.tts_voice == "auto" and task.vocal_file)
-                else None
-            )
-            if task.tts_voice != "auto":
-                refp_or_tname = task.tts_name
+        # —— TTS —— #
+        tts_out = os.path.join(_DIRS["tts"], f"tts_{task.id}_{ts}.wav")
 
-            if _advance(db, task, 75, "TTS 合成中..."):
-                return
+        refp_or_tname = None
+        if task.tts_voice == "auto" and task.vocal_file:
+            # 优先用阶段一另存的人声前段作参考音色（旧任务没有时退回整段人声）
+            vocal_abs = os.path.join(MEDIA_ROOT, task.vocal_file)
+            ref_abs = vocal_ref_path(vocal_abs)
+            refp_or_tname = ref_abs if os.path.exists(ref_abs) else vocal_abs
+        if task.tts_voice != "auto":
+            refp_or_tname = task.tts_name
 
-            ok, msg = srt_to_tts(
-                srt_path=srt_path,
-                out_path=tts_out,
-                language=task.target_language.replace("zh-CN", "zh-cn"),
-                engine="auto",
-                refp_or_tname=refp_or_tname,
-                resolve_mode=None,
-                voiceid=(task.tts_voice or None),
-                task_id=task.id,  # ★ 透传，内部支持取消
-            )
-            if not ok:
-                if is_stop_requested(task.id):
-                    # TTS 内部已因取消中断
-                    task.status = "REVIEW"
-                    task.msg = "已停止：TTS 合成中"
-                    db.add(task); db.commit()
-                    return
-                _fail(db, task, f"TTS 失败：{msg}", "REVIEW")
+        if _advance(db, task, 75, "TTS 合成中..."):
+            return
+
+        # TTS 刚写出的混音 (pcm, sr) 由后端放回这里，最终合成直接经管道送 ffmpeg；
+        # 只是本函数的局部变量，用完即弃，不会在进程里常驻
+        tts_mix: dict = {}
+        ok, msg = srt_to_tts(
+            srt_path=srt_path,
+            out_path=tts_out,
+            language=task.target_language.replace("zh-CN", "zh-cn"),
+            engine="auto",
+            refp_or_tname=refp_or_tname,
+            resolve_mode=None,
+            voiceid=(task.tts_voice or None),
+            task_id=task.id,  # ★ 透传，内部支持取消
+            mix_out=tts_mix,
+        )
+        if not ok:
+            if is_stop_requested(task.id):
+                # TTS 内部已因取消中断
+                task.status = "REVIEW"
+                task.msg = "已停止：TTS 合成中"
+                db.add(task); db.commit()
                 return
+            _fail(db, task, f"TTS 失败：{msg}", "REVIEW")
+            return
 
-            task.tts_file = os.path.relpath(tts_out, MEDIA_ROOT)
-            db.add(task); db.commit()
-            log.info(f"[task#{task.id}] TTS done -> {task.tts_file}")
+        task.tts_file = os.path.relpath(tts_out, MEDIA_ROOT)
+        db.add(task); db.commit()
+        log.info(f"[task#{task.id}] TTS done -> {task.tts_file}")
 
-            if _cancel_if_needed(db, task, "已停止：TTS 完成后"):
-                return
+        if _cancel_if_needed(db, task, "已停止：TTS 完成后"):
+            return
 
-            # —— 合成最终视频 —— #
-            if _advance(db, task, 90, "最终视频合成中..."):
-                return
+        # —— 合成最终视频 —— #
+        if _advance(db, task, 90, "最终视频合成中..."):
+            return
 
-            if not task.bg_video_file:
-                _fail(db, task, "缺少无声视频", "REVIEW")
-                return
+        if not task.bg_video_file:
+            _fail(db, task, "缺少无声视频", "REVIEW")
+            return
 
-            final_dir = os.path.join(MEDIA_ROOT, "final_videos")
-            os.makedirs(final_dir, exist_ok=True)
-            final_out = os.path.join(final_dir, f"final_{task.id}_{task.created_at:%Y%m%d_%H%M%S}.mp4")
+        final_out = os.path.join(_DIRS["final_videos"], f"final_{task.id}_{ts}.mp4")
 
+        # 阶段一分离出的伴奏 WAV 仍在时，直接以原视频画面 + 伴奏 + TTS 一次合成，
+        # 不再解码去人声视频里重编码过的 AAC
+        bgm_wav = os.path.join(_DIRS["bgm"], f"bgm_{task.id}_{ts}.wav")
+        if os.path.exists(bgm_wav):
+            compose_translated_video(
+                src_video_path=os.path.join(MEDIA_ROOT, task.video_file),
+                tts_wav_path=tts_out,
+                tts_pcm=tts_mix.pop("pcm", None),  # 取走即释放引用，合成结束后数组随之回收
+                subtitle_path=subtitle_for_video,
+                out_video_path=final_out,
+                bgm_audio_path=bgm_wav,
+                burn_subtitle=(task.burn_subtitle or use_ass),
+                bgm_volume=task.bgm_volume,
+                tts_volume=task.tts_volume,
+                task_id=task.id,  # ★ 透传，内部 ffmpeg 可被杀
+            )
+        else:
+            tts_mix.clear()  # 此路径回读 WAV，不必在合成期间留着混音
             make_final_video(
                 bg_video_path=os.path.join(MEDIA_ROOT, task.bg_video_file),
                 tts_wav_path=tts_out,
@@ -347,17 +421,17 @@ def process_finalize(db: Session, task: Task):
                 task_id=task.id,  # ★ 透传，内部 ffmpeg 可被杀
             )
 
-            if _cancel_if_needed(db, task, "已停止：最终视频生成后"):
-                return
+        if _cancel_if_needed(db, task, "已停止：最终视频生成后"):
+            return
 
-            task.final_video_file = os.path.relpath(final_out, MEDIA_ROOT)
-            log.info(f"[task#{task.id}] Final video -> {task.final_video_file}")
+        task.final_video_file = os.path.relpath(final_out, MEDIA_ROOT)
+        log.info(f"[task#{task.id}] Final video -> {task.final_video_file}")
 
-            # 前端可访问路径
-            rel_front = publish_to_frontend_media(final_out, "final_videos")
-            log.info(f"[task#{task.id}] Published -> {rel_front}")
+        # 前端可访问路径
+        rel_front = publish_to_frontend_media(final_out, "final_videos")
+        log.info(f"[task#{task.id}] Published -> {rel_front}")
 
-            _succeed(db, task, "处理完成")
+        _succeed(db, task, "处理完成")
 
     except Exception as e:
         if str(e) == "Cancelled":
@@ -375,7 +449,7 @@ def process_reburn(db: Session, task: Task):
     - 支持取消。
     """
     try:
-        if task.status not in ("SUCCESS", "REVIEW", "PROCESSING"):
+        if task.status not in _ALLOWED_REBURN:
             _fail(db, task, "当前状态不可仅重烧", "SUCCESS")
             return
         if not task.bg_video_file or not task.tts_file:
@@ -390,13 +464,14 @@ def process_reburn(db: Session, task: Task):
         if _cancel_if_needed(db, task, "已停止：准备重烧"):
             return
 
+        subs = task.subtitles  # 关系已按 sequence 排序
         with tempfile.TemporaryDirectory() as tmp:
             # 生成字幕文件（ASS 或 SRT）
             use_ass = (task.subtitle_format or "ass").lower() == "ass"
             if use_ass:
                 ass_tmp = os.path.join(tmp, "reburn.ass")
                 dump_subtitles_to_ass(
-                    subtitles=sorted(task.subtitles, key=lambda x: x.sequence),
+                    subtitles=subs,
                     ass_path=ass_tmp,
                     title=task.title,
                     font_name=task.sub_font_name,
@@ -415,20 +490,14 @@ def process_reburn(db: Session, task: Task):
                 sub_path = ass_tmp
             else:
                 srt_tmp = os.path.join(tmp, "reburn.srt")
-                with open(srt_tmp, "w", encoding="utf-8") as f:
-                    for sub in sorted(task.subtitles, key=lambda x: x.sequence):
-                        f.write(f"{sub.sequence}\n")
-                        f.write(f"{format_srt_timestamp(sub.start_time)} --> {format_srt_timestamp(sub.end_time)}\n")
-                        f.write(f"{(sub.translated_text or sub.original_text or '').strip()}\n\n")
+                _write_srt(srt_tmp, subs)
                 sub_path = srt_tmp
 
             if _cancel_if_needed(db, task, "已停止：重烧字幕准备就绪"):
                 return
 
             # 输出路径
-            final_dir = os.path.join(MEDIA_ROOT, "final_videos")
-            os.makedirs(final_dir, exist_ok=True)
-            final_out = os.path.join(final_dir, f"final_reburn_{task.id}_{datetime.utcnow():%Y%m%d_%H%M%S}.mp4")
+            final_out = os.path.join(_DIRS["final_videos"], f"final_reburn_{task.id}_{datetime.utcnow():%Y%m%d_%H%M%S}.mp4")
 
             # 合成（复用已有 TTS）
             make_final_video(
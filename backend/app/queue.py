@@ -3,13 +3,18 @@ import uuid
 import socket
 import asyncio
 from contextlib import suppress
+from sqlalchemy import update, select, and_, or_, case, cast, func, String
 from sqlalchemy.orm import Session
 from datetime import datetime, timedelta
 
 from .models import Task
-from .db import SessionLocal
+from .db import SessionLocal, engine
 from .processors.video_pipeline import *
-from .crud import list_queue, count_processing
+from .processors.utils import WHISPER_PRELOAD, warmup_whisper
+from .crud import list_queue, add_queue_listener, bump_queue_epoch
+from .logs import get_logger
+
+log = get_logger(__name__)
 
 # ----------------- 配置 -----------------
 MAX_PARALLEL = int(os.getenv("MAX_PARALLEL_TASKS", "1"))
@@ -25,6 +30,10 @@ MAX_PROCESSING_SECONDS = int(os.getenv("MAX_PROCESSING_SECONDS", "600"))  # 10 
 # 自动重试（当模型无 attempt/max_attempts 字段时使用）
 MAX_RETRIES = int(os.getenv("MAX_RETRIES", "0"))
 
+# 无事件时分发器的兜底轮询间隔；救援扫描的周期
+DISPATCH_IDLE_SECONDS = float(os.getenv("DISPATCH_IDLE_SECONDS", "30"))
+RESCUE_INTERVAL_SECONDS = max(1, STALE_SECONDS // 2)
+
 # 本 worker 唯一标识
 WORKER_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
 
@@ -34,16 +43,20 @@ def _now() -> datetime:
     return datetime.utcnow()
 
 
-def _lease_deadline() -> datetime:
-    return _now() + timedelta(seconds=LEASE_SECONDS)
+def _lease_deadline(now: datetime | None = None) -> datetime:
+    return (now or _now()) + timedelta(seconds=LEASE_SECONDS)
 
 
-def _hasattr_safe(obj, name: str) -> bool:
-    try:
-        getattr(obj, name)
-        return True
-    except Exception:
-        return False
+# 可选的租约列是否存在：导入时按类判断一次，热路径里只读布尔值
+_HAS_WORKER_ID = hasattr(Task, "worker_id")
+_HAS_LEASE_UNTIL = hasattr(Task, "lease_until")
+_HAS_HEARTBEAT_AT = hasattr(Task, "heartbeat_at")
+_HAS_PROCESSING_STARTED_AT = hasattr(Task, "processing_started_at")
+
+
+# ----------------- 本进程在跑的任务 -----------------
+# 任务只由本进程的分发器拉起，占用的并发槽位直接看这个集合，调度时不再 COUNT 数据库
+_running: set[int] = set()
 
 
 # ----------------- 内存兜底重试表 -----------------
@@ -74,9 +87,9 @@ def _run_one_sync(task_id: int):
             return
 
         # 若租约失效或被其它 worker 占用，直接退出
-        if _hasattr_safe(t, "worker_id") and t.worker_id and t.worker_id != WORKER_ID:
+        if _HAS_WORKER_ID and t.worker_id and t.worker_id != WORKER_ID:
             return
-        if _hasattr_safe(t, "lease_until") and t.lease_until and t.lease_until < _now():
+        if _HAS_LEASE_UNTIL and t.lease_until and t.lease_until < _now():
             return
 
         # 分派阶段
@@ -99,13 +112,13 @@ def _run_one_sync(task_id: int):
         try:
             t = db.get(Task, task_id)
             if t:
-                if _hasattr_safe(t, "worker_id"):
+                if _HAS_WORKER_ID:
                     t.worker_id = None
-                if _hasattr_safe(t, "lease_until"):
+                if _HAS_LEASE_UNTIL:
                     t.lease_until = None
-                if _hasattr_safe(t, "heartbeat_at"):
+                if _HAS_HEARTBEAT_AT:
                     t.heartbeat_at = None
-                if _hasattr_safe(t, "processing_started_at"):
+                if _HAS_PROCESSING_STARTED_AT:
                     t.processing_started_at = None
                 db.add(t)
                 db.commit()
@@ -121,48 +134,34 @@ async def _heartbeat_loop(task_id: int):
     周期性刷新心跳与续租。
     ⚠️ 若发现任务已不在 PROCESSING（例如切到 REVIEW/QUEUED/SUCCESS/FAILED），
        立刻清空占位信息（包括 lease_until），然后退出心跳。
+    每次心跳只在连接上执行 UPDATE，不建 Session、不加载 ORM 对象。
     """
+    owned = or_(Task.worker_id.is_(None), Task.worker_id == WORKER_ID)
     while True:
         await asyncio.sleep(HEARTBEAT_SECONDS)
-        db: Session = SessionLocal()
+        now = _now()
         try:
-            t = db.get(Task, task_id)
-            if not t:
-                return
-            # 不再由本 worker 持有，或状态不在 PROCESSING：清空并退出
-            not_owner = _hasattr_safe(t, "worker_id") and t.worker_id and t.worker_id != WORKER_ID
-            not_processing = t.status != "PROCESSING"
-            if not_owner or not_processing:
-                changed = False
-                if _hasattr_safe(t, "worker_id") and t.worker_id is not None:
-                    t.worker_id = None
-                    changed = True
-                if _hasattr_safe(t, "lease_until") and t.lease_until is not None:
-                    t.lease_until = None
-                    changed = True
-                if _hasattr_safe(t, "heartbeat_at") and t.heartbeat_at is not None:
-                    t.heartbeat_at = None
-                    changed = True
-                if _hasattr_safe(t, "processing_started_at") and t.processing_started_at is not None:
-                    t.processing_started_at = None
-                    changed = True
-                if changed:
-                    db.add(t)
-                    db.commit()
-                return
-
-            # 仍在本 worker + PROCESSING：正常心跳与续租
-            if _hasattr_safe(t, "heartbeat_at"):
-                t.heartbeat_at = _now()
-            if _hasattr_safe(t, "lease_until"):
-                t.lease_until = _lease_deadline()
-            db.add(t)
-            db.commit()
-
+            with engine.begin() as conn:
+                # 仍在本 worker + PROCESSING：正常心跳与续租
+                hit = conn.execute(
+                    update(Task)
+                    .where(Task.id == task_id, Task.status == "PROCESSING", owned)
+                    .values(heartbeat_at=now, lease_until=_lease_deadline(now))
+                ).rowcount
+                if hit:
+                    continue
+                # 不再由本 worker 持有，或状态不在 PROCESSING（或任务已删除）：清空并退出
+                conn.execute(
+                    update(Task)
+                    .where(Task.id == task_id, or_(
+                        Task.worker_id.is_not(None), Task.lease_until.is_not(None),
+                        Task.heartbeat_at.is_not(None), Task.processing_started_at.is_not(None),
+                    ))
+                    .values(worker_id=None, lease_until=None, heartbeat_at=None, processing_started_at=None)
+                )
+            return
         except Exception:
-            db.rollback()
-        finally:
-            db.close()
+            pass
 
 
 # ----------------- 线程封装（异步） -----------------
@@ -174,9 +173,12 @@ async def _run_one(task_id: int):
     try:
         await asyncio.to_thread(_run_one_sync, task_id)
     finally:
-        with suppress(Exception):
+        # 被 cancel 的心跳协程 await 时抛 CancelledError（BaseException），需一并吞掉
+        with suppress(asyncio.CancelledError, Exception):
             hb_task.cancel()
             await hb_task
+        _running.discard(task_id)
+        _wakeup.set()  # 腾出了并发槽位
 
 
 # ----------------- 救援/回收逻辑 -----------------
@@ -186,114 +188,169 @@ def _rescue_orphan_tasks(db: Session):
     - processing 段：从 processing_started_at 计时（若无则退化为 heartbeat_at/created_at）
     - 条件：租约过期 或 心跳过旧 或 processing 段超时
     命中后：优先回队列重试（清空占位与租约）；超出重试上限则 FAILED。
+    判定与改写都在 SQL 里完成：按模型计数重试的行各用一条 UPDATE，不把 PROCESSING 行逐条载入。
     """
     now = _now()
     stale_edge = now - timedelta(seconds=STALE_SECONDS)
-    proc_tasks = db.query(Task).filter(Task.status == "PROCESSING").all()
-    for t in proc_tasks:
-        # 起点
-        if _hasattr_safe(t, "processing_started_at") and t.processing_started_at:
-            started = t.processing_started_at
-        elif _hasattr_safe(t, "heartbeat_at") and t.heartbeat_at:
-            started = t.heartbeat_at
+    proc_edge = now - timedelta(seconds=MAX_PROCESSING_SECONDS)
+
+    lease_expired = Task.lease_until < now
+    heartbeat_stale = or_(Task.heartbeat_at.is_(None), Task.heartbeat_at < stale_edge)
+    over_processing_cap = func.coalesce(Task.processing_started_at, Task.heartbeat_at, Task.created_at) < proc_edge
+    orphan = and_(Task.status == "PROCESSING", or_(lease_expired, heartbeat_stale, over_processing_cap))
+    # 命中原因拼成 "a, b, c"：每项带前缀 ", "，最后去掉开头两个字符
+    reasons = func.substr(
+        case((lease_expired, ", lease_expired"), else_="")
+        + case((heartbeat_stale, ", heartbeat_stale"), else_="")
+        + case((over_processing_cap, f", processing>{MAX_PROCESSING_SECONDS}s"), else_=""),
+        3,
+    )
+    # 清空占位信息（包含 lease_until）
+    cleared = dict(worker_id=None, lease_until=None, heartbeat_at=None, processing_started_at=None)
+
+    # 自动重试：模型带 attempt/max_attempts 时按库内计数
+    next_attempt = func.coalesce(Task.attempt, 0) + 1
+    by_model = and_(orphan, Task.max_attempts.is_not(None))
+    requeued = db.execute(
+        update(Task)
+        .where(by_model, next_attempt <= Task.max_attempts)
+        .values(
+            status="QUEUED", attempt=next_attempt, enqueued_at=now,
+            error_msg="检测到任务失联/超时（" + reasons + "），自动重试第 " + cast(next_attempt, String) + " 次。",
+            **cleared,
+        )
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    failed = db.execute(
+        update(Task)
+        .where(by_model)  # 上一条已把可重试的行改回 QUEUED，剩下的都超出上限
+        .values(
+            status="FAILED", attempt=next_attempt,
+            error_msg="任务失联/超时并达到最大重试次数（" + reasons + "）。",
+            **cleared,
+        )
+        .execution_options(synchronize_session=False)
+    ).rowcount
+
+    # max_attempts 为空的旧数据：退回内存计数，逐条处理（通常没有）
+    legacy = db.execute(
+        select(Task.id, reasons).where(orphan, Task.max_attempts.is_(None))
+    ).all()
+    for task_id, why in legacy:
+        attempt = _inc_memory_attempt(int(task_id))
+        if attempt <= MAX_RETRIES:
+            values = dict(
+                status="QUEUED", enqueued_at=now,
+                error_msg=f"检测到任务失联/超时（{why}），自动重试第 {attempt} 次。",
+            )
         else:
-            started = getattr(t, "created_at", now)
-        processing_seconds = (now - started).total_seconds() if started else 0.0
-        lease_expired = _hasattr_safe(t, "lease_until") and t.lease_until and t.lease_until < now
-        heartbeat_stale = (not _hasattr_safe(t, "heartbeat_at")) or (not t.heartbeat_at) or (t.heartbeat_at < stale_edge)
-        over_processing_cap = processing_seconds > MAX_PROCESSING_SECONDS
-
-        if not (lease_expired or heartbeat_stale or over_processing_cap):
-            continue
-
-        reasons = []
-        if lease_expired:
-            reasons.append("lease_expired")
-        if heartbeat_stale:
-            reasons.append("heartbeat_stale")
-        if over_processing_cap:
-            reasons.append(f"processing>{MAX_PROCESSING_SECONDS}s")
-
-        # 自动重试
-        can_retry_by_model = _hasattr_safe(t, "attempt") and _hasattr_safe(t, "max_attempts") and (t.max_attempts is not None)
-        if can_retry_by_model:
-            t.attempt = (t.attempt or 0) + 1
-            left = (t.max_attempts or 0) - (t.attempt or 0)
-            if left >= 0:
-                t.status = "QUEUED"
-                t.enqueued_at = datetime.utcnow() 
-                t.error_msg = f"检测到任务失联/超时（{', '.join(reasons)}），自动重试第 {t.attempt} 次。"
-            else:
-                t.status = "FAILED"
-                t.error_msg = f"任务失联/超时并达到最大重试次数（{', '.join(reasons)}）。"
-        else:
-            attempt = _inc_memory_attempt(int(t.id))
-            if attempt <= MAX_RETRIES:
-                t.status = "QUEUED"
-                t.enqueued_at = datetime.utcnow() 
-                t.error_msg = f"检测到任务失联/超时（{', '.join(reasons)}），自动重试第 {attempt} 次。"
-            else:
-                t.status = "FAILED"
-                t.error_msg = f"任务失联/超时并达到最大重试次数（{', '.join(reasons)}）。"
-
-        # 清空占位信息（包含 lease_until）
-        if _hasattr_safe(t, "worker_id"):
-            t.worker_id = None
-        if _hasattr_safe(t, "lease_until"):
-            t.lease_until = None
-        if _hasattr_safe(t, "heartbeat_at"):
-            t.heartbeat_at = None
-        if _hasattr_safe(t, "processing_started_at"):
-            t.processing_started_at = None
-
-        db.add(t)
-
-        if t.status == "FAILED":
-            _reset_memory_attempt(int(t.id))
+            values = dict(status="FAILED", error_msg=f"任务失联/超时并达到最大重试次数（{why}）。")
+            _reset_memory_attempt(int(task_id))
+        db.execute(
+            update(Task).where(Task.id == task_id).values(**values, **cleared)
+            .execution_options(synchronize_session=False)
+        )
 
     db.commit()
+    if requeued or failed or legacy:
+        # 批量 UPDATE 不经过 ORM flush，需手动通知队列变化
+        bump_queue_epoch()
+
+
+# ----------------- 唤醒 -----------------
+# 任务状态/排队变化（入队、结束、救援回队列）提交后由 crud 回调唤醒分发器，空闲时不再轮询数据库
+_wakeup = asyncio.Event()
+_loop: asyncio.AbstractEventLoop | None = None
+
+
+def wake_dispatcher() -> None:
+    """可在任意线程调用（路由线程池、任务线程）；分发器尚未启动时忽略。"""
+    loop = _loop
+    if loop is None or loop.is_closed():
+        return
+    with suppress(RuntimeError):
+        loop.call_soon_threadsafe(_wakeup.set)
+
+
+add_queue_listener(wake_dispatcher)
+
+
+async def _rescue_loop():
+    """救援扫描独立按周期运行；有任务回到队列时，提交会经由上面的回调唤醒分发器。"""
+    while True:
+        db: Session = SessionLocal()
+        try:
+            _rescue_orphan_tasks(db)
+        except Exception:
+            db.rollback()
+        finally:
+            db.close()
+        await asyncio.sleep(RESCUE_INTERVAL_SECONDS)
+
+
+async def _preload_models():
+    """后台线程预加载 Whisper；失败只记日志，首个任务时会再按需加载。"""
+    try:
+        await asyncio.to_thread(warmup_whisper)
+        log.info("Whisper 模型已预加载")
+    except Exception as e:
+        log.warning(f"Whisper 预加载失败：{type(e).__name__}: {e}")
 
 
 # ----------------- 分发器 -----------------
 async def dispatcher():
     """
-    每 2 秒调度一次：
-      1) 救援失联任务；
+    事件驱动调度（无事件时每 DISPATCH_IDLE_SECONDS 秒兜底一次）：
+      1) 救援失联任务（由 _rescue_loop 独立周期执行）；
       2) 按并发上限拉起 QUEUED 任务，进入 PROCESSING；
       3) 为每个启动的任务开线程执行，并在事件循环里维护心跳。
     """
+    global _loop
+    _loop = asyncio.get_running_loop()
+    db: Session = SessionLocal()
+    try:
+        # 本 worker 名下已在 PROCESSING 的任务计入槽位
+        _running.update(db.execute(
+            select(Task.id).where(Task.status == "PROCESSING", Task.worker_id == WORKER_ID)
+        ).scalars())
+    finally:
+        db.close()
+    asyncio.create_task(_rescue_loop())
+    if WHISPER_PRELOAD:
+        asyncio.create_task(_preload_models())
+
     while True:
+        _wakeup.clear()
         db: Session = SessionLocal()
         try:
-            # 1) 先救援
-            _rescue_orphan_tasks(db)
-
-            # 2) 拉起新任务
-            running = count_processing(db)
-            slots = max(0, MAX_PARALLEL - running)
+            # 拉起新任务
+            slots = max(0, MAX_PARALLEL - len(_running))
             if slots > 0:
                 queue = list_queue(db)[:slots]
                 for t in queue:
                     if t.status != "QUEUED":
                         continue
                     # 占位并进入处理；仅此刻记录 processing_started_at（排队不计时）
+                    now = _now()  # 同一时刻写入三个时间列
                     t.status = "PROCESSING"
-                    if _hasattr_safe(t, "worker_id"):
+                    if _HAS_WORKER_ID:
                         t.worker_id = WORKER_ID
-                    if _hasattr_safe(t, "lease_until"):
-                        t.lease_until = _lease_deadline()
-                    if _hasattr_safe(t, "heartbeat_at"):
-                        t.heartbeat_at = _now()
-                    if _hasattr_safe(t, "processing_started_at"):
-                        t.processing_started_at = _now()
+                    if _HAS_LEASE_UNTIL:
+                        t.lease_until = _lease_deadline(now)
+                    if _HAS_HEARTBEAT_AT:
+                        t.heartbeat_at = now
+                    if _HAS_PROCESSING_STARTED_AT:
+                        t.processing_started_at = now
                     db.add(t)
                     db.commit()
 
                     # 线程执行 + 心跳
+                    _running.add(t.id)
                     asyncio.create_task(_run_one(t.id))
         except Exception:
             db.rollback()
         finally:
             db.close()
 
-        await asyncio.sleep(2)
+        with suppress(asyncio.TimeoutError):
+            await asyncio.wait_for(_wakeup.wait(), timeout=DISPATCH_IDLE_SECONDS)
@@ -1,10 +1,16 @@
+import os
 from typing import Union
 from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
+from sqlalchemy import select, update
 from sqlalchemy.orm import Session
+from .. import crud
 from ..db import get_db
 from ..models import Task, Subtitle
-from ..processors.utils import parse_time_to_seconds, format_srt_timestamp
+from ..schemas import SubtitleOut
+from ..processors.utils import MEDIA_ROOT, parse_time_to_seconds, format_srt_timestamp
+from ..processors import cache as result_cache
 
 router = APIRouter(prefix="/api/subtitles", tags=["subtitles"])
 
@@ -13,14 +19,43 @@ class SubtitlePatch(BaseModel):
     end_time: Union[float, str]
     translated_text: str
 
+@router.get("/{task_id}", response_model=list[SubtitleOut])
+def list_subtitles(task_id: int, db: Session = Depends(get_db)):
+    """按 sequence 流式输出 JSON 数组；长字幕无需先整体载入内存"""
+    # 只查 id：db.get(Task) 会按 selectin 把全部字幕预加载进来
+    if db.execute(select(Task.id).where(Task.id == task_id)).first() is None:
+        raise HTTPException(404, "Task not found")
+    def _iter():
+        yield "["
+        for i, sub in enumerate(crud.get_subtitles(db, task_id)):
+            yield ("," if i else "") + SubtitleOut.model_validate(sub).model_dump_json()
+        yield "]"
+    return StreamingResponse(_iter(), media_type="application/json")
+
 @router.patch("/{task_id}/{subtitle_id}")
 def edit_subtitle(task_id:int, subtitle_id:int, body:SubtitlePatch, db: Session = Depends(get_db)):
-    sub = db.get(Subtitle, subtitle_id)
-    if not sub or sub.task_id != task_id: raise HTTPException(404, "Subtitle not found")
     st = parse_time_to_seconds(body.start_time)
     et = parse_time_to_seconds(body.end_time)
     if et <= st: raise HTTPException(400, "结束时间必须大于开始时间")
-    sub.translated_text = body.translated_text
-    sub.start_time = st; sub.end_time = et; 
-    sub.start_time_srt = format_srt_timestamp(st); sub.end_time_srt = format_srt_timestamp(et)
-    db.add(sub); return {"ok": True}
+    # 归属校验与修改合并为一条 UPDATE：不先 SELECT 整行
+    res = db.execute(
+        update(Subtitle)
+        .where(Subtitle.id == subtitle_id, Subtitle.task_id == task_id)
+        .values(
+            translated_text=body.translated_text,
+            start_time=st, end_time=et,
+            start_time_srt=format_srt_timestamp(st), end_time_srt=format_srt_timestamp(et),
+        )
+        .execution_options(synchronize_session=False)
+    )
+    if not res.rowcount: raise HTTPException(404, "Subtitle not found")
+    db.commit()
+    # 人工改过译文后，该段人声的译文缓存作废，重跑阶段一时重新请求 LLM
+    vocal_file = db.execute(select(Task.vocal_file).where(Task.id == task_id)).scalar()
+    if vocal_file:
+        try:
+            vocal_hash = result_cache.file_key(os.path.join(MEDIA_ROOT, vocal_file))
+            result_cache.delete_prefix(result_cache.translation_prefix(vocal_hash))
+        except OSError:
+            pass
+    return {"ok": True}
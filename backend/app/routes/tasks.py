@@ -1,14 +1,19 @@
-import os, shutil
+import os, json, time, shutil, hashlib
 from typing import Optional
+from contextlib import suppress
 from datetime import datetime
+from sqlalchemy import func
 from sqlalchemy.orm import Session
 from pydantic import BaseModel, Field
-from fastapi import APIRouter, UploadFile, File, Form, Depends, HTTPException
+from fastapi import APIRouter, BackgroundTasks, UploadFile, File, Form, Depends, HTTPException, Request, Response
+from fastapi.concurrency import run_in_threadpool
+from python_multipart import MultipartParser
+from python_multipart.multipart import parse_options_header
 
 from ..db import get_db
 from .. import crud, models
-from ..processors.utils import MEDIA_ROOT
-from ..schemas import TaskCreate, TaskOut, TaskDetail, ProgressOut
+from ..processors.utils import MEDIA_ROOT, vocal_ref_path
+from ..schemas import TaskCreate, TaskOut, TaskListItem, TaskDetail, ProgressOut
 
 from app.logs import get_logger
 from app.cancel import request_stop
@@ -17,6 +22,9 @@ log = get_logger(__name__)
 # === 每用户排队上限（仅统计 QUEUED），默认 1，可用环境变量覆盖 ===
 MAX_QUEUED_PER_USER = int(os.getenv("MAX_QUEUED_PER_USER", "1"))
 
+# by-path 导入时同盘硬链接：与用户给的原文件共享 inode（原文件被原地改写会连带影响任务视频），默认关闭
+BY_PATH_HARDLINK = os.getenv("BY_PATH_HARDLINK", "0") == "1"
+
 def _can_user_queue_now(db: Session, user_id: str, exclude_task_id: int | None = None) -> bool:
     """
     返回该用户是否仍可入队（未达到排队上限）。
@@ -25,8 +33,9 @@ def _can_user_queue_now(db: Session, user_id: str, exclude_task_id: int | None =
     if not user_id:
         # 模型 Task.user_id 非空；这里兜底为不可入队
         return False
-    cur = crud.count_user_queued(db, user_id=user_id, exclude_task_id=exclude_task_id)
-    return cur < MAX_QUEUED_PER_USER
+    return not crud.has_at_least_user_queued(
+        db, user_id=user_id, k=MAX_QUEUED_PER_USER, exclude_task_id=exclude_task_id
+    )
 
 def _ensure_user_queue_slot_or_409(db: Session, user_id: str, exclude_task_id: int | None = None):
     """
@@ -39,6 +48,61 @@ def _ensure_user_queue_slot_or_409(db: Session, user_id: str, exclude_task_id: i
             detail=f"该用户当前已有 {cur} 个任务排队，已达到上限 {MAX_QUEUED_PER_USER}。请等排队任务完成或停止后再重试。"
         )
 
+_COPY_CHUNK = 1 << 20
+
+def _copy_fd(src_fd: int, dst_fd: int, offset: int = 0) -> None:
+    """
+    从 src_fd 的 offset 起拷到 dst_fd 当前位置直到 EOF：先 copy_file_range（同盘可 reflink / NFS 服务端拷贝），
+    不支持时用 sendfile；两者都在内核内完成，数据不经用户态。
+    """
+    if hasattr(os, "copy_file_range"):
+        try:
+            while n := os.copy_file_range(src_fd, dst_fd, 1 << 30, offset_src=offset):
+                offset += n
+            return
+        except OSError:
+            pass  # EXDEV / ENOSYS / 文件系统不支持：从已拷到的位置继续用 sendfile
+    while n := os.sendfile(dst_fd, src_fd, offset, 1 << 30):
+        offset += n
+
+def _save_upload(video: UploadFile, save_path: str) -> None:
+    """
+    上传文件落盘：Starlette 的 SpooledTemporaryFile 已落到磁盘临时文件时走内核拷贝；
+    仍在内存（小文件）时用 1MB 缓冲的 copyfileobj。
+    """
+    src = video.file
+    with open(save_path, "wb") as f:
+        if getattr(src, "_rolled", True):
+            try:
+                _copy_fd(src.fileno(), f.fileno(), src.tell())
+                return
+            except (AttributeError, OSError, ValueError):
+                src.seek(0); f.seek(0); f.truncate()
+        shutil.copyfileobj(src, f, _COPY_CHUNK)
+
+def _copy_local(src: str, dst: str) -> None:
+    """
+    本机文件导入到 dst（等同 copy2）：BY_PATH_HARDLINK 开启且同盘时直接硬链接（只加目录项，不拷数据）；
+    否则先尝试内核拷贝，失败退回 shutil.copy2。都先写到 .part 再 os.replace，读方不会看到半个文件。
+    """
+    tmp = dst + ".part"
+    with suppress(OSError):
+        os.remove(tmp)
+    if BY_PATH_HARDLINK:
+        try:
+            os.link(src, tmp)
+            os.replace(tmp, dst)
+            return
+        except OSError:
+            pass  # EXDEV（跨设备）/ 文件系统不支持硬链接：退回复制
+    try:
+        with open(src, "rb") as fi, open(tmp, "wb") as fo:
+            _copy_fd(fi.fileno(), fo.fileno())
+        shutil.copystat(src, tmp)
+    except OSError:
+        shutil.copy2(src, tmp)
+    os.replace(tmp, dst)
+
 class TaskStyleUpdate(BaseModel):
     subtitle_format: Optional[str] = Field(default=None, pattern="^(srt|ass)$")
     burn_subtitle: Optional[bool] = None
@@ -62,32 +126,25 @@ class TaskStyleUpdate(BaseModel):
 
 router = APIRouter(prefix="/api/tasks", tags=["tasks"])
 
-@router.post("", response_model=TaskOut)
-async def create_task(
-    user_id: str = Form(...),
-    title: str = Form(...),
-    target_language: str = Form("zh-CN"),
-    target_language_display: str | None = Form(None),
-    video_duration_seconds: float = Form(0.0),
-    video: UploadFile = File(...),
-    db: Session = Depends(get_db)
-):
+os.makedirs(os.path.join(MEDIA_ROOT, "videos"), exist_ok=True)
+
+def _create_task_record(
+    db: Session,
+    user_id: str,
+    title: str,
+    target_language: str,
+    target_language_display: str | None,
+    video_duration_seconds: float,
+    video_file: str,
+) -> models.Task:
     """
-    需求：创建提交永远成功
-    - 若达到排队上限：任务存为 FAILED（可在“无排队任务”时使用 /restart 重新入队）
-    - 否则：正常入队 QUEUED
+    建任务记录（上传 / by-path 共用）：提交总成功；满额则存为 FAILED 并写提示（soft-fail）。
     """
-    log.info(f"{user_id} create task: {title}")
-
-    os.makedirs(os.path.join(MEDIA_ROOT, "videos"), exist_ok=True)
-    save_path = os.path.join(MEDIA_ROOT, "videos", video.filename)
-    with open(save_path, "wb") as f: shutil.copyfileobj(video.file, f)
-
     can_queue = _can_user_queue_now(db, user_id=user_id)
     status = "QUEUED" if can_queue else "FAILED"
     msg = None
     err = None
-    enq_time = datetime.utcnow() if can_queue else None
+    enq_time = func.now() if can_queue else None  # 入队时间取数据库时钟
     progress = 0
 
     if not can_queue:
@@ -95,27 +152,147 @@ async def create_task(
                f"请等待本用户排队任务清空后，在任务列表中点击『重新开始』再入队。")
         err = "排队上限已满，任务暂未入队；可稍后重新开始。"
 
-    t = crud.create_task(
+    # soft-fail 的提示信息随 INSERT 一并写入
+    return crud.create_task(
         db,
         user_id=user_id,
         title=title,
         target_language=target_language,
         target_language_display=target_language_display,
-        video_file=os.path.relpath(save_path, MEDIA_ROOT),
         video_duration_seconds=video_duration_seconds,
+        video_file=video_file,
         queued_for="prepare",
         status=status,
         progress=progress,
         enqueued_at=enq_time,
+        msg=msg,
+        error_msg=err,
     )
 
-    # 回写提示信息（仅当 soft-fail 时）
-    if not can_queue:
-        t.msg = msg
-        t.error_msg = err
-        db.add(t); db.flush(); db.refresh(t)
+@router.post("", response_model=TaskOut)
+async def create_task(
+    user_id: str = Form(...),
+    title: str = Form(...),
+    target_language: str = Form("zh-CN"),
+    target_language_display: str | None = Form(None),
+    video_duration_seconds: float = Form(0.0),
+    video: UploadFile = File(...),
+    db: Session = Depends(get_db)
+):
+    """
+    需求：创建提交永远成功
+    - 若达到排队上限：任务存为 FAILED（可在“无排队任务”时使用 /restart 重新入队）
+    - 否则：正常入队 QUEUED
+    落盘与建记录都是阻塞操作，放到线程池执行，不占事件循环，多个上传可并行。
+    """
+    log.info(f"{user_id} create task: {title}")
 
-    return t
+    save_path = os.path.join(MEDIA_ROOT, "videos", video.filename)
+    await run_in_threadpool(_save_upload, video, save_path)
+
+    return await run_in_threadpool(
+        _create_task_record, db, user_id, title, target_language, target_language_display,
+        video_duration_seconds, os.path.relpath(save_path, MEDIA_ROOT),
+    )
+
+async def _receive_upload(request: Request) -> tuple[dict[str, str], str | None]:
+    """
+    边收请求体边解析 multipart：文件分段直接写入 MEDIA_ROOT/videos，不经 UploadFile 的临时文件中转。
+    返回 (普通表单字段, 视频保存路径)；没有文件分段时路径为 None。
+    """
+    content_type, params = parse_options_header(request.headers.get("content-type", ""))
+    if content_type != b"multipart/form-data" or b"boundary" not in params:
+        raise HTTPException(400, "需要 multipart/form-data 请求体")
+
+    fields: dict[str, str] = {}
+    part: dict = {}
+    pending: list[bytes] = []  # 本轮解析出的文件数据，解析完一块后统一写盘
+    state = {"file": None, "path": None}
+
+    def on_part_begin():
+        part.clear(); part.update(headers={}, field=b"", value=b"", data=[])
+
+    def on_header_field(data, start, end):
+        part["field"] += data[start:end]
+
+    def on_header_value(data, start, end):
+        part["value"] += data[start:end]
+
+    def on_header_end():
+        part["headers"][part["field"].lower()] = part["value"]
+        part["field"] = part["value"] = b""
+
+    def on_headers_finished():
+        _, opts = parse_options_header(part["headers"].get(b"content-disposition", b""))
+        part["name"] = opts.get(b"name", b"").decode("utf-8", "replace")
+        filename = opts.get(b"filename")
+        part["is_file"] = filename is not None
+        if not part["is_file"]:
+            part["sink"] = part["data"]
+            return
+        # 只接受一个文件分段：多个文件字段/重复的 video 字段会把数据拼进同一个文件，直接拒绝
+        if state["file"] is not None:
+            raise HTTPException(400, "只允许上传一个视频文件")
+        # 只取文件名部分，防止路径穿越
+        name = os.path.basename(filename.decode("utf-8", "replace").replace("\\", "/")) or "video.mp4"
+        state["path"] = os.path.join(MEDIA_ROOT, "videos", name)
+        state["file"] = open(state["path"], "wb")
+        part["sink"] = pending
+
+    def on_part_data(data, start, end):
+        part["sink"].append(data[start:end])
+
+    def on_part_end():
+        if not part["is_file"]:
+            fields[part["name"]] = b"".join(part["data"]).decode("utf-8", "replace")
+
+    parser = MultipartParser(params[b"boundary"], {
+        "on_part_begin": on_part_begin, "on_header_field": on_header_field,
+        "on_header_value": on_header_value, "on_header_end": on_header_end,
+        "on_headers_finished": on_headers_finished, "on_part_data": on_part_data,
+        "on_part_end": on_part_end,
+    })
+    try:
+        async for chunk in request.stream():
+            parser.write(chunk)
+            if pending:
+                await run_in_threadpool(state["file"].write, b"".join(pending))
+                pending.clear()
+        parser.finalize()
+    except BaseException:
+        if state["file"] is not None:
+            state["file"].close()
+            with suppress(OSError):
+                os.remove(state["path"])
+        raise
+    if state["file"] is not None:
+        state["file"].close()
+    return fields, state["path"]
+
+@router.post("/stream", response_model=TaskOut)
+async def create_task_streaming(request: Request, db: Session = Depends(get_db)):
+    """
+    与上传接口（POST /api/tasks）字段、行为一致；请求体边收边写盘，大文件不再先落 Starlette 的临时文件。
+    """
+    fields, save_path = await _receive_upload(request)
+    missing = [k for k in ("user_id", "title") if not fields.get(k)]
+    if save_path is None:
+        missing.append("video")
+    if missing:
+        if save_path:
+            with suppress(OSError):
+                os.remove(save_path)
+        raise HTTPException(422, f"缺少字段：{', '.join(missing)}")
+    try:
+        duration = float(fields.get("video_duration_seconds") or 0.0)
+    except ValueError:
+        duration = 0.0
+    log.info(f"{fields['user_id']} create task (stream): {fields['title']}")
+    return await run_in_threadpool(
+        _create_task_record, db, fields["user_id"], fields["title"],
+        fields.get("target_language") or "zh-CN", fields.get("target_language_display") or None,
+        duration, os.path.relpath(save_path, MEDIA_ROOT),
+    )
 
 @router.post("/by-path", response_model=TaskOut)
 def create_task_by_path(
@@ -129,13 +306,13 @@ def create_task_by_path(
 ):
     """
     与上传接口一致的行为：提交总成功；满额则 soft-fail。
+    同步接口本就由 FastAPI 放在线程池里执行，复制大文件不会阻塞事件循环。
     """
     log.info(f"{user_id} create task by-path: {title}")
     abs_src = os.path.abspath(video_path)
     if not os.path.exists(abs_src) or not os.path.isfile(abs_src):
         raise HTTPException(status_code=400, detail=f"视频不存在或不可读：{video_path}")
 
-    os.makedirs(os.path.join(MEDIA_ROOT, "videos"), exist_ok=True)
     abs_media = os.path.abspath(MEDIA_ROOT)
 
     if os.path.commonpath([abs_src, abs_media]) == abs_media:
@@ -143,75 +320,81 @@ def create_task_by_path(
     else:
         fname = os.path.basename(abs_src)
         dst = os.path.join(MEDIA_ROOT, "videos", fname)
-        shutil.copy2(abs_src, dst)
+        _copy_local(abs_src, dst)
         save_rel_path = os.path.relpath(dst, MEDIA_ROOT)
 
     task_title = title or os.path.splitext(os.path.basename(abs_src))[0]
 
-    can_queue = _can_user_queue_now(db, user_id=user_id)
-    status = "QUEUED" if can_queue else "FAILED"
-    msg = None
-    err = None
-    enq_time = datetime.utcnow() if can_queue else None
-    progress = 0
-
-    if not can_queue:
-        msg = (f"已创建，但当前排队已达上限 {MAX_QUEUED_PER_USER}。"
-               f"请等待本用户排队任务清空后，在任务列表中点击『重新开始』再入队。")
-        err = "排队上限已满，任务暂未入队；可稍后重新开始。"
-
-    t = crud.create_task(
-        db,
-        user_id=user_id,
-        title=task_title,
-        target_language=target_language,
-        target_language_display=target_language_display,
-        video_duration_seconds=video_duration_seconds,
-        video_file=save_rel_path,
-        queued_for="prepare",
-        status=status,
-        progress=progress,
-        enqueued_at=enq_time,
+    return _create_task_record(
+        db, user_id, task_title, target_language, target_language_display,
+        video_duration_seconds, save_rel_path,
     )
 
-    if not can_queue:
-        t.msg = msg
-        t.error_msg = err
-        db.add(t); db.flush(); db.refresh(t)
-
-    return t
-
-@router.get("", response_model=list[TaskOut])
-def list_tasks(user_id: str | None = None, db: Session = Depends(get_db)):
+# 列表/详情的条件请求：ETag 由一条只取版本字段的轻查询算出，客户端带 If-None-Match 且未变时直接 304。
+# updated_at 只精确到秒：最近一次变更距今不足 ETAG_SETTLE_SECONDS 时不发 ETag，
+# 否则同一秒内的两次变更会得到相同 ETag，客户端会一直拿着旧数据
+ETAG_SETTLE_SECONDS = 2.0
+_REVALIDATE = {"Cache-Control": "private, no-cache"}
+
+def _version_etag(prefix: str, version: crud.DataVersion) -> str | None:
+    if version.age_seconds < ETAG_SETTLE_SECONDS:
+        return None
+    digest = hashlib.blake2b(repr(version.key).encode(), digest_size=8).hexdigest()
+    return f'W/"{prefix}-{digest}"'
+
+def _not_modified(request: Request, response: Response, etag: str | None) -> Response | None:
+    """命中 If-None-Match 返回 304；否则把 ETag 与缓存头挂到即将返回的响应上。"""
+    if etag and request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers={"ETag": etag, **_REVALIDATE})
+    if etag:
+        response.headers["ETag"] = etag
+    response.headers.update(_REVALIDATE)
+    return None
+
+@router.get("", response_model=list[TaskListItem])
+def list_tasks(request: Request, response: Response, user_id: str | None = None, db: Session = Depends(get_db)):
     log.info(f"{user_id} list tasks")
-    return crud.list_tasks(db, user_id=user_id)
+    etag = _version_etag("list", crud.task_list_version(db, user_id=user_id))
+    if (nm := _not_modified(request, response, etag)) is not None:
+        return nm
+    # 行来自数据库且已按列类型取出，直接构造，跳过逐字段校验
+    return [TaskListItem.model_construct(**m) for m in crud.list_tasks(db, user_id=user_id)]
 
 @router.get("/{task_id}", response_model=TaskDetail)
-def get_task(task_id: int, db: Session = Depends(get_db)):
+def get_task(task_id: int, request: Request, response: Response, db: Session = Depends(get_db)):
     log.info(f"get task: {task_id}")
+    version = crud.task_detail_version(db, task_id)
+    if not version: raise HTTPException(404, "Task not found")
+    if (nm := _not_modified(request, response, _version_etag(str(task_id), version))) is not None:
+        return nm
     t = crud.get_task(db, task_id)
     if not t: raise HTTPException(404, "Task not found")
     return t
 
+# 停止 / 重启时一并清掉的租约字段
+_LEASE_CLEARED = dict(worker_id=None, lease_until=None, heartbeat_at=None, processing_started_at=None)
+
+def _requeue(db: Session, task_id: int, queued_for: str) -> models.Task:
+    """confirm / reburn：校验配额后一条 UPDATE 重新入队（进度至少 40）。"""
+    row = crud.get_task_fields(db, task_id, models.Task.user_id, models.Task.progress)
+    if not row: raise HTTPException(404, "Task not found")
+    # 入队前硬性校验（必须能排队）
+    _ensure_user_queue_slot_or_409(db, row.user_id, exclude_task_id=task_id)
+    t = crud.transition_task(
+        db, task_id, status="QUEUED", progress=max(40, row.progress or 40), queued_for=queued_for,
+        enqueued_at=func.now(),
+    )
+    if not t: raise HTTPException(404, "Task not found")
+    return t
+
 @router.post("/{task_id}/confirm", response_model=TaskOut)
 def confirm(task_id:int, db: Session = Depends(get_db)):
     log.info(f"confirm task: {task_id}")
-    t = crud.get_task(db, task_id); 
-    if not t: raise HTTPException(404, "Task not found")
-    # 入队前硬性校验（confirm 必须能排队）
-    _ensure_user_queue_slot_or_409(db, t.user_id, exclude_task_id=t.id)
-    t.status="QUEUED"; t.progress=max(40, t.progress or 40); t.queued_for="finalize"
-    t.enqueued_at = datetime.utcnow() 
-    db.add(t); return t
+    return _requeue(db, task_id, "finalize")
 
 @router.post("/{task_id}/reburn", response_model=TaskOut)
 def reburn(task_id:int, db: Session = Depends(get_db)):
-    t = crud.get_task(db, task_id)
-    if not t: raise HTTPException(404, "Task not found")
-    _ensure_user_queue_slot_or_409(db, t.user_id, exclude_task_id=t.id)
-    t.status="QUEUED"; t.progress=max(40,t.progress or 40); t.queued_for="reburn"
-    t.enqueued_at = datetime.utcnow() 
-    db.add(t); return t
+    return _requeue(db, task_id, "reburn")
 
 @router.post("/{task_id}/restart", response_model=TaskOut)
 def restart(task_id:int, db: Session = Depends(get_db)):
@@ -220,99 +403,103 @@ def restart(task_id:int, db: Session = Depends(get_db)):
     若满额则 409，提示用户稍后重试。
     """
     log.info(f"restart task: {task_id}")
-    t = crud.get_task(db, task_id)
-    if not t: raise HTTPException(404, "Task not found")
-    _ensure_user_queue_slot_or_409(db, t.user_id, exclude_task_id=t.id)
+    row = crud.get_task_fields(db, task_id, models.Task.user_id)
+    if not row: raise HTTPException(404, "Task not found")
+    _ensure_user_queue_slot_or_409(db, row.user_id, exclude_task_id=task_id)
     # 清理中间产物（物理文件可选，这里不删）
-    t.vocal_file=t.bg_video_file=t.tts_file=t.final_video_file=None
-    t.status="QUEUED"; t.progress=0; t.queued_for="prepare"
-    t.error_msg=""; t.msg=""; t.worker_id=None;t.lease_until=None
-    t.heartbeat_at=None; t.processing_started_at=None
-    t.enqueued_at = datetime.utcnow() 
-    # 删除字幕
-    t.subtitles.clear()
-    db.add(t); return t
+    t = crud.transition_task(
+        db, task_id,
+        vocal_file=None, bg_video_file=None, tts_file=None, final_video_file=None,
+        status="QUEUED", progress=0, queued_for="prepare", error_msg="", msg="",
+        enqueued_at=func.now(), **_LEASE_CLEARED,
+    )
+    if not t: raise HTTPException(404, "Task not found")
+    # 删除字幕：一条 DELETE，不先把字幕载入会话
+    crud.delete_subtitles(db, task_id)
+    return t
 
 @router.post("/{task_id}/stop", response_model=TaskOut)
 def stop(task_id: int, db: Session = Depends(get_db)):
     log.warning(f"stop task: {task_id}")
-    t = crud.get_task(db, task_id)
-    log.warning(f"[task#{task_id}] STOPPING, {t.status}")
-    if not t:
+    row = crud.get_task_fields(
+        db, task_id, models.Task.status, models.Task.queued_for, models.Task.final_video_file, models.Task.progress,
+    )
+    if not row:
         raise HTTPException(404, "Task not found")
-    if t.status not in ("PROCESSING", "QUEUED"):
+    log.warning(f"[task#{task_id}] STOPPING, {row.status}")
+    if row.status not in ("PROCESSING", "QUEUED"):
         raise HTTPException(400, "任务不在运行或排队中")
     try:
         request_stop(task_id)
     except Exception as _: pass
-    prev_status = t.status or ""
-    phase = (t.queued_for or "").strip()  # prepare | finalize | reburn
-    now = datetime.utcnow()
-    now_str = now.strftime("%Y-%m-%d %H:%M:%S UTC")
-    for attr in ("worker_id", "lease_until", "heartbeat_at", "processing_started_at"):
-        if hasattr(t, attr):
-            setattr(t, attr, None)
-    t.enqueued_at = None
-    back_msg = ""
+    prev_status = row.status or ""
+    phase = (row.queued_for or "").strip()  # prepare | finalize | reburn
+    now_str = datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S UTC")  # 只取一次，各条提示共用
+    back_progress = max(40, row.progress or 40)
     if phase == "finalize":
-        t.status = "REVIEW"
-        t.progress = max(40, t.progress or 40)
+        values = dict(status="REVIEW", progress=back_progress, msg=f"已停止：已回退到待确认（{now_str}）。")
         back_msg = "已回退到『待确认』，可再次检查字幕后重新生成。"
-        t.msg = f"已停止：已回退到待确认（{now_str}）。"
     elif phase == "reburn":
-        if t.final_video_file:
-            t.status = "SUCCESS"
-            t.progress = 100
+        if row.final_video_file:
+            values = dict(status="SUCCESS", progress=100, msg=f"已停止：已回到成功状态（{now_str}）。")
             back_msg = "已回到『处理成功』，保留上一次生成的最终视频。"
-            t.msg = f"已停止：已回到成功状态（{now_str}）。"
         else:
-            t.status = "REVIEW"
-            t.progress = max(40, t.progress or 40)
+            values = dict(status="REVIEW", progress=back_progress, msg=f"已停止：已回退到待确认（{now_str}）。")
             back_msg = "未检测到历史成品，已回退到『待确认』。"
-            t.msg = f"已停止：已回退到待确认（{now_str}）。"
     else:
-        t.status = "FAILED"
-        t.msg = f"已停止：阶段一处理已中止（{now_str}）。"
+        values = dict(status="FAILED", msg=f"已停止：阶段一处理已中止（{now_str}）。")
         back_msg = "阶段一已停止并标记为失败。"
     prefix = "用户手动停止任务"
     tail = f"（原状态={prev_status}，阶段={phase or 'unknown'}，时间={now_str}）"
-    t.error_msg = f"{prefix}{tail}。{back_msg}".strip()
-    log.info(t.msg);log.info(t.error_msg)
-    db.add(t); db.flush(); db.refresh(t)
+    values["error_msg"] = f"{prefix}{tail}。{back_msg}".strip()
+    log.info(values["msg"]);log.info(values["error_msg"])
+    # 状态条件写进 WHERE：读取后任务若已自行结束，不覆盖其结果
+    t = crud.transition_task(db, task_id, ("PROCESSING", "QUEUED"), enqueued_at=None, **_LEASE_CLEARED, **values)
+    if not t:
+        raise HTTPException(400, "任务不在运行或排队中")
     return t
 
+def _rm_all(paths: list[str]) -> None:
+    """删除任务的媒体文件（绝对路径）；直接 unlink，不存在即跳过，省掉逐个 exists 检查。"""
+    for p in paths:
+        try:
+            os.unlink(p)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            log.warning(f"remove media file failed: {p}: {e}")
+
 @router.delete("/{task_id}")
-def delete_task(task_id:int, db: Session = Depends(get_db)):
+def delete_task(task_id:int, bg: BackgroundTasks, db: Session = Depends(get_db)):
     log.info(f"delete task: {task_id}")
     t = crud.get_task(db, task_id)
     if not t: raise HTTPException(404, "Task not found")
     if t.status in ("PROCESSING","QUEUED"):
         raise HTTPException(400, "任务进行中或排队中，请先停止")
-    def _rm(relpath: str|None):
-        try:
-            if relpath:
-                abspath = os.path.join(MEDIA_ROOT, relpath)
-                if os.path.exists(abspath):
-                    os.remove(abspath)
-        except Exception:
-            pass
-    _rm(t.video_file); _rm(t.vocal_file); _rm(t.bg_video_file); _rm(t.tts_file); _rm(t.final_video_file)
+    relpaths = [t.video_file, t.vocal_file, t.bg_video_file, t.tts_file, t.final_video_file]
+    if t.vocal_file: relpaths.append(vocal_ref_path(t.vocal_file))
+    paths = [os.path.join(MEDIA_ROOT, p) for p in relpaths if p]
     db.delete(t)
+    db.commit()
+    # 记录删除已提交后再删文件；放到响应发出之后执行，大文件/网络盘上的 unlink 不再拖慢请求
+    bg.add_task(_rm_all, paths)
     return {"ok": True}
 
-@router.get("/{task_id}/progress", response_model=ProgressOut)
-def progress(task_id:int, db: Session = Depends(get_db)):
-    t = crud.get_task(db, task_id)
+# 进度响应的短 TTL 缓存：{task_id: (过期时间, 响应体, ETag)}；多个页面同时轮询同一任务时只查一次库
+PROGRESS_CACHE_TTL = float(os.getenv("PROGRESS_CACHE_TTL", "0.5"))
+_PROGRESS_CACHE_MAX = 4096
+_progress_cache: dict[int, tuple[float, dict, str]] = {}
+# 任务状态/队列变化提交后整体作废（启动、完成、停止、重排都会触发），进度百分比的变化靠 TTL 过期
+crud.add_queue_listener(_progress_cache.clear)
+
+def _progress_body(db: Session, task_id: int) -> dict:
+    # 任务、排队位置与运行数一次查询取回（前端持续轮询，这是请求量最大的接口）
+    t, pos, total, running, proc_secs = crud.get_task_with_queue_stats(db, task_id)
     if not t: raise HTTPException(404, "Task not found")
-    proc_secs = 0
-    if t.status == "PROCESSING" and t.processing_started_at:
-        proc_secs = int((datetime.utcnow() - t.processing_started_at).total_seconds())
     state = "PENDING" if t.status=="QUEUED" else ("SUCCESS" if t.status=="SUCCESS" else ("FAILED" if t.status=="FAILED" else "PROCESSING"))
     status_text = t.msg or ("排队中..." if t.status=="QUEUED" else "处理中..." )
     qp = ql = None
-    running = crud.count_processing(db)
     if t.status == "QUEUED":
-        pos, total = crud.queue_position_and_length(db, t)
         qp, ql = pos, total
         status_text = f"排队中（第 {pos} 位 / 共 {total} 个，运行中 {running}）"
     elif t.status == "FAILED" and t.error_msg:
@@ -322,3 +509,24 @@ def progress(task_id:int, db: Session = Depends(get_db)):
         "task_status": t.status, "final_video_file": t.final_video_file or "",
         "queue_position": qp, "queue_length": ql, "running_workers": running, "max_parallel": int(os.getenv("MAX_PARALLEL_TASKS","1"))
     }
+
+@router.get("/{task_id}/progress", response_model=ProgressOut)
+def progress(task_id:int, request: Request, response: Response, db: Session = Depends(get_db)):
+    """
+    TTL 内重复轮询直接返回缓存（不碰数据库）；响应带弱 ETag，客户端带 If-None-Match 且内容未变时回 304。
+    """
+    now = time.monotonic()
+    hit = _progress_cache.get(task_id)
+    if hit and hit[0] > now:
+        _, body, etag = hit
+    else:
+        body = _progress_body(db, task_id)
+        digest = hashlib.blake2b(json.dumps(body, sort_keys=True).encode(), digest_size=8).hexdigest()
+        etag = f'W/"{task_id}-{digest}"'
+        if len(_progress_cache) >= _PROGRESS_CACHE_MAX:
+            _progress_cache.clear()
+        _progress_cache[task_id] = (now + PROGRESS_CACHE_TTL, body, etag)
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+    response.headers["ETag"] = etag
+    return body
@@ -59,6 +59,20 @@ class TaskOut(BaseModel):
         from_attributes = True
 
 
+class TaskListItem(BaseModel):
+    """任务列表页用：只含列表渲染的字段，由 crud.list_tasks 的窄查询直接构造（不逐字段校验）"""
+    id: int
+    user_id: str
+    title: str
+    status: str
+    progress: int
+    target_language_display: Optional[str] = None
+    final_video_file: Optional[str] = None
+    video_duration_seconds: Optional[float] = None
+    created_at: datetime
+    updated_at: Optional[datetime] = None
+
+
 class TaskDetail(TaskOut):
     subtitles: List[SubtitleOut] = []
 
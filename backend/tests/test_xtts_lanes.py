@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+"""sub_xtts._partition_lanes：多卡切分时间轴，段数应为 min(k, n) 且每段非空、首尾相接。"""
+import pytest
+
+from app.processors.subtts.sub_xtts import _partition_lanes
+
+
+def _schedule(lengths):
+    return [(float(i), float(i) + 1.0, "x" * m) for i, m in enumerate(lengths)]
+
+
+def _check(lanes, n, k):
+    assert len(lanes) == min(k, n)
+    assert all(len(r) > 0 for r in lanes)
+    assert [i for r in lanes for i in r] == list(range(1, n + 1))
+
+
+@pytest.mark.parametrize("n", range(0, 9))
+@pytest.mark.parametrize("k", range(1, 6))
+def test_lane_count_and_coverage(n, k):
+    _check(_partition_lanes(_schedule([(i * 7) % 5 + 1 for i in range(n)]), k), n, k)
+
+
+@pytest.mark.parametrize("n", [2, 3, 4])
+def test_one_line_per_gpu_when_n_equals_k(n):
+    assert _partition_lanes(_schedule([5] * n), n) == [range(i, i + 1) for i in range(1, n + 1)]
+
+
+def test_balanced_by_text_length():
+    # 首尾两条长、中间两条短：两段各取一长一短
+    assert _partition_lanes(_schedule([10, 1, 1, 10]), 2) == [range(1, 3), range(3, 5)]
+    # 一条特别长时独占一段，其余再分
+    assert _partition_lanes(_schedule([30, 1, 1, 1, 1, 1]), 3) == [range(1, 2), range(2, 3), range(3, 7)]
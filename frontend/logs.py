@@ -7,14 +7,19 @@ Django 前端通用日志：控制台级别与文件级别可分开设置
 - 轮转日志：10MB x 5
 - 彩色控制台（colorama 自动检测）
 - 幂等初始化，避免重复 handler
+- 输出经 QueueHandler 交给后台线程，不阻塞请求线程
 """
 
 from __future__ import annotations
+import atexit
 import logging
 import os
+import queue
 import sys
+import time
+from functools import lru_cache
 from typing import Optional
-from logging.handlers import RotatingFileHandler
+from logging.handlers import RotatingFileHandler, QueueHandler, QueueListener
 
 # ---------- 可选依赖：colorama ----------
 try:
@@ -35,6 +40,7 @@ LOG_CAPTURE_DJANGO_SERVER = os.getenv("LOG_CAPTURE_DJANGO_SERVER", "1") == "1"
 
 # ---------- 全局状态 ----------
 _CONFIGURED = False
+_LISTENER: Optional[QueueListener] = None
 
 # ---------- 基础格式 ----------
 _PLAIN_FMT = "%(asctime)s | %(levelname)s | [%(name)s] [%(filename)s:%(lineno)d] - %(message)s"
@@ -164,13 +170,21 @@ def configure_logging() -> None:
 
     app_logger.setLevel(min(console_level, file_level))  # 基础 level 设为两者较低值
 
-    # 控制台
-    app_logger.addHandler(_make_console_handler(console_level))
-
-    # 文件（可选）
+    # 控制台 + 文件（可选）挂在后台 QueueListener 线程上；请求线程只把记录放进队列，
+    # 格式化与写盘（含轮转时的 rename）都不再阻塞请求
+    handlers = [_make_console_handler(console_level)]
     fh = _make_file_handler(file_level)
     if fh:
-        app_logger.addHandler(fh)
+        handlers.append(fh)
+
+    global _LISTENER
+    if _LISTENER is not None:
+        _LISTENER.stop()
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+    app_logger.addHandler(QueueHandler(log_queue))
+    _LISTENER = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _LISTENER.start()
+    atexit.register(_LISTENER.stop)  # 退出前把队列里剩余的记录写完
 
     # 降噪
     _silence_noisy_loggers()
@@ -189,6 +203,12 @@ def get_logger(name: str = __name__) -> logging.Logger:
     """
     if not _CONFIGURED:
         configure_logging()
+    return _cached_logger(name)
+
+
+@lru_cache(maxsize=256)
+def _cached_logger(name: str) -> logging.Logger:
+    # logging.getLogger 每次都要拿模块级锁；同名 logger 取一次后直接复用
     # 统一挂到 "frontend.*" 命名空间
     name = name if name and name != "__main__" else "app"
     return logging.getLogger(f"frontend.{name}")
@@ -205,23 +225,21 @@ class RequestLogMiddleware:
         self.log = get_logger("http")
 
     def __call__(self, request):
-        import time
-        start = time.perf_counter()
+        # 未开 INFO 时不计时、不取参数
+        if not self.log.isEnabledFor(logging.INFO):
+            return self.get_response(request)
+        start_ns = time.perf_counter_ns()
         resp = None
         try:
             resp = self.get_response(request)
             return resp
         finally:
-            cost_ms = int((time.perf_counter() - start) * 1000)
+            cost_ms = (time.perf_counter_ns() - start_ns) // 1_000_000  # 整数运算，免浮点
             status = getattr(resp, "status_code", 0) if resp else 0
-            path = request.path
-            method = request.method
             user = getattr(request, "user", None)
-            uid = getattr(user, "id", None)
-            uname = getattr(user, "username", None)
+            uid, uname = (getattr(user, "id", None), getattr(user, "username", None)) if user is not None else (None, None)
+            # 格式串里没有引用 extra 字段，不再逐请求构造 extra 字典；参数交给 logging 惰性格式化
             self.log.info(
-                "%s %s -> %s %sms%s",
-                method, path, status, cost_ms,
-                f" (user={uid or '-'}:{uname or '-'})",
-                extra={"path": path, "method": method, "status": status, "ms": cost_ms, "user_id": uid},
+                "%s %s -> %s %sms (user=%s:%s)",
+                request.method, request.path, status, cost_ms, uid or "-", uname or "-",
             )
@@ -1,6 +1,6 @@
 from __future__ import annotations
 from django.apps import AppConfig
-from typing import Dict, Iterable, Tuple
+from typing import Iterable, Tuple
 from django.db import transaction, connections
 from django.db.models.signals import post_migrate
 from logs import get_logger
@@ -60,65 +60,46 @@ class SubtitleProcessorConfig(AppConfig):
     @staticmethod
     def _seed_languages(LanguageModel, using: str) -> None:
         """
-        使用 bulk_create(ignore_conflicts=True) + 差集，避免逐条 get_or_create 的额外查询。
+        一条 INSERT ... ON CONFLICT DO UPDATE：缺的补上，已存在的展示名与默认表对齐。
         """
         wanted: Iterable[Tuple[str, str]] = DEFAULT_LANGUAGES
+        rows = [
+            LanguageModel(target_language=code, target_language_display=label)
+            for code, label in wanted
+        ]
         with transaction.atomic(using=using):
-            existing = set(
-                LanguageModel.objects.using(using)
-                .values_list("target_language", flat=True)
+            LanguageModel.objects.using(using).bulk_create(
+                rows,
+                update_conflicts=True,
+                unique_fields=["target_language"],
+                update_fields=["target_language_display"],
             )
-            to_create = [
-                LanguageModel(
-                    target_language=code, target_language_display=label
-                )
-                for code, label in wanted
-                if code not in existing
-            ]
-            if to_create:
-                # Django 2.2+ 支持 ignore_conflicts；旧版本可改为 try/except
-                LanguageModel.objects.using(using).bulk_create(
-                    to_create, ignore_conflicts=True
-                )
-
-            # 同时对已存在的项做展示名“对齐更新”（不强制，但保证与默认表一致）
-            update_map: Dict[str, str] = {code: label for code, label in wanted}
-            rows = (
-                LanguageModel.objects.using(using)
-                .filter(target_language__in=update_map.keys())
-                .only("id", "target_language", "target_language_display")
-            )
-            dirty = []
-            for r in rows:
-                new_label = update_map.get(r.target_language)
-                if new_label and r.target_language_display != new_label:
-                    r.target_language_display = new_label
-                    dirty.append(r)
-            if dirty:
-                LanguageModel.objects.using(using).bulk_update(
-                    dirty, ["target_language_display"]
-                )
 
     @staticmethod
     def _seed_voice_profiles(VoiceProfileModel, using: str) -> None:
         """
-        逐条 update_or_create，保证代码/名称/示例等可被更新；数量有限影响可忽略。
+        一条 INSERT ... ON CONFLICT DO UPDATE（按 unique_together(language_code, code) 判重），
+        保证代码/名称/示例等可被更新，不再逐条 SELECT + UPDATE/INSERT。
         """
+        rows = [
+            VoiceProfileModel(
+                language_code=lang_code,
+                code=v["code"],
+                name=v.get("name", v["code"]),
+                enname=v.get("enname", v["code"]),
+                tts_name=v.get("tts_name", v["code"]),
+                gender=v.get("gender", "auto"),
+                sample_url=v.get("sample", "") or "",
+                enabled=True,
+                sort_order=idx,
+            )
+            for lang_code, voices in get_default_voice_bank().items()
+            for idx, v in enumerate(voices)
+        ]
         with transaction.atomic(using=using):
-            voice_bank = get_default_voice_bank()
-            for lang_code, voices in voice_bank.items():
-                for idx, v in enumerate(voices):
-                    code = v["code"]
-                    defaults = {
-                        "name": v.get("name", code),
-                        "enname": v.get("enname", code),
-                        "tts_name": v.get("tts_name", code),
-                        "gender": v.get("gender", "auto"),
-                        "sample_url": v.get("sample", "") or "",
-                        "enabled": True,
-                        "sort_order": idx,
-                    }
-                    # unique_together(language_code, code) 保证幂等
-                    VoiceProfileModel.objects.using(using).update_or_create(
-                        language_code=lang_code, code=code, defaults=defaults
-                    )
+            VoiceProfileModel.objects.using(using).bulk_create(
+                rows,
+                update_conflicts=True,
+                unique_fields=["language_code", "code"],
+                update_fields=["name", "enname", "tts_name", "gender", "sample_url", "enabled", "sort_order"],
+            )
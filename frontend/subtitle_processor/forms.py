@@ -1,7 +1,29 @@
+import time
 from django import forms
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
 from .models import Language
 from .seed_data import DEFAULT_LANGUAGES
 
+# 语言表在 migrate 时写入，运行期基本不变：选项按进程缓存，增删改时作废
+LANGUAGE_CHOICES_TTL = 300
+_CHOICES_CACHE: tuple[list, float] | None = None
+
+def _language_choices() -> list:
+    global _CHOICES_CACHE
+    now = time.monotonic()
+    if _CHOICES_CACHE is None or _CHOICES_CACHE[1] <= now:
+        qs = Language.objects.all().values_list("target_language", "target_language_display")
+        choices = list(qs) or list(DEFAULT_LANGUAGES)  # 数据库为空时兜底
+        _CHOICES_CACHE = (choices, now + LANGUAGE_CHOICES_TTL)
+    return _CHOICES_CACHE[0]
+
+@receiver(post_save, sender=Language)
+@receiver(post_delete, sender=Language)
+def _invalidate_language_choices(**kwargs):
+    global _CHOICES_CACHE
+    _CHOICES_CACHE = None
+
 class VideoUploadForm(forms.Form):
     title = forms.CharField(
         label="任务名称",
@@ -26,6 +48,4 @@ class VideoUploadForm(forms.Form):
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        qs = Language.objects.all().values_list("target_language", "target_language_display")
-        choices = list(qs) or DEFAULT_LANGUAGES  # 数据库为空时兜底
-        self.fields["target_language"].choices = choices
\ No newline at end of file
+        self.fields["target_language"].choices = _language_choices()
\ No newline at end of file
@@ -2,7 +2,16 @@
 # -*- coding: utf-8 -*-
 from __future__ import annotations
 import os, json
-from typing import Dict, List, Tuple, Any
+from functools import lru_cache
+from types import MappingProxyType
+from typing import Dict, List, Mapping, Tuple, Any
+
+# orjson（可选，解析更快；不可用时回退标准库 json）
+try:
+    import orjson
+    _json_loads = orjson.loads
+except Exception:
+    _json_loads = json.loads
 
 try:
     # 若可用，读取 Django settings，便于定位 STATIC 目录
@@ -11,14 +20,15 @@ except Exception:
     settings = None  # 迁移时也能兜底
 
 # 目标语言显示（保持不变）
-DEFAULT_LANGUAGES: List[Tuple[str, str]] = [
+# 元组：被多处模块共享，防止被意外原地修改
+DEFAULT_LANGUAGES: Tuple[Tuple[str, str], ...] = (
     ("zh-CN","中文（简体）"),
     ("en",   "英语"),
     ("ja",   "日语"),
     ("ko",   "韩语"),
     ("fr",   "法语"),
     ("de",   "德语"),
-]
+)
 
 # —— 旧的硬编码 VOICE_BANK（作为兜底）——
 _FALLBACK_VOICE_BANK: Dict[str, List[Dict[str, Any]]] = {
@@ -32,8 +42,8 @@ _FALLBACK_VOICE_BANK: Dict[str, List[Dict[str, Any]]] = {
     ]
 }
 
-# —— lang 规范化：把 tts_map.json 的 "lang" 映射到我们的语言代码 —— #
-_LANG_NORM = {
+# —— lang 规范化：把 tts_map.json 的 "lang" 映射到我们的语言代码（只读视图）—— #
+_LANG_NORM: Mapping[str, str] = MappingProxyType({
     "zh": "zh-CN",
     "zh-cn": "zh-CN",
     "en": "en",
@@ -43,7 +53,7 @@ _LANG_NORM = {
     "kr": "ko",
     "fr": "fr",
     "de": "de",
-}
+})
 
 def _normalize_lang(lang: str) -> str:
     if not lang:
@@ -63,12 +73,14 @@ def _guess_display_name(code: str, gender: str, zhname: str, mark: str) -> str:
         return f"{g_disp}·{tag}"
     return code
 
+@lru_cache(maxsize=1)
 def _resolve_tts_map_path() -> str | None:
     """
     寻找 static/assets/tts_map.json 的可能位置：
     - 优先 settings.BASE_DIR/static/assets/tts_map.json
     - 其次 settings.STATIC_ROOT 或 STATICFILES_DIRS
     - 再次 当前工作目录/static/assets/tts_map.json
+    settings 运行期不变，结果缓存；找不到时由 _load_tts_map 清缓存，下次重新查找。
     """
     candidates: List[str] = []
 
@@ -102,21 +114,51 @@ def _resolve_tts_map_path() -> str | None:
             return p
     return None
 
+def _reset_path_cache() -> None:
+    """测试或切换 settings 后调用：重新定位 tts_map.json。"""
+    _resolve_tts_map_path.cache_clear()
+
+# 解析结果缓存：键为 (path, st_mtime_ns, st_size)，文件未变时只花一次 stat
+_CACHE: Dict[str, Any] = {"key": None, "val": None}
+# 分组结果缓存：src 为生成它的 tts_map 对象（_load_tts_map 未重新解析时返回的是同一个对象）
+_BANK_CACHE: Dict[str, Any] = {"src": None, "val": None}
+
 def _load_tts_map() -> Dict[str, Any] | None:
     """
     读取 JSON；失败返回 None
     """
     path = _resolve_tts_map_path()
     if not path:
+        _reset_path_cache()  # 不缓存“找不到”，文件后来出现也能读到
         return None
     try:
-        with open(path, "r", encoding="utf-8") as f:
-            data = json.load(f)
-            if isinstance(data, dict):
-                return data
-    except Exception:
+        st = os.stat(path)
+    except OSError:
+        _reset_path_cache()  # 文件被移走：下次重新在各候选位置查找
         return None
-    return None
+    key = (path, st.st_mtime_ns, st.st_size)
+    if _CACHE["key"] == key:
+        return _CACHE["val"]
+    data = None
+    try:
+        with open(path, "rb") as f:
+            data = _json_loads(f.read())
+            if not isinstance(data, dict):
+                data = None
+    except Exception:
+        data = None
+    # 解析失败也按同一键缓存，文件修好（mtime 变化）后自然重读
+    _CACHE["key"], _CACHE["val"] = key, data
+    return data
+
+# 每个语言置顶的 "auto" 选项
+_AUTO_VOICE: Dict[str, Any] = {
+    "code": "auto",
+    "tts_name": "auto",
+    "name": "视频原声·声音克隆",
+    "gender": "auto",
+    "sample": "",
+}
 
 def _group_voices_by_lang(tts_map: Dict[str, Any]) -> Dict[str, List[Dict[str, Any]]]:
     """
@@ -124,60 +166,61 @@ def _group_voices_by_lang(tts_map: Dict[str, Any]) -> Dict[str, List[Dict[str, A
     同时为每个语言自动添加一个 "auto"（视频原声/声音克隆）选项。
     """
     grouped: Dict[str, List[Dict[str, Any]]] = {}
+    # 循环内用到的方法先绑定到局部变量，省去每行的属性查找（条目数上千时是重建的主要开销）
+    norm = _LANG_NORM.get
+    get_bucket = grouped.get
+    guess_name = _guess_display_name
 
     # 先把所有项按 lang 聚合
     for code, info in tts_map.items():
         if not isinstance(info, dict):
             continue
-        lang_raw = info.get("lang") or ""
-        lang_code = _normalize_lang(lang_raw)
-        if not lang_code:
+        get = info.get
+        lang_raw = get("lang")
+        if not lang_raw:
             continue
+        # 与 _normalize_lang 相同：表里没有的原样保留
+        lang_code = norm(str(lang_raw).strip().lower(), lang_raw)
 
-        tts_name = info.get("voice") or code
-        gender = (info.get("gender") or "auto").lower()
-        zhname = info.get("zhname") or ""
-        enname = info.get("enname") or ""
-        mark = info.get("mark") or ""
-        name = _guess_display_name(code, gender, zhname, mark)
-        enname = f"{gender}·{enname}"
-        # 示例音频的约定路径（可按需更改你的静态资源组织）
-        sample = f"/static/tts_samples/{code}.mp3"
-
-        grouped.setdefault(lang_code, []).append({
+        gender = (get("gender") or "auto").lower()
+        voice = {
             "code": code,
-            "tts_name": tts_name,
-            "name": name,
-            "enname": enname,
+            "tts_name": get("voice") or code,
+            "name": guess_name(code, gender, get("zhname") or "", get("mark") or ""),
+            "enname": f"{gender}·{get('enname') or ''}",
             "gender": gender,
-            "sample": sample,
-        })
-
-    # 为已出现的语言补充 "auto" 选项（置顶）
-    for lang_code, voices in grouped.items():
-        has_auto = any(v["code"] == "auto" for v in voices)
-        if not has_auto:
-            voices.insert(0, {
-                "code": "auto",
-                "tts_name": "auto",
-                "name": "视频原声·声音克隆",
-                "gender": "auto",
-                "sample": "",
-            })
+            # 示例音频的约定路径（可按需更改你的静态资源组织）
+            "sample": f"/static/tts_samples/{code}.mp3",
+        }
+        voices = get_bucket(lang_code)
+        if voices is None:
+            # 语言首次出现时即置顶补一个 "auto"（视频原声/声音克隆）选项，省去事后再扫一遍
+            voices = grouped[lang_code] = [dict(_AUTO_VOICE)]
+        if code == "auto":
+            voices[0] = voice  # tts_map 自带 auto 时用它替换默认项
+        else:
+            voices.append(voice)
     return grouped
 
 def build_default_voice_bank_from_file() -> Dict[str, List[Dict[str, Any]]] | None:
     data = _load_tts_map()
     if not data:
         return None
-    return _group_voices_by_lang(data)
+    if _BANK_CACHE["src"] is not data:
+        _BANK_CACHE["src"], _BANK_CACHE["val"] = data, _group_voices_by_lang(data)
+    return _BANK_CACHE["val"]
 
 def get_default_voice_bank() -> Dict[str, List[Dict[str, Any]]]:
     """
     对外主入口：优先读 tts_map.json，失败时回退 _FALLBACK_VOICE_BANK
+    返回的是共享的缓存对象，调用方只读、不要原地修改。
     """
     loaded = build_default_voice_bank_from_file()
     return loaded or _FALLBACK_VOICE_BANK
 
 # 兼容原有导入路径：仍然暴露一个 DEFAULT_VOICE_BANK，但其内容来自文件（或回退）
-DEFAULT_VOICE_BANK = get_default_voice_bank()
+# 按需读取（PEP 562），导入本模块时不碰磁盘
+def __getattr__(name: str):
+    if name == "DEFAULT_VOICE_BANK":
+        return get_default_voice_bank()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
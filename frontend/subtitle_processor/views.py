@@ -1,16 +1,40 @@
-import os, json, signal
+import os, io, json, uuid, shutil, signal
 import requests, tempfile, subprocess
+from requests.adapters import HTTPAdapter
+from urllib3.fields import RequestField
 from pathlib import Path
-from functools import lru_cache
+from itertools import groupby
+from operator import itemgetter
 from django.conf import settings
+from django.core.cache import cache
 from django.utils import timezone
 from django.contrib import messages
 from django.utils.dateparse import parse_datetime
+from django.dispatch import receiver
+from django.db.models.signals import post_save, post_delete
 from django.views.decorators.http import require_POST
 from django.core.files.storage import FileSystemStorage
 from django.shortcuts import render, redirect, get_object_or_404
 from django.http import JsonResponse, HttpResponse, HttpResponseBadRequest
 
+# ---------- 可选依赖：orjson（解析/序列化更快；不可用时回退标准库 json）----------
+try:
+    import orjson
+    _json_loads = orjson.loads
+    def _json_dumps(obj) -> str:
+        return orjson.dumps(obj).decode()  # UTF-8 输出、不转义非 ASCII，等同 ensure_ascii=False
+except Exception:
+    _json_loads = json.loads
+    def _json_dumps(obj) -> str:
+        return json.dumps(obj, ensure_ascii=False)
+
+# ---------- 可选依赖：PyAV（faster-whisper 已依赖它）----------
+try:
+    import av
+    _HAS_AV = True
+except Exception:
+    _HAS_AV = False
+
 from logs import get_logger
 from .forms import VideoUploadForm
 from .models import Language, VoiceProfile
@@ -18,45 +42,119 @@ from .seed_data import DEFAULT_LANGUAGES
 log = get_logger(__name__)
 
 API = settings.BACKEND_BASE_URL.rstrip("/")
+_API_TASKS = f"{API}/api/tasks"              # 任务接口前缀，只拼一次
+_PROGRESS_URL = f"{API}/api/tasks/%d/progress"  # 进度轮询地址
+
+# 调后端统一走一个带连接池的 Session：keep-alive 复用 TCP 连接，进度轮询不再每次握手
+SESSION = requests.Session()
+_ADAPTER = HTTPAdapter(pool_connections=16, pool_maxsize=32)
+SESSION.mount("http://", _ADAPTER)
+SESSION.mount("https://", _ADAPTER)
 
 MAX_VIDEO_SECONDS = int(os.getenv("MAX_VIDEO_SECONDS", "300"))
+USE_FFPROBE = os.getenv("USE_FFPROBE", "0") == "1"  # 强制用 ffprobe 子进程探测时长
+
+# 语言映射按“代次”缓存：语言表增删改时代次 +1，读者发现代次不符就重查。
+# 查询期间代次变了也只会按旧代次存下，下次读取即重查，不会把旧映射当成新的
+_LANG_GEN = 0
+_LANG_CACHE: tuple[int, dict] | None = None
 
-@lru_cache(maxsize=1)
 def _lang_map():
+    global _LANG_CACHE
+    gen = _LANG_GEN
+    hit = _LANG_CACHE
+    if hit is not None and hit[0] == gen:
+        return hit[1]
     rows = Language.objects.all().values_list("target_language", "target_language_display")
     data = dict(rows) or dict(DEFAULT_LANGUAGES)
+    _LANG_CACHE = (gen, data)
     return data
 
+@receiver(post_save, sender=Language)
+@receiver(post_delete, sender=Language)
+def _invalidate_lang_map(**kwargs):
+    global _LANG_GEN
+    _LANG_GEN += 1
+
 def _safe_delete_file(relpath):
     """根据 FileField 的相对路径在 MEDIA_ROOT 下删除物理文件（若存在）"""
     if not relpath:
         return
-    abs_path = os.path.join(settings.MEDIA_ROOT, str(relpath))
     try:
-        if os.path.exists(abs_path):
-            os.remove(abs_path)
-    except Exception:
-        # 忽略物理文件删除失败，不影响任务记录删除
+        os.unlink(os.path.join(settings.MEDIA_ROOT, str(relpath)))  # 不存在时直接 FileNotFoundError，不先 stat
+    except OSError:
+        # 文件不存在或删除失败都忽略，不影响任务记录删除
         pass
 
 def task_list(request):
     data = {"user_id": "test01"}
-    r = requests.get(f"{API}/api/tasks", data=data, timeout=30)
-    tasks = r.json() if r.ok else []
+    r = SESSION.get(_API_TASKS, data=data, timeout=30)
+    tasks = _json_loads(r.content) if r.ok else []
     for t in tasks:
         t["created_at"] = parse_datetime(t["created_at"])
     return render(request, "subtitle_processor/task_list.html", {"tasks": tasks})
 
+def _probe_duration_av(path: str) -> float:
+    try:
+        with av.open(path, metadata_errors="ignore") as c:
+            if c.duration is not None:
+                return float(c.duration) / av.time_base
+            # 容器头没有总时长时取各流时长的最大值
+            durs = [float(st.duration * st.time_base) for st in c.streams if st.duration and st.time_base]
+    except (av.FFmpegError, OSError) as e:
+        raise RuntimeError(str(e) or "probe failed") from e
+    if not durs:
+        raise RuntimeError("probe failed: no duration")
+    return max(durs)
+
 def help_center(request):
     """简洁帮助中心"""
     return render(request, "help_center.html")
 
 def _get_media_duration_seconds(path: str) -> float:
+    # 进程内读容器头取时长，省去每次上传 fork+exec ffprobe；无 PyAV 或 USE_FFPROBE=1 时仍走 ffprobe
+    if _HAS_AV and not USE_FFPROBE:
+        return _probe_duration_av(path)
     r = subprocess.run(["ffprobe","-v","error","-show_entries","format=duration","-of","default=noprint_wrappers=1:nokey=1",path],capture_output=True,text=True)
     if r.returncode!=0: raise RuntimeError(r.stderr.strip() or "ffprobe failed")
     return float(r.stdout.strip())
 
 
+_UPLOAD_CHUNK = 1 << 20  # 落临时文件时每块 1MB
+
+class _MultipartBody:
+    """
+    multipart/form-data 请求体：普通字段 + 一个文件字段，read() 时按需从文件读取。
+    requests 的 files= 会先把整个文件编码进内存；这里给出 __len__，requests 据此带 Content-Length 流式发送。
+    """
+    def __init__(self, fields: dict, file_field: str, fp, filename: str, content_type: str):
+        boundary = uuid.uuid4().hex
+        head = []
+        for name, value in fields.items():
+            rf = RequestField(name, "")
+            rf.make_multipart()
+            head.append(f"--{boundary}\r\n{rf.render_headers()}{value}\r\n".encode("utf-8"))
+        rf = RequestField(file_field, b"", filename=filename)
+        rf.make_multipart(content_type=content_type)
+        head.append(f"--{boundary}\r\n{rf.render_headers()}".encode("utf-8"))
+        head = b"".join(head)
+        tail = f"\r\n--{boundary}--\r\n".encode("ascii")
+        size = os.fstat(fp.fileno()).st_size - fp.tell()
+        self._parts = [io.BytesIO(head), fp, io.BytesIO(tail)]
+        self._len = len(head) + size + len(tail)
+        self.content_type = f"multipart/form-data; boundary={boundary}"
+
+    def __len__(self) -> int:
+        return self._len
+
+    def read(self, n: int = -1) -> bytes:
+        while self._parts:
+            chunk = self._parts[0].read(n)
+            if chunk:
+                return chunk
+            self._parts.pop(0)
+        return b""
+
 def video_upload(request):
     user_id = "test01"
     if request.method == "POST":
@@ -65,28 +163,20 @@ def video_upload(request):
             fe_dur = (request.POST.get("frontend_duration_seconds") or "").strip()
             fe_probe = (request.POST.get("frontend_probe") or "").strip()
             log.info(f"上传视频，前端视频时长检测结果：{fe_dur}-{fe_probe}")
-            if False and fe_probe == "frontend_ok": 
-                f = request.FILES["video_file"]
-                files = {"video": (f.name, f.read(), f.content_type)}
-                lang_code = form.cleaned_data["target_language"]
-                lang_map = _lang_map()
-                lang_display = lang_map.get(lang_code, lang_code)
-                data = {"user_id": user_id, "title": form.cleaned_data["title"], "target_language": lang_code,  
-                        "target_language_display": lang_display, "video_duration_seconds": float(fe_dur)}
-                r = requests.post(f"{API}/api/tasks", data=data, files=files, timeout=180)
-                if r.status_code == 200:
-                    messages.success(request, "任务创建成功，已进入队列。")
-                    return redirect("task_list")
-                messages.error(request, f"后端创建失败：{r.text[:200]}")
             f = request.FILES["video_file"]
-            # === 先写入临时文件用于时长探测 ===
-            suffix = os.path.splitext(getattr(f, "name", ""))[1] or ".mp4"
-            tmp_dir = Path(settings.MEDIA_ROOT) / "tmp"
-            tmp_dir.mkdir(parents=True, exist_ok=True) 
-            with tempfile.NamedTemporaryFile(delete=False, suffix=suffix, dir=str(tmp_dir)) as tmp:
-                tmp_path = tmp.name
-                for chunk in f.chunks():
-                    tmp.write(chunk)
+            # === 拿到一个磁盘路径用于时长探测和转发 ===
+            # 大文件 Django 已落到临时文件（TemporaryUploadedFile），直接用它，不再复制一遍
+            own_tmp = not hasattr(f, "temporary_file_path")
+            if own_tmp:
+                suffix = os.path.splitext(getattr(f, "name", ""))[1] or ".mp4"
+                tmp_dir = Path(settings.MEDIA_ROOT) / "tmp"
+                tmp_dir.mkdir(parents=True, exist_ok=True)
+                with tempfile.NamedTemporaryFile(delete=False, suffix=suffix, dir=str(tmp_dir)) as tmp:
+                    tmp_path = tmp.name
+                    f.seek(0)
+                    shutil.copyfileobj(f, tmp, _UPLOAD_CHUNK)
+            else:
+                tmp_path = f.temporary_file_path()
             try:
                 dur = _get_media_duration_seconds(tmp_path)
                 if dur is not None and dur > MAX_VIDEO_SECONDS:
@@ -109,26 +199,33 @@ def video_upload(request):
                     dur = 0.0
                     messages.warning(request, "未能读取视频时长，已放行提交；若过长后端会拒绝。")
                 # === 通过校验，转发到后端 ===
-                # 用临时文件重新打开，避免重复读内存
+                lang_code = form.cleaned_data["target_language"]
+                lang_map = _lang_map()
+                lang_display = lang_map.get(lang_code, lang_code)
+                data = {
+                    "user_id": user_id, "title": form.cleaned_data["title"],
+                    "target_language": lang_code, "target_language_display": lang_display,
+                    "video_duration_seconds": float(dur)
+                }
                 with open(tmp_path, "rb") as fp:
-                    files = {"video": (getattr(f, "name", "video.mp4"), fp, getattr(f, "content_type", "video/mp4"))}
-                    lang_code = form.cleaned_data["target_language"]
-                    lang_map = _lang_map()
-                    lang_display = lang_map.get(lang_code, lang_code)
-                    data = {
-                        "user_id": user_id, "title": form.cleaned_data["title"],
-                        "target_language": lang_code, "target_language_display": lang_display,
-                        "video_duration_seconds": float(dur)
-                    }
-                    r = requests.post(f"{API}/api/tasks", data=data, files=files, timeout=180)
+                    body = _MultipartBody(
+                        data, "video", fp,
+                        getattr(f, "name", "video.mp4"), getattr(f, "content_type", None) or "video/mp4",
+                    )
+                    # 流式上传接口：后端边收边写盘；本端按块读文件发送，不把视频整个读进内存
+                    r = SESSION.post(
+                        f"{_API_TASKS}/stream", data=body,
+                        headers={"Content-Type": body.content_type}, timeout=180,
+                    )
                 if r.status_code == 200:
                     messages.success(request, "任务创建成功，已进入队列。")
                     return redirect("task_list")
                 messages.error(request, f"后端创建失败：{r.text[:200]}")
-            finally: 
-                try:
-                    os.remove(tmp_path) # 清理临时文件
-                except Exception: pass
+            finally:
+                if own_tmp:
+                    try:
+                        os.remove(tmp_path) # 清理临时文件
+                    except Exception: pass
     else:
         form = VideoUploadForm()
 
@@ -140,42 +237,65 @@ def video_upload(request):
 def task_progress_api(request, celery_task_id):
     # 可以让页面把 task_id 传来，或沿用你原来的“id-{task_id}”规则：
     task_id = int(str(celery_task_id).split("id-")[-1])
-    r = requests.get(f"{API}/api/tasks/{task_id}/progress", timeout=10)
-    return JsonResponse(r.json() if r.ok else {
+    # 前端以 WSGI（runserver）部署：同步视图直接走带连接池的 SESSION，
+    # 不为每次轮询起事件循环、切线程
+    r = SESSION.get(_PROGRESS_URL % task_id, timeout=10)
+    if r.ok:
+        # 后端已是 JSON，原样转发，省去一次解析再序列化
+        return HttpResponse(r.content, content_type="application/json")
+    return JsonResponse({
         "state":"UNKNOWN","progress":0,"status":"查询失败","task_status":"FAILED","final_video_file":""
     })
 
+# 音色表只在 migrate 种子或后台修改时变化：序列化好的 JSON 放进 Django 缓存，增删改时作废
+VOICE_BANK_CACHE_KEY = "voice_bank_json_v1"
+VOICE_BANK_CACHE_TTL = 3600
+
+@receiver(post_save, sender=VoiceProfile)
+@receiver(post_delete, sender=VoiceProfile)
+def _invalidate_voice_bank(**kwargs):
+    cache.delete(VOICE_BANK_CACHE_KEY)
+
+def _build_voice_bank() -> dict:
+    """{language_code: [{code, name, gender, sample}]}；只取这几列的字典行（不构造模型实例），已按语言排序直接分组。"""
+    rows = (
+        VoiceProfile.objects.filter(enabled=True)
+        .order_by("language_code", "sort_order", "code")
+        .values_list("language_code", "code", "name", "gender", "sample_url")
+    )
+    return {
+        lang: [{"code": code, "name": name, "gender": gender, "sample": sample or ""}
+               for _, code, name, gender, sample in group]
+        for lang, group in groupby(rows, key=itemgetter(0))
+    }
+
+# 样式表单字段（表单字段名需与模板中的 input/select name 一致）：(字段名, 转换函数)，空值不提交
+_STYLE_FIELDS = (
+    ("subtitle_format", str), ("sub_font_name", str), ("sub_font_size", int),
+    ("sub_font_color", str), ("sub_outline_color", str), ("sub_back_color", str),
+    ("sub_outline_width", float), ("sub_back_opacity", float), ("sub_alignment", int),
+    ("bgm_volume", float), ("tts_volume", float),
+    # 若你的样式表单里也有 TTS 选项，会一并提交
+    ("tts_gender", str), ("tts_voice", str),
+)
+_STYLE_FLAGS = ("burn_subtitle", "sub_font_bold", "sub_font_italic", "sub_font_underline")
+
 def task_detail(request, task_id):
-    r = requests.get(f"{API}/api/tasks/{task_id}", timeout=30)
+    r = SESSION.get(f"{_API_TASKS}/{task_id}", timeout=30)
     if not r.ok:
         messages.error(request, "任务不存在"); return redirect("task_list")
-    dto = r.json()
+    dto = _json_loads(r.content)
     # 保存样式（表单字段名需与你模板中的 input/select name 一致）
     if request.method=="POST" and request.POST.get("action")=="save_style":
         try:
-            payload = {
-                "subtitle_format": request.POST.get("subtitle_format") or None,
-                "burn_subtitle": request.POST.get("burn_subtitle") == "on",
-                "sub_font_name": request.POST.get("sub_font_name") or None,
-                "sub_font_size": int(request.POST.get("sub_font_size")) if request.POST.get("sub_font_size") else None,
-                "sub_font_bold": request.POST.get("sub_font_bold") == "on",
-                "sub_font_italic": request.POST.get("sub_font_italic") == "on",
-                "sub_font_underline": request.POST.get("sub_font_underline") == "on",
-                "sub_font_color": request.POST.get("sub_font_color") or None,
-                "sub_outline_color": request.POST.get("sub_outline_color") or None,
-                "sub_back_color": request.POST.get("sub_back_color") or None,
-                "sub_outline_width": float(request.POST.get("sub_outline_width")) if request.POST.get("sub_outline_width") else None,
-                "sub_back_opacity": float(request.POST.get("sub_back_opacity")) if request.POST.get("sub_back_opacity") else None,
-                "sub_alignment": int(request.POST.get("sub_alignment")) if request.POST.get("sub_alignment") else None,
-                "bgm_volume": float(request.POST.get("bgm_volume")) if request.POST.get("bgm_volume") else None,
-                "tts_volume": float(request.POST.get("tts_volume")) if request.POST.get("tts_volume") else None,
-                # 若你的样式表单里也有 TTS 选项，可放开下面两行
-                "tts_gender": request.POST.get("tts_gender") or None,
-                "tts_voice": request.POST.get("tts_voice") or None,
-            }
-            # 去掉 None（避免把空值写入）
-            payload = {k:v for k,v in payload.items() if v is not None}
-            rr = requests.patch(f"{API}/api/tasks/{task_id}/style", json=payload, timeout=30)
+            post = request.POST
+            # 复选框：未勾选也要提交 False；其余字段为空即不提交（避免把空值写入）
+            payload = {k: post.get(k) == "on" for k in _STYLE_FLAGS}
+            for k, conv in _STYLE_FIELDS:
+                v = post.get(k)
+                if v:
+                    payload[k] = conv(v)
+            rr = SESSION.patch(f"{_API_TASKS}/{task_id}/style", json=payload, timeout=30)
             if rr.ok:
                 messages.success(request, "样式已保存到后端（数据库）并将在合成时生效。")
                 return redirect("task_detail", task_id=task_id)
@@ -190,15 +310,16 @@ def task_detail(request, task_id):
                 "tts_gender": request.POST.get("tts_gender") or None,
                 "tts_voice": request.POST.get("tts_voice") or None,
             }
-            vp = (
+            # 音色按任务目标语言 + 所选音色代码查 tts_name；只取这一列，不构造模型实例
+            lang_code = request.POST.get("target_language") or dto.get("target_language")
+            payload["tts_name"] = (
                 VoiceProfile.objects
-                .filter(language_code=lang_code, code=voice_code, enabled=True)
-                .only("tts_name")
+                .filter(language_code=lang_code, code=payload["tts_voice"], enabled=True)
+                .values_list("tts_name", flat=True)
                 .first()
             )
-            payload["tts_name"] = vp.tts_name if vp else None
             payload = {k: v for k, v in payload.items() if v is not None}
-            rr = requests.patch(f"{API}/api/tasks/{task_id}/style", json=payload, timeout=30)
+            rr = SESSION.patch(f"{_API_TASKS}/{task_id}/style", json=payload, timeout=30)
             if rr.ok:
                 messages.success(request, "音色已保存，将在合成时生效。")
                 return redirect("task_detail", task_id=task_id)
@@ -214,7 +335,7 @@ def task_detail(request, task_id):
             "end_time": request.POST["end_time"],
             "translated_text": request.POST["translated_text"].strip(),
         }
-        rr = requests.patch(f"{API}/api/subtitles/{task_id}/{edit_subtitle_id}", json=body, timeout=30)
+        rr = SESSION.patch(f"{API}/api/subtitles/{task_id}/{edit_subtitle_id}", json=body, timeout=30)
         if rr.ok:
             messages.success(request, "字幕编辑成功！")
             return redirect("task_detail", task_id=task_id)
@@ -227,17 +348,11 @@ def task_detail(request, task_id):
     if dt and timezone.is_naive(dt):
         dt = timezone.make_aware(dt, timezone.get_current_timezone())
     dto["created_at"] = dt
-    # ====== 音色 VOICE_BANK：从数据库按语言聚合 ======
-    voices_qs = VoiceProfile.objects.filter(enabled=True).order_by("language_code", "sort_order", "code")
-    voice_bank = {}
-    for v in voices_qs:
-        voice_bank.setdefault(v.language_code, []).append({
-            "code": v.code,
-            "name": v.name,
-            "gender": v.gender,
-            "sample": v.sample_url or "",
-        })
-    voice_bank_json = json.dumps(voice_bank, ensure_ascii=False)
+    # ====== 音色 VOICE_BANK：从数据库按语言聚合（序列化结果走缓存） ======
+    voice_bank_json = cache.get(VOICE_BANK_CACHE_KEY)
+    if voice_bank_json is None:
+        voice_bank_json = _json_dumps(_build_voice_bank())
+        cache.set(VOICE_BANK_CACHE_KEY, voice_bank_json, VOICE_BANK_CACHE_TTL)
     return render(request, "subtitle_processor/task_detail.html", {
         "task": dto,
         "subtitles": dto.get("subtitles", []),
@@ -248,25 +363,25 @@ def task_detail(request, task_id):
 
 @require_POST
 def confirm_translation(request, task_id):
-    r = requests.post(f"{API}/api/tasks/{task_id}/confirm", timeout=15)
+    r = SESSION.post(f"{_API_TASKS}/{task_id}/confirm", timeout=15)
     messages.success(request, "已确认，进入合成队列。" if r.ok else f"失败：{r.text[:200]}")
     return redirect("task_list")
 
 @require_POST
 def refinalize_video(request, task_id):
-    r = requests.post(f"{API}/api/tasks/{task_id}/confirm", timeout=15)
+    r = SESSION.post(f"{_API_TASKS}/{task_id}/confirm", timeout=15)
     messages.success(request, "已提交重新合成。" if r.ok else f"失败：{r.text[:200]}")
     return redirect("task_list")
 
 @require_POST
 def reburn_video(request, task_id):
-    r = requests.post(f"{API}/api/tasks/{task_id}/reburn", timeout=15)
+    r = SESSION.post(f"{_API_TASKS}/{task_id}/reburn", timeout=15)
     messages.success(request, "已提交仅重新合成字幕。" if r.ok else f"失败：{r.text[:200]}")
     return redirect("task_list")
 
 @require_POST
 def restart_task(request, task_id):
-    r = requests.post(f"{API}/api/tasks/{task_id}/restart", timeout=15)
+    r = SESSION.post(f"{_API_TASKS}/{task_id}/restart", timeout=15)
     messages.success(request, "已重新开始阶段一。" if r.ok else f"失败：{r.text[:200]}")
     return redirect("task_list")
 
@@ -282,9 +397,9 @@ def stop_task(request, task_id):
     """
     log.info(f"stop task {task_id}")
     try:
-        resp = requests.post(f"{API}/api/tasks/{task_id}/stop", timeout=20)
+        resp = SESSION.post(f"{_API_TASKS}/{task_id}/stop", timeout=20)
         if resp.ok:
-            dto = resp.json()
+            dto = _json_loads(resp.content)
             st = dto.get("status")
             msg = dto.get("msg") or ""
             if st == "REVIEW":
@@ -296,7 +411,7 @@ def stop_task(request, task_id):
         else:
             detail = ""
             try:
-                detail = (resp.json().get("detail") or "").strip()
+                detail = (_json_loads(resp.content).get("detail") or "").strip()
             except Exception:
                 pass
             if not detail:
@@ -316,14 +431,14 @@ def delete_task(request, task_id):
     前端仅根据返回结果提示用户，无需再本地删除文件或操作本地数据库。
     """
     try:
-        resp = requests.delete(f"{API}/api/tasks/{task_id}", timeout=15)
+        resp = SESSION.delete(f"{_API_TASKS}/{task_id}", timeout=15)
         if resp.ok:
             messages.success(request, "任务已删除。")
         else:
             # 优先取后端的 detail 文本（FastAPI 常见返回）
             detail = ""
             try:
-                detail = (resp.json().get("detail") or "").strip()
+                detail = (_json_loads(resp.content).get("detail") or "").strip()
             except Exception:
                 pass
             if not detail: